@@ -1,14 +1,36 @@
 import json
-import numpy as np
-from flask import Flask, request, jsonify
+import os
+import shutil
+
+from itertools import chain
+
+import click
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
-from tqdm import tqdm
+from prometheus_client import CONTENT_TYPE_LATEST
 
+from config.config import (INDEX_ALIAS, KNN_K, KNN_NUM_CANDIDATES, LOCAL_IVF_LISTS, SEARCH_BATCH_MAX_QUERIES,
+                           SEARCH_MODE, VECTOR_COMPRESSION_FIT_SAMPLE, VECTOR_COMPRESSION_PATH, VECTOR_STORE_DIR,
+                           VECTOR_STORE_DTYPE)
 from elasticsearch_client import ElasticsearchClient
-from indexing.elasticsearch_index import ElasticsearchIndex
-from search.semantic import SemanticSearch
+from indexing.elasticsearch_index import ElasticsearchIndex, current_index, swap_alias, versioned_index_name
+from indexing.pipeline import Checkpoint, IndexingPipeline, iter_documents, sample_documents
+from indexing.vector_compression import DEFAULT_OPTIONS, VectorCompressor, fit_compressor
+from monitoring.metrics import exposition, request_timing
+from preprocessing.batcher import EmbeddingBatcher
+from preprocessing.embedding_cache import EmbeddingCache
+from preprocessing.embeddings import BioBertEmbedding
+from preprocessing.model_registry import BACKENDS, ModelRegistry
+from search.evaluation import compare_retrieval_modes, compare_vector_options as compare_compression_options
+from search.local_engine import LocalSemanticSearch, build_ivf_indexes, local_engine_for
+from search.facets import parse_categories
+from search.index_state import IndexState
+from search.result_cache import ResultCache
+from search.semantic import SemanticSearch, format_search_response
+from search.vector_store import VectorStore, VectorStoreWriter, build_path, publish_store
 app = Flask(__name__)
-CORS(app)
+# X-Timing is readable by browser clients that ask for it
+CORS(app, expose_headers=["X-Timing"])
 
 # route for health ES client heathcheck
 @app.route("/healthcheck", methods=['GET'])
@@ -16,25 +38,68 @@ def healthcheck():
     try:
         es_client = ElasticsearchClient.get_client()
         health = es_client.cluster.health()
-        return jsonify({"status": "OK", "elasticsearch": health}), 200
+        cache = EmbeddingCache.shared()
+        batcher = EmbeddingBatcher._shared
+        result_cache = ResultCache._shared
+        # Under serve.py the cache and batcher figures are those of the worker with this pid
+        return jsonify({"status": "OK", "elasticsearch": health, "pid": os.getpid(),
+                        "models": ModelRegistry.stats(),
+                        "embedding_cache": cache.stats() if cache else None,
+                        "embedding_batcher": batcher.stats() if batcher else None,
+                        "result_cache": result_cache.stats() if result_cache else None}), 200
     except Exception as e:
         return jsonify({"status": "Error", "message": str(e)}), 500
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    # Prometheus text exposition format
+    return exposition(), 200, {"Content-Type": CONTENT_TYPE_LATEST}
+
 @app.route('/document/<doc_id>', methods=["GET"])
 def get_document(doc_id):
     try:
+        engine = local_engine_for()
+        if engine is not None:
+            source = engine.get_document(doc_id)
+            if source is None:
+                return jsonify({"error": f"Document '{doc_id}' not found"}), 404
+            return jsonify(source)
         # Fetch the document by ID from the specified index
-        response = ElasticsearchClient.get_client().get(index="pubmed-tja-v2", id=doc_id)
+        response = ElasticsearchClient.get_client().get(index=INDEX_ALIAS, id=doc_id)
         return jsonify(response['_source'])  # Return only the document source
     except Exception as e:
+        fallback = local_engine_for(e)
+        source = fallback.get_document(doc_id) if fallback is not None else None
+        if source is not None:
+            return jsonify(source)
         # Handle errors (e.g., document not found or index does not exist)
         return jsonify({"error": str(e)}), 404
 
 
+@app.route("/facets", methods=["GET"])
+def facets():
+    """Entity facets of the whole corpus, counted at index time."""
+    try:
+        engine = local_engine_for()
+        if engine is None:
+            try:
+                state = IndexState.shared(INDEX_ALIAS).refresh(ElasticsearchClient.get_client())
+                global_facets = state.global_facets()
+                if global_facets is None:
+                    return jsonify({"error": f"{state.index_name} has no recorded facets; run create-index"}), 404
+                return jsonify(dict(global_facets, version=state.version, engine="elasticsearch"))
+            except Exception as e:
+                engine = local_engine_for(e)
+                if engine is None:
+                    raise
+        engine.sync()
+        return jsonify(dict(engine.global_facets(), engine="local"))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/search', methods=['POST'])
 def search():
-    search = SemanticSearch(ElasticsearchClient.get_client(),
-                            "pubmed-tja-v2")
     try:
         # Extract the user query from the request
         data = request.json
@@ -43,51 +108,295 @@ def search():
         if not user_query:
             return jsonify({"error": "Query parameter is missing"}), 400
 
-        response = search.execute_semantic_search(user_query)
-        hits = response.get("hits", {}).get("hits", [])
-    
-        # Format the results
-        results = [
-            {
-                "id": hit["_id"],
-                "score": hit["_score"],
-                "source": hit["_source"]
-            } for hit in hits
-        ]
-
-        return jsonify({
-            "total_results": response.get("hits").get("total", {}).get("value", 0),
-            "returned_results": len(hits),
-            "query": user_query, 
-            "results": results, 
-            "agg_data": response.get("aggregations")
-        })
+        mode = data.get("mode", SEARCH_MODE)
+        if mode not in ("ann", "exact"):
+            return jsonify({"error": "mode must be 'ann' or 'exact'"}), 400
+        try:
+            # Narrow to these CATEGORY entities before scoring
+            categories = parse_categories(data.get("categories"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        engine = local_engine_for()
+        search = LocalSemanticSearch(engine) if engine is not None else \
+            SemanticSearch(ElasticsearchClient.get_client(), INDEX_ALIAS)
+        with request_timing() as timing:
+            try:
+                response = search.execute_semantic_search(user_query, mode=mode, categories=categories)
+            except Exception as e:
+                engine = local_engine_for(e)
+                if engine is None:
+                    raise
+                search = LocalSemanticSearch(engine)
+                response = search.execute_semantic_search(user_query, mode=mode, categories=categories)
+        result = jsonify(format_search_response(user_query, response, search.last_prf_stats,
+                                                "local" if engine is not None else "elasticsearch"))
+        # Per-stage breakdown for clients that send an X-Timing request header
+        if request.headers.get("X-Timing") and timing.stages:
+            result.headers["X-Timing"] = timing.header()
+        return result
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def batch_line(query, response, prf_stats, engine):
+    if "error" in response:
+        item = {"query": query, "error": response["error"], "status": response.get("status")}
+    else:
+        item = format_search_response(query, response, prf_stats, engine)
+    return json.dumps(item) + "\n"
+
+
+def batch_lines(queries, items, engine):
+    sent = 0
+    try:
+        for query, response, prf_stats in items:
+            yield batch_line(query, response, prf_stats, engine)
+            sent += 1
+    except Exception as e:
+        # The status line is out: fail the queries left instead of cutting the stream short
+        for query in queries[sent:]:
+            yield batch_line(query, {"error": str(e), "status": 500}, None, engine)
+
+
+@app.route('/search/batch', methods=['POST'])
+def search_batch():
+    """
+    Search a list of queries at once. Every line of the NDJSON response is
+    what /search returns for one query, in query order, streamed as soon
+    as that query's results are back.
+    """
+    try:
+        data = request.json
+        queries = data.get("queries")
+
+        if not isinstance(queries, list) or not queries or \
+                not all(isinstance(query, str) and query for query in queries):
+            return jsonify({"error": "queries must be a non-empty list of non-empty strings"}), 400
+        if len(queries) > SEARCH_BATCH_MAX_QUERIES:
+            return jsonify({"error": f"At most {SEARCH_BATCH_MAX_QUERIES} queries per batch"}), 400
+
+        mode = data.get("mode", SEARCH_MODE)
+        if mode not in ("ann", "exact"):
+            return jsonify({"error": "mode must be 'ann' or 'exact'"}), 400
+        try:
+            # Narrow to these CATEGORY entities before scoring
+            categories = parse_categories(data.get("categories"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        engine = local_engine_for()
+        search = LocalSemanticSearch(engine) if engine is not None else \
+            SemanticSearch(ElasticsearchClient.get_client(), INDEX_ALIAS)
+        with request_timing() as timing:
+            try:
+                items = iter(search.execute_semantic_search_batch(queries, mode=mode, categories=categories))
+                # Fail (or fall back) before the 200 status line goes out
+                first = next(items)
+            except Exception as e:
+                engine = local_engine_for(e)
+                if engine is None:
+                    raise
+                items = iter(LocalSemanticSearch(engine).execute_semantic_search_batch(queries, mode=mode,
+                                                                                      categories=categories))
+                first = next(items)
+        result = Response(batch_lines(queries, chain([first], items),
+                                      "local" if engine is not None else "elasticsearch"),
+                          mimetype="application/x-ndjson")
+        if request.headers.get("X-Timing") and timing.stages:
+            result.headers["X-Timing"] = timing.header()
+        return result
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @app.cli.command()
-def create_index():
-    """Create or re-create the Elasticsearch index."""
+@click.option("--path", default="data/PubMedData/pubmed-tja.ndjson", show_default=True,
+              help="JSON array or NDJSON file with the documents to index.")
+@click.option("--sample", type=int, default=None,
+              help="Index a random sample of N documents instead of the full corpus.")
+@click.option("--batch-size", default=32, show_default=True, help="Documents per embedding/NER batch.")
+@click.option("--chunk-size", default=500, show_default=True, help="Documents per bulk request.")
+@click.option("--embed-workers", default=1, show_default=True)
+@click.option("--ner-workers", default=1, show_default=True)
+@click.option("--ner-processes", default=1, show_default=True,
+              help="Run NER in this many worker processes instead of threads when greater than 1.")
+@click.option("--terms-workers", default=1, show_default=True)
+@click.option("--bulk-threads", default=1, show_default=True,
+              help="Use parallel_bulk with this many threads when greater than 1.")
+@click.option("--rebuild", is_flag=True,
+              help="Build a new versioned index and swap the alias to it once it is loaded, "
+                   "instead of updating the current index in place.")
+@click.option("--keep-old", is_flag=True, help="Keep the previous index and vector store after a rebuild.")
+@click.option("--resume/--no-resume", default=True, show_default=True,
+              help="Continue from the checkpoint of an interrupted run.")
+def create_index(path, sample, batch_size, chunk_size, embed_workers, ner_workers, ner_processes,
+                 terms_workers, bulk_threads, rebuild, keep_old, resume):
+    """Index new and changed documents, or rebuild the index behind the alias."""
      # Create elasticsearch connection
     es_client = ElasticsearchClient.get_client()
+    checkpoint_path = path + ".checkpoint"
+
+    checkpoint = Checkpoint(checkpoint_path)
+    live_index = current_index(es_client, INDEX_ALIAS)
+    if resume and checkpoint.index_name and not (rebuild and checkpoint.index_name == live_index):
+        # Pick up the interrupted run, in the index it was writing to
+        index_name = checkpoint.index_name
+    else:
+        checkpoint.clear()
+        index_name = versioned_index_name(INDEX_ALIAS) if rebuild or live_index is None else live_index
+    building = index_name != live_index
+    resuming = checkpoint.done > 0
+
+    compressor = VectorCompressor.from_config()
+    if not building:
+        # Documents added in place must be encoded like the ones already there
+        meta = es_client.indices.get_mapping(index=index_name)[index_name]["mappings"].get("_meta", {})
+        indexed_with = meta.get("vector_compression", {}).get("name", compressor.name)
+        if indexed_with != compressor.name:
+            raise click.ClickException(f"{index_name} was indexed with vector compression {indexed_with}, "
+                                       f"config.py now asks for {compressor.name}: run with --rebuild.")
+    # A rebuild keeps its PCA projection next to the live one until the alias swap
+    compression_path = f"{VECTOR_COMPRESSION_PATH}.{index_name}" if building else VECTOR_COMPRESSION_PATH
+    es_index = ElasticsearchIndex(es_client, index_name, compressor=compressor)
+    if compressor.needs_fit:
+        if not building or resuming:
+            compressor.load(compression_path)
+        else:
+            fit_compressor(compressor, es_index.embedder,
+                           sample_documents(iter_documents(path), VECTOR_COMPRESSION_FIT_SAMPLE),
+                           batch_size=batch_size)
+            compressor.save(compression_path)
 
-    # Build index
-    with open("data/PubMedData/pubmed-tja.json", "r") as f:
-        data = json.load(f)
+    pipeline = IndexingPipeline(es_index, batch_size=batch_size, chunk_size=chunk_size,
+                                embed_workers=embed_workers, ner_workers=ner_workers,
+                                ner_processes=ner_processes,
+                                terms_workers=terms_workers,
+                                bulk_threads=bulk_threads, checkpoint_path=checkpoint_path,
+                                skip_unchanged=not building)
+    pipeline.checkpoint.index_name = index_name
+    if building and not resuming:
+        es_index.create_index(drop=True)
+    store_path = None
+    if VECTOR_STORE_DIR:
+        store_path = build_path(VECTOR_STORE_DIR, index_name) if building else VECTOR_STORE_DIR
+        # Document sources make the store usable by the local search engine
+        pipeline.vector_store = VectorStoreWriter(store_path, dtype=VECTOR_STORE_DTYPE,
+                                                  reset=building and not resuming, sources=True)
 
-    data_samples = np.random.choice(data, 5000, replace=False)
-    index_name = "pubmed-tja-v2"
+    documents = iter_documents(path)
+    if sample:
+        documents = sample_documents(documents, sample)
 
-    es_index = ElasticsearchIndex(es_client, index_name)
-    es_index.create_index(drop=True)
+    # Replicas only go down on an index that is not serving searches yet
+    with es_index.bulk_load_settings(replicas=building):
+        report = pipeline.run(documents)
+    if not report["failed"]:
+        # Kept otherwise, so the next run resumes at the first failed document
+        pipeline.checkpoint.clear()
+    # Corpus-wide facet counts, read by searches from the index _meta
+    report["entity_facets"] = es_index.record_global_facets()
+    if store_path and LOCAL_IVF_LISTS:
+        report["ivf"] = build_ivf_indexes(store_path, LOCAL_IVF_LISTS)
+
+    if building and report["failed"]:
+        # A rebuild missing documents must not replace the complete index
+        serving = f"still points to {live_index}" if live_index else "was not created"
+        print(f"{report['failed']} documents failed: alias '{INDEX_ALIAS}' {serving}. Run create-index "
+              f"with the same --path again to resume into {index_name} before it goes live.")
+    elif building:
+        report["replaced"] = swap_alias(es_client, INDEX_ALIAS, index_name, delete_old=not keep_old)
+        if compressor.needs_fit:
+            os.replace(compression_path, VECTOR_COMPRESSION_PATH)
+        if store_path:
+            previous_store = publish_store(VECTOR_STORE_DIR, store_path)
+            if previous_store and not keep_old:
+                shutil.rmtree(previous_store)
+        print(f"Alias '{INDEX_ALIAS}' now points to {index_name}.")
+    IndexState.shared(INDEX_ALIAS).invalidate()
+
+    print(json.dumps(report, indent=2))
+    print(f"Successfully indexed {report['indexed']} documents into index: {index_name} "
+          f"({report['unchanged']} unchanged).")
+
+
+@app.cli.command()
+@click.option("--queries", "queries_path", required=True, type=click.Path(exists=True),
+              help="Text file with one query per line.")
+@click.option("--k", default=50, show_default=True, help="Cut-off for recall@k.")
+@click.option("--knn-k", default=KNN_K, show_default=True)
+@click.option("--num-candidates", default=KNN_NUM_CANDIDATES, show_default=True)
+def compare_retrieval(queries_path, k, knn_k, num_candidates):
+    """Report recall@k and latency of ANN retrieval against exact scoring."""
+    with open(queries_path, "r") as f:
+        queries = [line.strip() for line in f if line.strip()]
 
-    for doc in tqdm(data_samples):
-        es_index.insert_doc(doc)
+    search = SemanticSearch(ElasticsearchClient.get_client(), INDEX_ALIAS)
+    report = compare_retrieval_modes(search, queries, k=k, knn_k=knn_k, num_candidates=num_candidates)
+    print(json.dumps(report, indent=2))
+
+
+@app.cli.command()
+@click.option("--queries", "queries_path", required=True, type=click.Path(exists=True),
+              help="Text file with one query per line.")
+@click.option("--option", "options", multiple=True,
+              help="Compression to compare as reduction:dims:element_type:index_type, e.g. "
+                   "pca:256:float:int8_hnsw (repeatable; the first is the baseline).")
+@click.option("--k", default=10, show_default=True, help="Cut-off for recall@k.")
+@click.option("--num-candidates", default=100, show_default=True)
+@click.option("--fit-sample", default=VECTOR_COMPRESSION_FIT_SAMPLE, show_default=True,
+              help="Document vectors PCA options are fitted on.")
+@click.option("--keep-indices", is_flag=True, help="Keep the scratch indices for inspection.")
+def compare_vector_options(queries_path, options, k, num_candidates, fit_sample, keep_indices):
+    """Report recall@k, index size and latency of compact vector options against full precision."""
+    with open(queries_path, "r") as f:
+        queries = [line.strip() for line in f if line.strip()]
+
+    store = VectorStore.shared()
+    if store is None:
+        raise click.ClickException("The comparison indexes the vector store; run create-index first.")
+    query_vectors = BioBertEmbedding().generate_embeddings(queries)
+    report = compare_compression_options(ElasticsearchClient.get_client(), store, query_vectors,
+                                         list(options) or list(DEFAULT_OPTIONS), k=k,
+                                         num_candidates=num_candidates, fit_sample=fit_sample,
+                                         keep_indices=keep_indices)
+    print(json.dumps(report, indent=2))
+
+
+@app.cli.command()
+@click.option("--lists", type=int, default=LOCAL_IVF_LISTS,
+              help="IVF lists per vector field (defaults to 4 * sqrt(documents)).")
+def build_local_index(lists):
+    """Build the IVF indexes the local search engine uses for approximate search."""
+    print(json.dumps(build_ivf_indexes(VECTOR_STORE_DIR, lists), indent=2))
+
+
+@app.cli.command()
+@click.option("--path", default="data/PubMedData/pubmed-tja.ndjson", show_default=True,
+              help="JSON array or NDJSON file whose abstracts are embedded.")
+@click.option("--sample", default=256, show_default=True, help="Number of abstracts to embed.")
+@click.option("--backend", "backends", multiple=True, type=click.Choice(BACKENDS),
+              help="Backend to compare against the reference (repeatable, defaults to all).")
+@click.option("--batch-size", default=32, show_default=True)
+@click.option("--threads", type=int, default=None, help="torch intra-op threads.")
+@click.option("--repeats", default=3, show_default=True)
+def compare_backends(path, sample, backends, batch_size, threads, repeats):
+    """Report parity, throughput and peak memory of the BioBERT inference backends."""
+    # Imports torch, which the serving endpoints and the other commands load only on first use
+    from preprocessing.inference_backends import compare_backends as compare_inference_backends
 
-    print(f"Successfully indexed {len(data_samples)} into index: {index_name}.")
+    texts = [doc["abstract"] for doc in sample_documents(iter_documents(path), sample)]
+    report = compare_inference_backends(texts, backends=backends or BACKENDS, batch_size=batch_size,
+                                        num_threads=threads, repeats=repeats)
+    print(json.dumps(report, indent=2))
 
 
 if __name__ == "__main__":
-    app.run(port=3000, debug=True)
+    # Development server; serve.py is the pre-fork mode for production
+    # Load and warm up every model once, before the first request arrives
+    # Expansion terms are precomputed at index time, so serving needs no ScispaCy model
+    ModelRegistry.warm_up(spacy_models=())
+    # The reloader would start a second process and load the models again
+    app.run(port=3000, debug=True, use_reloader=False)
@@ -0,0 +1,325 @@
+"""
+asyncio-native serving mode with the same /search, /search/batch, /facets,
+/document/<id> and /healthcheck contracts as app.py.
+
+Run it with any ASGI server, e.g.:
+
+    uvicorn asgi:app --port 3000
+
+Elasticsearch is reached through one pooled AsyncElasticsearch client. Model
+inference and everything else that blocks (the local engine, its file reads
+and the vector store refresh) runs on a bounded thread pool, so the event
+loop only ever waits on sockets.
+"""
+import json
+
+from collections.abc import AsyncIterator
+
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from config.config import (ASYNC_INFERENCE_MAX_PENDING, ASYNC_INFERENCE_WORKERS, INDEX_ALIAS,
+                           SEARCH_BATCH_MAX_QUERIES, SEARCH_MODE)
+from elasticsearch_client import ElasticsearchClient
+from monitoring.metrics import exposition, request_timing
+from preprocessing.batcher import EmbeddingBatcher
+from preprocessing.embedding_cache import EmbeddingCache
+from preprocessing.model_registry import ModelRegistry
+from search.async_semantic import AsyncSemanticSearch, InferenceExecutor
+from search.facets import parse_categories
+from search.index_state import IndexState
+from search.local_engine import LocalSemanticSearch, local_engine_for
+from search.result_cache import ResultCache
+from search.semantic import format_search_response
+
+# Reads go through the alias, so a rebuilt index is picked up without a restart
+INDEX_NAME = INDEX_ALIAS
+
+# Created on startup, inside the server's event loop
+state = {}
+
+
+async def startup():
+    executor = InferenceExecutor(max_workers=ASYNC_INFERENCE_WORKERS,
+                                 max_pending=ASYNC_INFERENCE_MAX_PENDING)
+    # Expansion terms are precomputed at index time, so serving needs no ScispaCy model
+    await executor.run(ModelRegistry.warm_up, spacy_models=())
+    state["executor"] = executor
+    state["search"] = await executor.run(AsyncSemanticSearch, ElasticsearchClient.get_async_client(),
+                                         INDEX_NAME, executor)
+
+
+async def shutdown():
+    await ElasticsearchClient.get_async_client().close()
+    state["executor"].shutdown()
+
+
+async def healthcheck(request):
+    try:
+        health = await ElasticsearchClient.get_async_client().cluster.health()
+        # Opens (and on first use creates) the cache files
+        cache = await run_blocking(EmbeddingCache.shared)
+        batcher = EmbeddingBatcher._shared
+        result_cache = ResultCache._shared
+        return 200, {"status": "OK", "elasticsearch": health.body,
+                     "models": ModelRegistry.stats(),
+                     "embedding_cache": cache.stats() if cache else None,
+                     "embedding_batcher": batcher.stats() if batcher else None,
+                     "result_cache": result_cache.stats() if result_cache else None}
+    except Exception as e:
+        return 500, {"status": "Error", "message": str(e)}
+
+
+async def run_blocking(fn, *args, **kwargs):
+    # Opening the local engine reads the vector store and IVF files from disk
+    return await state["executor"].run(fn, *args, **kwargs)
+
+
+async def get_document(request, doc_id):
+    try:
+        engine = await run_blocking(local_engine_for)
+        if engine is not None:
+            source = await run_blocking(engine.get_document, doc_id)
+            return (200, source) if source is not None else (404, {"error": f"Document '{doc_id}' not found"})
+        # Fetch the document by ID from the specified index
+        response = await ElasticsearchClient.get_async_client().get(index=INDEX_NAME, id=doc_id)
+        return 200, response["_source"]  # Return only the document source
+    except Exception as e:
+        fallback = await run_blocking(local_engine_for, e)
+        source = await run_blocking(fallback.get_document, doc_id) if fallback is not None else None
+        if source is not None:
+            return 200, source
+        # Handle errors (e.g., document not found or index does not exist)
+        return 404, {"error": str(e)}
+
+
+async def facets(request):
+    try:
+        engine = await run_blocking(local_engine_for)
+        if engine is None:
+            try:
+                index_state = await IndexState.shared(INDEX_NAME).refresh_async(
+                    ElasticsearchClient.get_async_client())
+                global_facets = index_state.global_facets()
+                if global_facets is None:
+                    return 404, {"error": f"{index_state.index_name} has no recorded facets; run create-index"}
+                return 200, dict(global_facets, version=index_state.version, engine="elasticsearch")
+            except Exception as e:
+                engine = await run_blocking(local_engine_for, e)
+                if engine is None:
+                    raise
+        await run_blocking(engine.sync)
+        return 200, dict(await run_blocking(engine.global_facets), engine="local")
+    except Exception as e:
+        return 500, {"error": str(e)}
+
+
+async def search(request):
+    try:
+        data = json.loads(request["body"] or b"{}")
+        user_query = data.get("query", "")
+
+        if not user_query:
+            return 400, {"error": "Query parameter is missing"}
+
+        mode = data.get("mode", SEARCH_MODE)
+        if mode not in ("ann", "exact"):
+            return 400, {"error": "mode must be 'ann' or 'exact'"}
+        try:
+            # Narrow to these CATEGORY entities before scoring
+            categories = parse_categories(data.get("categories"))
+        except ValueError as e:
+            return 400, {"error": str(e)}
+
+        with request_timing() as timing:
+            engine = await run_blocking(local_engine_for)
+            if engine is None:
+                try:
+                    response, prf_stats = await state["search"].execute_semantic_search_async(
+                        user_query, mode=mode, categories=categories)
+                except Exception as e:
+                    engine = await run_blocking(local_engine_for, e)
+                    if engine is None:
+                        raise
+            if engine is not None:
+                # Pure in-process work: run it off the event loop
+                local_search = await run_blocking(LocalSemanticSearch, engine)
+                response = await run_blocking(local_search.execute_semantic_search, user_query,
+                                              mode=mode, categories=categories)
+                prf_stats = local_search.last_prf_stats
+        if request["headers"].get(b"x-timing") and timing.stages:
+            request["response_headers"].append((b"x-timing", timing.header().encode("ascii")))
+        return 200, format_search_response(user_query, response, prf_stats,
+                                           "local" if engine is not None else "elasticsearch")
+
+    except Exception as e:
+        return 500, {"error": str(e)}
+
+
+def batch_line(query, response, prf_stats, engine):
+    if "error" in response:
+        item = {"query": query, "error": response["error"], "status": response.get("status")}
+    else:
+        item = format_search_response(query, response, prf_stats, engine)
+    return (json.dumps(item) + "\n").encode("utf-8")
+
+
+async def blocking_items(iterator):
+    """
+    Step a blocking generator on the executor, one item at a time.
+    """
+    done = object()
+    while True:
+        item = await run_blocking(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+async def batch_lines(queries, first, items, engine):
+    sent = 0
+    try:
+        yield batch_line(*first, engine)
+        sent += 1
+        async for item in items:
+            yield batch_line(*item, engine)
+            sent += 1
+    except Exception as e:
+        # The status line is out: fail the queries left instead of cutting the stream short
+        for query in queries[sent:]:
+            yield batch_line(query, {"error": str(e), "status": 500}, None, engine)
+
+
+async def search_batch(request):
+    try:
+        data = json.loads(request["body"] or b"{}")
+        queries = data.get("queries")
+
+        if not isinstance(queries, list) or not queries or \
+                not all(isinstance(query, str) and query for query in queries):
+            return 400, {"error": "queries must be a non-empty list of non-empty strings"}
+        if len(queries) > SEARCH_BATCH_MAX_QUERIES:
+            return 400, {"error": f"At most {SEARCH_BATCH_MAX_QUERIES} queries per batch"}
+
+        mode = data.get("mode", SEARCH_MODE)
+        if mode not in ("ann", "exact"):
+            return 400, {"error": "mode must be 'ann' or 'exact'"}
+        try:
+            # Narrow to these CATEGORY entities before scoring
+            categories = parse_categories(data.get("categories"))
+        except ValueError as e:
+            return 400, {"error": str(e)}
+
+        with request_timing() as timing:
+            engine = await run_blocking(local_engine_for)
+            if engine is None:
+                items = state["search"].execute_semantic_search_batch_async(queries, mode=mode,
+                                                                           categories=categories)
+                try:
+                    # Fail (or fall back) before the 200 status line goes out
+                    first = await items.__anext__()
+                except Exception as e:
+                    engine = await run_blocking(local_engine_for, e)
+                    if engine is None:
+                        raise
+            if engine is not None:
+                local_search = await run_blocking(LocalSemanticSearch, engine)
+                items = blocking_items(local_search.execute_semantic_search_batch(queries, mode=mode,
+                                                                                  categories=categories))
+                first = await items.__anext__()
+        if request["headers"].get(b"x-timing") and timing.stages:
+            request["response_headers"].append((b"x-timing", timing.header().encode("ascii")))
+        return 200, batch_lines(queries, first, items, "local" if engine is not None else "elasticsearch")
+
+    except Exception as e:
+        return 500, {"error": str(e)}
+
+
+async def route(request):
+    method, path = request["method"], request["path"]
+    if path == "/healthcheck" and method == "GET":
+        return await healthcheck(request)
+    if path.startswith("/document/") and method == "GET":
+        return await get_document(request, path[len("/document/"):])
+    if path == "/facets" and method == "GET":
+        return await facets(request)
+    if path == "/metrics" and method == "GET":
+        return 200, exposition()
+    if path == "/search" and method == "POST":
+        return await search(request)
+    if path == "/search/batch" and method == "POST":
+        return await search_batch(request)
+    return 404, {"error": "Not found"}
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            return body
+
+
+async def send_response(send, status, payload, extra_headers=()):
+    if isinstance(payload, AsyncIterator):
+        # NDJSON lines, sent one body chunk each as soon as they are ready
+        headers = [
+            (b"content-type", b"application/x-ndjson"),
+            (b"access-control-allow-origin", b"*"),
+            (b"access-control-expose-headers", b"X-Timing")
+        ]
+        await send({"type": "http.response.start", "status": status, "headers": headers + list(extra_headers)})
+        async for line in payload:
+            await send({"type": "http.response.body", "body": line, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+        return
+    if isinstance(payload, bytes):
+        # Prometheus text exposition format
+        body, content_type = payload, CONTENT_TYPE_LATEST.encode("ascii")
+    else:
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        content_type = b"application/json"
+    headers = [
+        (b"content-type", content_type),
+        (b"content-length", str(len(body)).encode("ascii")),
+        # Same permissive CORS policy as flask_cors in app.py
+        (b"access-control-allow-origin", b"*"),
+        (b"access-control-expose-headers", b"X-Timing")
+    ]
+    await send({"type": "http.response.start", "status": status, "headers": headers + list(extra_headers)})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await startup()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    if scope["method"] == "OPTIONS":
+        # CORS preflight
+        return await send_response(send, 204, None, [
+            (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+            (b"access-control-allow-headers", b"Content-Type, X-Timing")
+        ])
+
+    request = {"method": scope["method"], "path": scope["path"], "body": await read_body(receive),
+               "headers": dict(scope.get("headers", [])), "response_headers": []}
+    status, payload = await route(request)
+    await send_response(send, status, payload, request["response_headers"])
@@ -0,0 +1,533 @@
+"""
+In-process stand-in for the Elasticsearch REST API, for benchmarks that must
+run without a cluster.
+
+It plugs into the real client as a transport node, so requests still go
+through elasticsearch-py (serialisation, the bulk helpers, response
+decoding and the content-length header) and only the network and the
+cluster are replaced. It implements the subset of the API this repo uses:
+index management (aliases, settings, mappings and an estimated store size
+in _stats), index/get/mget/bulk and searches (single or _msearch) built from
+match_all, ids, term(s), nested, knn, bool and cosineSimilarity script_score
+queries with nested terms aggregations.
+"""
+import json
+import re
+import threading
+import time
+
+from collections import Counter
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from elastic_transport import ApiResponseMeta, BaseAsyncNode, BaseNode, HttpHeaders
+from elastic_transport._node import NodeApiResponse
+from elasticsearch import AsyncElasticsearch, Elasticsearch
+
+SCRIPT_PATTERN = re.compile(r"^cosineSimilarity\(params\.query_vector, '([\w.]+)'\) \+ ([\d.]+)$")
+
+
+class RequestError(Exception):
+    def __init__(self, status, error_type, reason):
+        super().__init__(reason)
+        self.status = status
+        self.error_type = error_type
+        self.reason = reason
+
+    def payload(self):
+        return {"error": {"type": self.error_type, "reason": self.reason}, "status": self.status}
+
+
+class FakeIndex:
+    def __init__(self, name, body):
+        self.name = name
+        self.body = body or {}
+        self.settings = {"number_of_shards": "1", "number_of_replicas": "1"}
+        self.settings.update({key: str(value) for key, value in self.body.get("settings", {}).items()})
+        self.docs = {}
+        self._vectors = {}
+
+    def put(self, doc_id, source):
+        self.docs[doc_id] = source
+        self._vectors.clear()
+
+    def vectors(self, field):
+        """
+        Returns:
+            tuple: (doc ids, L2-normalised float32 matrix) of the documents with `field`.
+        """
+        if field not in self._vectors:
+            ids = [doc_id for doc_id, source in self.docs.items() if source.get(field) is not None]
+            matrix = np.array([self.docs[doc_id][field] for doc_id in ids], dtype=np.float32).reshape(len(ids), -1)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            self._vectors[field] = (ids, matrix / np.where(norms == 0, 1, norms))
+        return self._vectors[field]
+
+    def store_size(self):
+        """
+        Estimated on-disk size: JSON size of the non-vector fields plus, per
+        vector, its raw elements, the quantized copy of int8_hnsw/int4_hnsw
+        and the HNSW links. Only meant to compare mapping options.
+        """
+        properties = self.body.get("mappings", {}).get("properties", {})
+        vector_bytes = {}
+        for field, mapping in properties.items():
+            if mapping.get("type") != "dense_vector":
+                continue
+            dims = mapping["dims"]
+            index_options = mapping.get("index_options", {})
+            size = dims * (1 if mapping.get("element_type") == "byte" else 4)
+            size += {"int8_hnsw": dims, "int4_hnsw": dims // 2}.get(index_options.get("type"), 0)
+            vector_bytes[field] = size + 2 * index_options.get("m", 16) * 4
+        total = 0
+        for source in self.docs.values():
+            for field, value in source.items():
+                total += vector_bytes[field] if field in vector_bytes else len(json.dumps(value))
+        return total
+
+
+class FakeCluster:
+    """
+    Holds the indices and answers REST requests. Thread-safe, so it can
+    sit behind parallel_bulk or concurrent searches.
+    """
+    def __init__(self):
+        self.indices = {}
+        # alias -> names of the indices it points to
+        self.aliases = {}
+        self.requests = Counter()
+        self._lock = threading.RLock()
+        self._next_id = 0
+
+    def handle(self, method, path, params, body):
+        """
+        Returns:
+            tuple: (HTTP status, JSON-serialisable payload or None)
+        """
+        parts = [part for part in path.split("/") if part]
+        self.requests[f"{method} {'/'.join(p if p.startswith('_') else '{index}' for p in parts)}"] += 1
+        with self._lock:
+            try:
+                return self._dispatch(method, parts, params, body)
+            except RequestError as e:
+                return e.status, e.payload()
+
+    def _dispatch(self, method, parts, params, body):
+        if parts == ["_cluster", "health"]:
+            return 200, {"cluster_name": "fake", "status": "green",
+                         "number_of_nodes": 1, "active_shards": len(self.indices)}
+        if parts == ["_bulk"]:
+            return 200, self.bulk(None, body)
+        if parts == ["_msearch"]:
+            return 200, self.msearch(None, body, params)
+        if parts == ["_aliases"] and method == "POST":
+            return 200, self.update_aliases(body["actions"])
+        if len(parts) == 2 and parts[0] == "_alias":
+            return self.get_alias(parts[1])
+        if not parts or parts[0].startswith("_"):
+            raise RequestError(400, "illegal_argument_exception", f"Unsupported endpoint /{'/'.join(parts)}")
+
+        name, rest = parts[0], parts[1:]
+        if not rest:
+            if method == "HEAD":
+                return (200 if name in self.indices or name in self.aliases else 404), None
+            if method == "PUT":
+                if name in self.indices:
+                    raise RequestError(400, "resource_already_exists_exception", f"index [{name}] already exists")
+                self.indices[name] = FakeIndex(name, body)
+                return 200, {"acknowledged": True, "shards_acknowledged": True, "index": name}
+            if method == "DELETE":
+                if name not in self.indices:
+                    raise RequestError(404, "index_not_found_exception", f"no such index [{name}]")
+                del self.indices[name]
+                for indices in self.aliases.values():
+                    indices.discard(name)
+                self.aliases = {alias: indices for alias, indices in self.aliases.items() if indices}
+                return 200, {"acknowledged": True}
+        if rest == ["_bulk"]:
+            return 200, self.bulk(name, body)
+        if rest == ["_refresh"]:
+            self.index(name)
+            return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+        if rest == ["_settings"]:
+            index = self.index(name)
+            if method == "PUT":
+                for key, value in body.get("index", body).items():
+                    if value is None:
+                        # null resets a setting to its default
+                        index.settings.pop(key, None)
+                    else:
+                        index.settings[key] = str(value)
+                return 200, {"acknowledged": True}
+            return 200, {index.name: {"settings": {"index": dict(index.settings)}}}
+        if rest == ["_mapping"]:
+            index = self.index(name)
+            mappings = index.body.setdefault("mappings", {})
+            if method == "PUT":
+                if "_meta" in body:
+                    mappings["_meta"] = body["_meta"]
+                mappings.setdefault("properties", {}).update(body.get("properties", {}))
+                return 200, {"acknowledged": True}
+            return 200, {index.name: {"mappings": mappings}}
+        if rest == ["_mget"]:
+            return 200, self.mget(name, body, params)
+        if rest == ["_forcemerge"]:
+            self.index(name)
+            return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+        if rest[0] == "_stats":
+            size = self.index(name).store_size()
+            store = {"store": {"size_in_bytes": size}, "docs": {"count": len(self.index(name).docs)}}
+            return 200, {"_all": {"primaries": store, "total": store}, "indices": {name: {"primaries": store}}}
+        if rest == ["_search"]:
+            return 200, self.search(name, body or {}, params)
+        if rest == ["_msearch"]:
+            return 200, self.msearch(name, body, params)
+        if rest[0] == "_doc":
+            if method in ("PUT", "POST"):
+                return 201, self.put(name, rest[1] if len(rest) > 1 else None, body)
+            if method == "GET" and len(rest) == 2:
+                return self.get(name, rest[1])
+        raise RequestError(400, "illegal_argument_exception", f"Unsupported endpoint {method} /{'/'.join(parts)}")
+
+    def index(self, name):
+        if name in self.aliases:
+            if len(self.aliases[name]) != 1:
+                raise RequestError(400, "illegal_argument_exception",
+                                   f"alias [{name}] points to {len(self.aliases[name])} indices")
+            name = next(iter(self.aliases[name]))
+        if name not in self.indices:
+            raise RequestError(404, "index_not_found_exception", f"no such index [{name}]")
+        return self.indices[name]
+
+    def get_alias(self, alias):
+        if alias not in self.aliases:
+            return 404, {"error": f"alias [{alias}] missing", "status": 404}
+        return 200, {name: {"aliases": {alias: {}}} for name in sorted(self.aliases[alias])}
+
+    def update_aliases(self, actions):
+        # Validated first, then applied together: the update is atomic
+        for action in actions:
+            (op, spec), = action.items()
+            if op not in ("add", "remove"):
+                raise RequestError(400, "illegal_argument_exception", f"Unsupported alias action [{op}]")
+            if spec["index"] not in self.indices:
+                raise RequestError(404, "index_not_found_exception", f"no such index [{spec['index']}]")
+            if op == "remove" and spec["index"] not in self.aliases.get(spec["alias"], ()):
+                raise RequestError(404, "aliases_not_found_exception", f"aliases [{spec['alias']}] missing")
+        for action in actions:
+            (op, spec), = action.items()
+            if op == "add":
+                self.aliases.setdefault(spec["alias"], set()).add(spec["index"])
+            else:
+                self.aliases[spec["alias"]].discard(spec["index"])
+                if not self.aliases[spec["alias"]]:
+                    del self.aliases[spec["alias"]]
+        return {"acknowledged": True}
+
+    def mget(self, name, body, params):
+        index = self.index(name)
+        ids = body.get("ids") or [doc["_id"] for doc in body.get("docs", [])]
+        includes = params["_source"].split(",") if "_source" in params else True
+        docs = []
+        for doc_id in ids:
+            source = index.docs.get(doc_id)
+            if source is None:
+                docs.append({"_index": index.name, "_id": doc_id, "found": False})
+            else:
+                docs.append({"_index": index.name, "_id": doc_id, "found": True,
+                             "_source": self.filter_source(source, includes)})
+        return {"docs": docs}
+
+    def put(self, name, doc_id, source):
+        if name in self.aliases:
+            name = self.index(name).name
+        if name not in self.indices:
+            # Elasticsearch creates missing indices on first write
+            self.indices[name] = FakeIndex(name, {})
+        if doc_id is None:
+            self._next_id += 1
+            doc_id = f"fake-{self._next_id}"
+        result = "updated" if doc_id in self.indices[name].docs else "created"
+        self.indices[name].put(doc_id, source)
+        return {"_index": name, "_id": doc_id, "result": result, "status": 201}
+
+    def get(self, name, doc_id):
+        index = self.index(name)
+        source = index.docs.get(doc_id)
+        if source is None:
+            return 404, {"_index": index.name, "_id": doc_id, "found": False}
+        return 200, {"_index": index.name, "_id": doc_id, "found": True, "_source": source}
+
+    def bulk(self, default_index, lines):
+        start = time.perf_counter()
+        items = []
+        lines = iter(lines)
+        for action in lines:
+            (op_type, meta), = action.items()
+            if op_type == "delete":
+                raise RequestError(400, "illegal_argument_exception", "delete is not supported")
+            source = next(lines)
+            item = self.put(meta.get("_index", default_index), meta.get("_id"), source)
+            items.append({op_type: item})
+        return {"took": int((time.perf_counter() - start) * 1000), "errors": False, "items": items}
+
+    def search(self, name, body, params):
+        start = time.perf_counter()
+        index = self.index(name)
+        scores = self.match(index, body.get("query", {"match_all": {}}))
+        ranked = sorted(scores.items(), key=lambda item: -item[1])
+        offset = int(body.get("from", params.get("from", 0)))
+        size = int(body.get("size", params.get("size", 10)))
+
+        hits = []
+        for doc_id, score in ranked[offset:offset + size]:
+            hits.append({"_index": index.name, "_id": doc_id, "_score": score,
+                         "_source": self.filter_source(index.docs[doc_id], body.get("_source", True))})
+        response = {
+            "took": int((time.perf_counter() - start) * 1000),
+            "timed_out": False,
+            "hits": {
+                "total": {"value": len(ranked), "relation": "eq"},
+                "max_score": ranked[0][1] if ranked else None,
+                "hits": hits
+            }
+        }
+        if "aggs" in body or "aggregations" in body:
+            matched = [index.docs[doc_id] for doc_id, _ in ranked]
+            response["aggregations"] = self.aggregate(matched, body.get("aggs", body.get("aggregations")), "")
+        return response
+
+    def msearch(self, default_index, lines, params):
+        start = time.perf_counter()
+        responses = []
+        for header, body in zip(lines[::2], lines[1::2]):
+            try:
+                response = self.search(header.get("index", default_index), body, params)
+                response["status"] = 200
+            except RequestError as e:
+                response = dict(e.payload(), status=e.status)
+            responses.append(response)
+        return {"took": int((time.perf_counter() - start) * 1000), "responses": responses}
+
+    @staticmethod
+    def filter_source(source, includes):
+        if includes is True:
+            return source
+        if includes is False:
+            return {}
+        if isinstance(includes, str):
+            includes = [includes]
+        return {field: value for field, value in source.items() if field in includes}
+
+    def match(self, index, query):
+        """
+        Returns:
+            dict: Score per matching document id.
+        """
+        (query_type, spec), = query.items()
+        if query_type == "match_all":
+            return {doc_id: 1.0 for doc_id in index.docs}
+        if query_type == "ids":
+            return {doc_id: 1.0 for doc_id in spec["values"] if doc_id in index.docs}
+        if query_type in ("term", "terms"):
+            (field, value), = ((k, v) for k, v in spec.items() if k != "boost")
+            values = set(value if query_type == "terms" else [value.get("value") if isinstance(value, dict) else value])
+            return {doc_id: 1.0 for doc_id, source in index.docs.items()
+                    if values & set(self.field_values(source, field))}
+        if query_type == "nested":
+            path = spec["path"]
+            return {doc_id: 1.0 for doc_id, source in index.docs.items()
+                    if any(self.match_object(obj, spec["query"], path) for obj in source.get(path) or [])}
+        if query_type == "knn":
+            return self.knn(index, spec)
+        if query_type == "bool":
+            return self.bool(index, spec)
+        if query_type == "script_score":
+            return self.script_score(index, spec)
+        raise RequestError(400, "parsing_exception", f"Unsupported query [{query_type}]")
+
+    def match_object(self, obj, query, path):
+        # Only term-level queries are supported inside nested queries
+        (query_type, spec), = query.items()
+        if query_type == "bool":
+            clauses = spec.get("must", []) + spec.get("filter", [])
+            return all(self.match_object(obj, clause, path) for clause in clauses)
+        if query_type in ("term", "terms"):
+            (field, value), = spec.items()
+            values = set(value if query_type == "terms" else [value])
+            return bool(values & set(self.field_values(obj, field[len(path) + 1:])))
+        raise RequestError(400, "parsing_exception", f"Unsupported nested query [{query_type}]")
+
+    @staticmethod
+    def field_values(source, field):
+        value = source
+        for part in field.split("."):
+            if isinstance(value, list):
+                value = [item.get(part) for item in value if isinstance(item, dict)]
+            elif isinstance(value, dict):
+                value = value.get(part)
+            else:
+                return []
+        if value is None:
+            return []
+        return value if isinstance(value, list) else [value]
+
+    def knn(self, index, spec):
+        ids, matrix = index.vectors(spec["field"])
+        if not ids:
+            return {}
+        query_vector = np.asarray(spec["query_vector"], dtype=np.float32)
+        similarity = matrix @ (query_vector / (np.linalg.norm(query_vector) or 1))
+        if "filter" in spec:
+            filters = spec["filter"] if isinstance(spec["filter"], list) else [spec["filter"]]
+            allowed = self.bool(index, {"filter": filters})
+            similarity = np.where([doc_id in allowed for doc_id in ids], similarity, -np.inf)
+        k = spec.get("k", spec.get("num_candidates", 10))
+        top = np.argsort(-similarity, kind="stable")[:k]
+        # Elasticsearch's score for cosine similarity
+        return {ids[i]: float((1 + similarity[i]) / 2) for i in top if similarity[i] != -np.inf}
+
+    def bool(self, index, spec):
+        def clauses(occur):
+            value = spec.get(occur, [])
+            return [self.match(index, clause) for clause in (value if isinstance(value, list) else [value])]
+
+        must, filters, should = clauses("must"), clauses("filter"), clauses("should")
+        if must or filters:
+            required = must + filters
+            scores = {doc_id: 0.0 for doc_id in required[0]
+                      if all(doc_id in matched for matched in required[1:])}
+        elif should:
+            # Without must/filter clauses at least one should clause has to match
+            scores = {doc_id: 0.0 for matched in should for doc_id in matched}
+        else:
+            scores = dict.fromkeys(index.docs, 0.0)
+
+        for matched in must + should:
+            for doc_id in scores:
+                scores[doc_id] += matched.get(doc_id, 0.0)
+        for matched in clauses("must_not"):
+            scores = {doc_id: score for doc_id, score in scores.items() if doc_id not in matched}
+        return scores
+
+    def script_score(self, index, spec):
+        match = SCRIPT_PATTERN.match(spec["script"]["source"].strip())
+        if match is None:
+            raise RequestError(400, "script_exception", f"Unsupported script [{spec['script']['source']}]")
+        field, offset = match.group(1), float(match.group(2))
+
+        candidates = self.match(index, spec["query"])
+        ids, matrix = index.vectors(field)
+        rows = {doc_id: i for i, doc_id in enumerate(ids)}
+        query_vector = np.asarray(spec["script"]["params"]["query_vector"], dtype=np.float32)
+        query_vector = query_vector / (np.linalg.norm(query_vector) or 1)
+
+        selected = [doc_id for doc_id in candidates if doc_id in rows]
+        if len(selected) < len(candidates):
+            raise RequestError(400, "script_exception", f"A document doesn't have a value for field [{field}]")
+        similarity = matrix[[rows[doc_id] for doc_id in selected]] @ query_vector if selected else []
+        return {doc_id: float(value) + offset for doc_id, value in zip(selected, similarity)}
+
+    def aggregate(self, objects, aggs, path):
+        results = {}
+        for name, spec in aggs.items():
+            sub_aggs = spec.get("aggs", spec.get("aggregations", {}))
+            if "nested" in spec:
+                nested_path = spec["nested"]["path"]
+                nested = [obj for source in objects for obj in (source.get(nested_path[len(path) + 1:] if path else nested_path) or [])]
+                results[name] = {"doc_count": len(nested), **self.aggregate(nested, sub_aggs, nested_path)}
+            elif "terms" in spec:
+                field = spec["terms"]["field"]
+                field = field[len(path) + 1:] if path and field.startswith(path + ".") else field
+                counts = Counter(value for obj in objects for value in set(self.field_values(obj, field)))
+                size = spec["terms"].get("size", 10)
+                # Elasticsearch orders by count, then by key
+                buckets = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+                results[name] = {
+                    "doc_count_error_upper_bound": 0,
+                    "sum_other_doc_count": sum(count for _, count in buckets[size:]),
+                    "buckets": [{"key": key, "doc_count": count} for key, count in buckets[:size]]
+                }
+            else:
+                raise RequestError(400, "parsing_exception", f"Unsupported aggregation {list(spec)}")
+        return results
+
+
+class FakeNode(BaseNode):
+    """
+    Transport node that answers from a FakeCluster instead of the network.
+    """
+    cluster = None
+
+    def perform_request(self, method, target, body=None, headers=None, request_timeout=None):
+        start = time.perf_counter()
+        url = urlsplit(target)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        payload = None
+        if body:
+            text = body.decode("utf-8") if isinstance(body, bytes) else body
+            if url.path.endswith(("/_bulk", "/_msearch")):
+                payload = [json.loads(line) for line in text.splitlines() if line.strip()]
+            else:
+                payload = json.loads(text)
+
+        status, response = self.cluster.handle(method, url.path, params, payload)
+        data = json.dumps(response).encode("utf-8") if response is not None else b""
+        meta = ApiResponseMeta(
+            node=self.config,
+            duration=time.perf_counter() - start,
+            http_version="1.1",
+            status=status,
+            headers=HttpHeaders({
+                "content-type": "application/json",
+                "content-length": str(len(data)),
+                "x-elastic-product": "Elasticsearch"
+            })
+        )
+        return NodeApiResponse(meta, data)
+
+    def close(self):
+        pass
+
+
+class FakeAsyncNode(BaseAsyncNode):
+    """
+    FakeNode for AsyncElasticsearch. The cluster answers synchronously, so
+    a request never yields to the event loop.
+    """
+    cluster = None
+
+    async def perform_request(self, method, target, body=None, headers=None, request_timeout=None):
+        return FakeNode.perform_request(self, method, target, body=body, headers=headers,
+                                        request_timeout=request_timeout)
+
+    async def close(self):
+        pass
+
+
+def fake_client(cluster=None):
+    """
+    Parameters:
+        cluster (FakeCluster): Shared cluster state (a new one when omitted).
+
+    Returns:
+        Elasticsearch: A real client whose requests are answered by `cluster`.
+    """
+    cluster = cluster if cluster is not None else FakeCluster()
+    node_class = type("FakeClusterNode", (FakeNode,), {"cluster": cluster})
+    return Elasticsearch("http://fake-elasticsearch:9200", node_class=node_class)
+
+
+def fake_async_client(cluster=None):
+    """
+    Parameters:
+        cluster (FakeCluster): Shared cluster state (a new one when omitted).
+
+    Returns:
+        AsyncElasticsearch: A real async client whose requests are answered by `cluster`.
+    """
+    cluster = cluster if cluster is not None else FakeCluster()
+    node_class = type("FakeClusterAsyncNode", (FakeAsyncNode,), {"cluster": cluster})
+    return AsyncElasticsearch("http://fake-elasticsearch:9200", node_class=node_class)
@@ -0,0 +1,121 @@
+"""
+Offline stand-ins for the models and the corpus: a tiny randomly initialised
+BERT in place of BioBERT, a stub ScispaCy pipeline and synthetic PubMed-like
+documents and queries. None of it needs network access.
+"""
+import os
+import random
+
+# Words the synthetic documents are made of. Entity words are what the stub
+# spaCy pipelines recognise, with the label the NER model would give them.
+ENTITIES = {
+    "infection": "DISEASE", "osteoarthritis": "DISEASE", "pain": "DISEASE", "thrombosis": "DISEASE",
+    "fracture": "DISEASE", "dislocation": "DISEASE", "loosening": "DISEASE", "stiffness": "DISEASE",
+    "obesity": "DISEASE", "diabetes": "DISEASE", "anemia": "DISEASE", "sepsis": "DISEASE",
+    "TKA": "DISEASE", "THA": "DISEASE", "TSA": "DISEASE", "TJA": "DISEASE",
+    "tranexamic": "CHEMICAL", "vancomycin": "CHEMICAL", "cefazolin": "CHEMICAL", "aspirin": "CHEMICAL",
+    "warfarin": "CHEMICAL", "cement": "CHEMICAL", "polyethylene": "CHEMICAL", "cobalt": "CHEMICAL",
+    "chromium": "CHEMICAL", "titanium": "CHEMICAL", "dexamethasone": "CHEMICAL", "morphine": "CHEMICAL"
+}
+WORDS = [
+    "total", "knee", "hip", "shoulder", "joint", "arthroplasty", "replacement", "revision", "primary",
+    "patients", "outcomes", "after", "before", "surgery", "postoperative", "preoperative", "risk",
+    "rate", "study", "cohort", "randomized", "trial", "analysis", "years", "follow", "up", "results",
+    "compared", "with", "the", "of", "and", "in", "for", "to", "was", "were", "a", "an", "on",
+    "significant", "increased", "reduced", "associated", "implant", "component", "femoral", "tibial",
+    "acetabular", "range", "motion", "function", "score", "mortality", "readmission", "length", "stay",
+    "complications", "blood", "loss", "transfusion", "prophylaxis", "antibiotic", "periprosthetic"
+] + list(ENTITIES)
+
+
+def make_tiny_bert(path, hidden_size=128, num_layers=2, num_heads=2, seed=0):
+    """
+    Save a randomly initialised BERT and a word-level WordPiece tokenizer
+    covering WORDS to `path`, unless they are already there.
+
+    Returns:
+        str: `path`, loadable with AutoModel / AutoTokenizer.from_pretrained.
+    """
+    import torch
+
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    if os.path.exists(os.path.join(path, "config.json")):
+        return path
+    os.makedirs(path, exist_ok=True)
+
+    special = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    characters = [chr(c) for c in range(33, 127)] + [f"##{chr(c)}" for c in range(97, 123)]
+    vocab = special + sorted(set(WORDS) | set(characters))
+    vocab_path = os.path.join(path, "vocab.txt")
+    with open(vocab_path, "w") as f:
+        f.write("\n".join(vocab) + "\n")
+    tokenizer = BertTokenizerFast(vocab_path, do_lower_case=False)
+
+    config = BertConfig(vocab_size=len(vocab), hidden_size=hidden_size, num_hidden_layers=num_layers,
+                        num_attention_heads=num_heads, intermediate_size=hidden_size * 4)
+    torch.manual_seed(seed)
+    BertModel(config).eval().save_pretrained(path)
+    tokenizer.save_pretrained(path)
+    return path
+
+
+class StubEntity:
+    def __init__(self, text, label):
+        self.text = text
+        self.label_ = label
+
+
+class StubDoc:
+    def __init__(self, text):
+        self.text = text
+        self.ents = [StubEntity(word, ENTITIES[word]) for word in text.split() if word in ENTITIES]
+
+
+class StubNER:
+    listening_components = []
+
+
+class StubNlp:
+    """
+    Duck-typed spaCy Language: every word of ENTITIES becomes an entity.
+    """
+    def __init__(self):
+        self.pipeline = [("ner", StubNER())]
+        self.pipe_names = ["ner"]
+
+    def __call__(self, text):
+        return StubDoc(text)
+
+    def pipe(self, texts, batch_size=64, n_process=1, disable=()):
+        for text in texts:
+            yield StubDoc(text)
+
+
+def synthetic_documents(n, seed=0):
+    """
+    Yields:
+        dict: `n` PubMed-like documents with the fields of the indexing pipeline.
+    """
+    rng = random.Random(seed)
+    for i in range(n):
+        title = " ".join(rng.choices(WORDS, k=rng.randint(6, 14)))
+        abstract = " ".join(rng.choices(WORDS, k=rng.randint(80, 280)))
+        yield {
+            "title": title,
+            "abstract": abstract,
+            "authors": [f"Author {rng.randint(1, 500)}" for _ in range(rng.randint(1, 6))],
+            "doi": f"10.0000/synthetic.{seed}.{i}",
+            "publication_date": str(rng.randint(1995, 2024)),
+            "mesh_headings": rng.sample(WORDS, 3),
+            "other_terms": rng.sample(WORDS, 2)
+        }
+
+
+def synthetic_queries(n, seed=1):
+    """
+    Returns:
+        list[str]: `n` short queries drawn from the document vocabulary.
+    """
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(WORDS, k=rng.randint(2, 6))) for _ in range(n)]
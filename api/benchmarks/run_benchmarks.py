@@ -0,0 +1,289 @@
+"""
+Offline search-latency and indexing-throughput benchmark.
+
+BioBERT is replaced by a tiny randomly initialised BERT, the ScispaCy
+pipelines by a stub and Elasticsearch by an in-process fake, so the suite
+runs anywhere without network access. Everything else (embedding cache,
+batcher, vector store, indexing pipeline, SemanticSearch) is the production
+code with the settings from config.py.
+
+Run it from the api directory:
+
+    python -m benchmarks.run_benchmarks --output bench.json
+    python -m benchmarks.run_benchmarks --output bench-new.json --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+from prometheus_client import REGISTRY
+
+from benchmarks.fake_elasticsearch import FakeCluster, fake_client
+from benchmarks.fixtures import StubNlp, make_tiny_bert, synthetic_documents, synthetic_queries
+from config import config
+from indexing.vector_compression import VectorCompressor, fit_compressor
+from monitoring import metrics
+from monitoring.metrics import request_timing
+from preprocessing.model_registry import ModelRegistry
+
+INDEX_NAME = "pubmed-tja-bench"
+STAGES = ("embed", "prf_query", "expansion", "final_query", "total")
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def percentiles(samples_ms):
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "p50": round(float(np.percentile(samples, 50)), 3),
+        "p95": round(float(np.percentile(samples, 95)), 3),
+        "p99": round(float(np.percentile(samples, 99)), 3),
+        "mean": round(float(samples.mean()), 3)
+    }
+
+
+def install_offline_models(workdir, hidden_size):
+    """
+    Register the tiny BERT and the stub spaCy pipelines under the names the
+    production code asks the ModelRegistry for.
+    """
+    from transformers import AutoTokenizer
+
+    from preprocessing.inference_backends import load_backend
+
+    model_path = make_tiny_bert(os.path.join(workdir, "tiny-bert"), hidden_size=hidden_size)
+    ModelRegistry.get(f"{config.BIOBERT_MODEL_NAME}:tokenizer",
+                      lambda: AutoTokenizer.from_pretrained(model_path))
+    ModelRegistry.get(f"{config.BIOBERT_MODEL_NAME}:{config.BIOBERT_BACKEND}",
+                      lambda: load_backend(config.BIOBERT_BACKEND, model_path,
+                                           num_threads=config.TORCH_NUM_THREADS))
+    for name in (config.SCISPACY_SEARCH_MODEL, config.SCISPACY_NER_MODEL):
+        ModelRegistry.get(name, StubNlp)
+
+
+def run_indexing(es_client, workdir, num_docs, hidden_size, batch_size, chunk_size):
+    from indexing.elasticsearch_index import ElasticsearchIndex
+    from indexing.pipeline import IndexingPipeline
+    from search.vector_store import VectorStoreWriter
+
+    es_index = ElasticsearchIndex(es_client, INDEX_NAME)
+    if es_index.compressor.needs_fit:
+        fit_compressor(es_index.compressor, es_index.embedder,
+                       list(synthetic_documents(min(num_docs, config.VECTOR_COMPRESSION_FIT_SAMPLE))),
+                       batch_size=batch_size)
+    # The search side encodes its query vectors with the same compressor
+    VectorCompressor._shared = es_index.compressor
+    es_index.create_index(drop=True)
+    pipeline = IndexingPipeline(es_index, batch_size=batch_size, chunk_size=chunk_size,
+                                checkpoint_path=os.path.join(workdir, "bench.checkpoint"),
+                                vector_store=VectorStoreWriter(os.path.join(workdir, "vectors"),
+                                                               dim=hidden_size, reset=True, sources=True))
+    report = pipeline.run(synthetic_documents(num_docs))
+    report["peak_rss_mb"] = peak_rss_mb()
+    return report
+
+
+def time_search(search, query):
+    """
+    Returns:
+        dict: Milliseconds spent in each stage of SemanticSearch.execute_semantic_search.
+    """
+    with request_timing() as timing:
+        search.execute_semantic_search(query)
+    return timing.as_dict()
+
+
+def histogram_means(histogram, scale, **labels):
+    series = metrics.snapshot(histogram, **labels)
+    return round(series["sum"] / series["count"] * scale, 3) if series["count"] else None
+
+
+def run_search(es_client, workdir, num_queries, warm_up, engine="elasticsearch"):
+    from search.local_engine import LocalSearchEngine, LocalSemanticSearch
+    from search.semantic import SemanticSearch
+    from search.vector_store import VectorStore
+
+    vector_store = VectorStore(os.path.join(workdir, "vectors"))
+    if engine == "local":
+        search = LocalSemanticSearch(LocalSearchEngine(vector_store, nprobe=config.LOCAL_IVF_NPROBE))
+    else:
+        search = SemanticSearch(es_client, INDEX_NAME, vector_store=vector_store)
+    # Time the pipeline itself; run_result_cache measures the result cache
+    search.result_cache = None
+    queries = synthetic_queries(num_queries + warm_up)
+    samples = {stage: [] for stage in STAGES}
+    for i, query in enumerate(queries):
+        timings = time_search(search, query)
+        if i >= warm_up:
+            for stage in STAGES:
+                samples[stage].append(timings[stage])
+
+    return {
+        "queries": num_queries,
+        "stages_ms": {stage: percentiles(values) for stage, values in samples.items()},
+        "queries_per_sec": round(num_queries / (sum(samples["total"]) / 1000), 1),
+        "elasticsearch": {
+            stage: {
+                "mean_took_ms": histogram_means(metrics.ES_TOOK_SECONDS, 1000, operation="search", stage=stage),
+                "mean_response_bytes": histogram_means(metrics.ES_RESPONSE_BYTES, 1, operation="search",
+                                                       stage=stage)
+            } for stage in ("prf_query", "final_query")
+        },
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def run_result_cache(es_client, workdir, num_queries):
+    """
+    Time the queries of run_search three times through the result cache:
+    cold (every query runs and is stored), from the shared tier alone (a
+    fresh process-local tier, as in another worker) and from the RAM tier.
+    """
+    from search.result_cache import ResultCache, SqliteResultStore
+    from search.semantic import SemanticSearch
+    from search.vector_store import VectorStore
+
+    vector_store = VectorStore(os.path.join(workdir, "vectors"))
+    store = SqliteResultStore(os.path.join(workdir, "results.sqlite"),
+                              max_entries=config.RESULT_CACHE_SHARED_ENTRIES)
+    queries = synthetic_queries(num_queries)
+    report = {}
+    cache = None
+    for phase in ("cold", "shared_hit", "ram_hit"):
+        if phase != "ram_hit":
+            cache = ResultCache(config.RESULT_CACHE_RAM_ENTRIES, config.RESULT_CACHE_TTL, store)
+        search = SemanticSearch(es_client, INDEX_NAME, vector_store=vector_store, result_cache=cache)
+        before = dict(cache.counters)
+        totals = [time_search(search, query)["total"] for query in queries]
+        report[phase] = {"total_ms": percentiles(totals),
+                         "lookups": {name: count - before[name] for name, count in cache.counters.items()}}
+    return report
+
+
+def flatten(report, prefix=""):
+    values = {}
+    for key, value in report.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+
+def compare_to_baseline(results, baseline):
+    """
+    Returns:
+        dict: baseline value, current value and relative change of every
+        metric present in both runs.
+    """
+    current = flatten({key: results[key] for key in ("indexing", "search", "peak_rss_mb")})
+    previous = flatten({key: baseline[key] for key in ("indexing", "search", "peak_rss_mb") if key in baseline})
+    diff = {}
+    for path, value in current.items():
+        if path in previous:
+            before = previous[path]
+            diff[path] = {
+                "baseline": before,
+                "current": value,
+                "change_pct": round((value - before) / before * 100, 1) if before else None
+            }
+    return diff
+
+
+def run(args):
+    if args.threads:
+        config.TORCH_NUM_THREADS = args.threads
+    # Stage timings come from the production instrumentation
+    metrics.set_enabled(True)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Keep the embedding cache inside the scratch directory, so every run starts cold
+        from preprocessing.embedding_cache import EmbeddingCache
+        EmbeddingCache._shared = EmbeddingCache(os.path.join(workdir, "embeddings"), dim=args.hidden_size,
+                                                dtype=config.EMBEDDING_CACHE_DTYPE,
+                                                ram_entries=config.EMBEDDING_CACHE_RAM_ENTRIES)
+        install_offline_models(workdir, args.hidden_size)
+        cluster = FakeCluster()
+        es_client = fake_client(cluster)
+
+        indexing = run_indexing(es_client, workdir, args.docs, args.hidden_size, args.batch_size,
+                                args.chunk_size)
+        search = run_search(es_client, workdir, args.queries, args.warm_up, engine=args.engine)
+        if args.engine == "elasticsearch":
+            search["result_cache"] = run_result_cache(es_client, workdir, args.queries)
+        embedding_cache = EmbeddingCache._shared.stats()
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "settings": {
+            "docs": args.docs,
+            "queries": args.queries,
+            "hidden_size": args.hidden_size,
+            "batch_size": args.batch_size,
+            "chunk_size": args.chunk_size,
+            "biobert_backend": config.BIOBERT_BACKEND,
+            "torch_num_threads": config.TORCH_NUM_THREADS,
+            "search_mode": config.SEARCH_MODE,
+            "search_engine": args.engine,
+            "vector_compression": VectorCompressor.from_config().name,
+            "embedding_batcher": config.EMBEDDING_BATCHER_ENABLED
+        },
+        "indexing": indexing,
+        "search": search,
+        "embedding_cache": embedding_cache,
+        "elasticsearch_requests": dict(cluster.requests),
+        "model_calls": {model: int(REGISTRY.get_sample_value("pubmed_model_calls_total", {"model": model}) or 0)
+                        for model in ("biobert", "scispacy_ner", "scispacy_terms")},
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline search-latency and indexing-throughput benchmark.")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="JSON file to write the results to.")
+    parser.add_argument("--baseline", help="Results of an earlier run to diff against.")
+    parser.add_argument("--docs", type=int, default=2000, help="Synthetic documents to index.")
+    parser.add_argument("--queries", type=int, default=200, help="Timed search queries.")
+    parser.add_argument("--warm-up", type=int, default=10, help="Untimed queries run first.")
+    parser.add_argument("--hidden-size", type=int, default=128, help="Hidden size of the tiny BERT.")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads.")
+    parser.add_argument("--engine", choices=("elasticsearch", "local"), default="elasticsearch",
+                        help="Serve the timed queries from Elasticsearch or the local search engine.")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            results["baseline_diff"] = compare_to_baseline(results, json.load(f))
+        for path, row in results["baseline_diff"].items():
+            change = f"{row['change_pct']:+.1f}%" if row["change_pct"] is not None else "n/a"
+            print(f"{path}: {row['baseline']} -> {row['current']} ({change})")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    stages = results["search"]["stages_ms"]
+    print(f"Indexing: {results['indexing']['docs_per_sec']} docs/sec. Search p50/p95/p99 (ms): " +
+          ", ".join(f"{stage} {row['p50']}/{row['p95']}/{row['p99']}" for stage, row in stages.items()))
+    print(f"Peak RSS {results['peak_rss_mb']} MB. Results written to {args.output}.")
+
+
+if __name__ == "__main__":
+    main()
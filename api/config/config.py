@@ -1,3 +1,120 @@
 DATA_ROOT = "./data"
 OUTPUT_DIR = ""
 ELASTICSEARCH_URL = "https://localhost:9200"
+# Alias /search and /document read from. `flask create-index` updates the
+# index behind it in place; with --rebuild it loads a new versioned index
+# (<alias>-<timestamp>) and then swaps the alias to it atomically.
+INDEX_ALIAS = "pubmed-tja"
+# Seconds each process trusts its cached copy of the index metadata (the
+# global facet counts and content version create-index records in _meta)
+# before re-reading it, so a reindex is picked up within this interval
+INDEX_STATE_TTL = 10
+
+# Models shared process-wide through preprocessing.model_registry
+BIOBERT_MODEL_NAME = "dmis-lab/biobert-base-cased-v1.1"
+# BioBERT inference backend (preprocessing.inference_backends): "reference",
+# "last_layer", "int8", "compile" or "torchscript". Compare them on real data
+# with `flask compare-backends` before switching a deployment.
+BIOBERT_BACKEND = "last_layer"
+# torch intra-op threads for CPU inference (None keeps the torch default)
+TORCH_NUM_THREADS = None
+SCISPACY_SEARCH_MODEL = "en_core_sci_md"
+SCISPACY_NER_MODEL = "en_ner_bc5cdr_md"
+
+# Persistent embedding cache shared by indexing and search (None disables it).
+# float16 halves the disk footprint at a small precision cost.
+EMBEDDING_CACHE_DIR = "./cache/embeddings"
+EMBEDDING_CACHE_DTYPE = "float32"
+EMBEDDING_CACHE_RAM_ENTRIES = 10000
+
+# Final scoring in SemanticSearch: "ann" rescores the knn candidates of both
+# vector fields, "exact" scores every document in the index.
+SEARCH_MODE = "ann"
+KNN_K = 100
+KNN_NUM_CANDIDATES = 500
+# Most queries accepted by /search/batch, which embeds them in one forward
+# pass and sends their PRF queries as one _msearch request
+SEARCH_BATCH_MAX_QUERIES = 32
+# Final queries per _msearch request of a batch. The requests are sent
+# concurrently and each query's result is streamed as soon as its request
+# returns, so the first lines do not wait for the slowest query.
+SEARCH_BATCH_STREAM_CHUNK = 8
+
+# Cache of final search results and query vectors (search.result_cache),
+# keyed by query, parameters and index version, so a reindex or alias swap
+# makes older entries unreachable. RESULT_CACHE_SHARED adds a tier every
+# worker shares: the path of a SQLite file (workers of one host) or a
+# redis:// URL (several hosts; needs the redis package); None keeps the
+# cache per process. A results entry holds the 50 returned documents.
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_TTL = 600
+RESULT_CACHE_RAM_ENTRIES = 256
+RESULT_CACHE_SHARED = "./cache/results.sqlite"
+RESULT_CACHE_SHARED_ENTRIES = 20000
+
+# Memory-mapped copy of the document vectors, written by the indexer and read
+# by the search path instead of fetching vectors as JSON (None disables it).
+VECTOR_STORE_DIR = "./cache/vectors"
+
+# Compact document vectors in Elasticsearch (indexing.vector_compression).
+# VECTOR_REDUCTION is None, "pca" (fitted on VECTOR_COMPRESSION_FIT_SAMPLE
+# documents when the index is created, saved to VECTOR_COMPRESSION_PATH and
+# applied to queries too) or "truncate" (keep the first VECTOR_DIMS dims).
+# VECTOR_ELEMENT_TYPE "byte" stores int8 vectors; VECTOR_INDEX_TYPE
+# "int8_hnsw"/"int4_hnsw" quantizes the HNSW graph of float vectors.
+# Compare the options with `flask compare-vector-options` before switching.
+VECTOR_REDUCTION = None
+VECTOR_DIMS = 768
+VECTOR_ELEMENT_TYPE = "float"
+VECTOR_INDEX_TYPE = "hnsw"
+VECTOR_COMPRESSION_PATH = "./cache/vector-compression.npz"
+VECTOR_COMPRESSION_FIT_SAMPLE = 5000
+# dtype of the vector store matrices: "float16" halves its size on disk and
+# in the page cache, but numpy has no float16 BLAS, so the local search
+# engine's exact scoring gets about 10x slower (PRF lookups are unaffected)
+VECTOR_STORE_DTYPE = "float32"
+
+# Retrieval engine behind /search: "elasticsearch", or "local" to answer from
+# the vector store in-process (search.local_engine). The local engine needs a
+# store indexed with document sources and also serves as the fallback when
+# Elasticsearch is unreachable, if LOCAL_SEARCH_FALLBACK is on.
+SEARCH_ENGINE = "elasticsearch"
+LOCAL_SEARCH_FALLBACK = True
+# IVF lists built after indexing for approximate local search (None builds no
+# IVF index, so the local engine always scores exactly) and lists probed per query
+LOCAL_IVF_LISTS = None
+LOCAL_IVF_NPROBE = 16
+
+# Cross-request micro-batching of query embeddings (preprocessing.batcher)
+EMBEDDING_BATCHER_ENABLED = True
+EMBEDDING_BATCH_MAX_WAIT_MS = 5
+EMBEDDING_BATCH_MAX_SIZE = 32
+EMBEDDING_BATCH_MAX_QUEUE = 1024
+
+# Per-stage timing, Elasticsearch and model-call metrics on /metrics
+# (monitoring.metrics). Turning it off makes the instrumentation a no-op.
+METRICS_ENABLED = True
+
+# asyncio serving path (asgi.py)
+ES_CONNECTIONS_PER_NODE = 50
+ASYNC_INFERENCE_WORKERS = 4
+ASYNC_INFERENCE_MAX_PENDING = 64
+
+# Pre-fork serving mode (serve.py): the master loads the models once and the
+# forked workers share the weights copy-on-write. SERVER_TORCH_THREADS is the
+# torch intra-op thread count of each worker (None splits the CPUs evenly).
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 3000
+SERVER_WORKERS = 4
+SERVER_TORCH_THREADS = None
+# Every process writes its Prometheus samples to SERVER_METRICS_DIR (emptied
+# at startup) so /metrics sums them over all workers, whichever one answers.
+# /healthcheck stays per worker: its cache and batcher figures, and the pid
+# it reports, are those of the worker that accepted the connection.
+SERVER_METRICS_DIR = "./cache/prometheus"
+# A worker that dies before it serves is forked again after a delay doubling
+# from SERVER_RESTART_DELAY up to SERVER_RESTART_MAX_DELAY seconds; after
+# SERVER_MAX_STARTUP_FAILURES such deaths in a row the master gives up.
+SERVER_RESTART_DELAY = 0.5
+SERVER_RESTART_MAX_DELAY = 30
+SERVER_MAX_STARTUP_FAILURES = 5
@@ -0,0 +1,198 @@
+import json
+import os
+import re
+import shutil
+
+from multiprocessing import Pool
+
+# Define regular expressions for each field
+pmid_pattern = re.compile(r'^PMID- (\d+)')
+title_pattern = re.compile(r'^TI  - (.+)')
+doi_pattern = re.compile(r'AID - (.+) \[doi\]')
+author_pattern = re.compile(r'FAU - (.+)')
+abstract_pattern = re.compile(r'^AB  - (.+)')
+mesh_pattern = re.compile(r'^MH  - (.+)')
+ot_pattern = re.compile(r'^OT  - (.+)')
+date_pattern = re.compile(r'^DP  - (.+)')
+
+
+def _record(pmid, title, abstract, authors, doi, date, mesh_headings, terms):
+    return {
+        "pmid": pmid if pmid else '',
+        "title": title,
+        "abstract": ' '.join(abstract),
+        "authors": authors,
+        "doi": doi if doi else '',
+        "publication_date": date if date else '',
+        "mesh_headings": mesh_headings,
+        "other_terms": terms
+    }
+
+
+def parse_medline(lines):
+    """
+    Parse MEDLINE-format lines into records, one at a time.
+
+    A record starts at its TI line. Titles continue until the PG line and
+    abstracts until the CI line, exactly like the original
+    build_json_format.py script.
+
+    Parameters:
+        lines (iterable[str]): Lines of a MEDLINE export.
+
+    The PMID line comes before the TI line of its record, so it is held
+    until that title starts the record.
+
+    Yields:
+        dict: pmid, title, abstract, authors, doi, publication_date,
+        mesh_headings and other_terms of each record.
+    """
+    next_pmid = None
+    current_pmid = None
+    current_title = None
+    current_doi = None
+    current_authors = []
+    current_abstract = []
+    current_mesh_headings = []
+    current_terms = []
+    current_date = None
+
+    is_collecting_title = False
+    is_collecting_abstract = False
+    for line in lines:
+        line = line.strip()  # Remove leading/trailing whitespace
+
+        # Handle PubMed ids, which belong to the record whose title follows
+        match = pmid_pattern.match(line)
+        if match:
+            next_pmid = match.group(1)
+
+        # Handle Titles
+        match = title_pattern.match(line)
+        if match:
+            if current_title:
+                # Emit the completed record before starting a new one
+                yield _record(current_pmid, current_title, current_abstract, current_authors, current_doi,
+                              current_date, current_mesh_headings, current_terms)
+                # Reset temporary storage
+                current_doi = None
+                current_authors = []
+                current_abstract = []
+                current_mesh_headings = []
+                current_terms = []
+                current_date = None
+
+            # Start a new title
+            current_pmid, next_pmid = next_pmid, None
+            current_title = match.group(1)
+            is_collecting_title = True
+            continue
+
+        # If title spans multiple lines
+        if is_collecting_title and not line.startswith(('PG  -')):
+            current_title += ' ' + line.strip()
+            continue
+        else:
+            is_collecting_title = False
+
+        # Handle DOI
+        match = doi_pattern.match(line)
+        if match:
+            current_doi = match.group(1)
+
+        # Handle Authors
+        match = author_pattern.match(line)
+        if match:
+            current_authors.append(match.group(1))
+
+        # Handle Abstracts
+        match = abstract_pattern.match(line)
+        if match:
+            current_abstract.append(match.group(1))
+            is_collecting_abstract = True
+            continue
+
+        # Handle MeSh Headings
+        match = mesh_pattern.match(line)
+        if match:
+            current_mesh_headings.append(match.group(1))
+
+        # Handle Other terms
+        match = ot_pattern.match(line)
+        if match:
+            current_terms.append(match.group(1))
+
+        match = date_pattern.match(line)
+        if match:
+            current_date = match.group(1)
+
+        # If abstract spans multiple lines
+        if is_collecting_abstract and not line.startswith(('CI  -')):
+            current_abstract.append(line)
+        else:
+            is_collecting_abstract = False
+
+    # Emit the last record if it exists
+    if current_title:
+        yield _record(current_pmid, current_title, current_abstract, current_authors, current_doi,
+                      current_date, current_mesh_headings, current_terms)
+
+
+def iter_medline_file(path):
+    """
+    Yields:
+        dict: The records of the MEDLINE file at `path`, streamed from disk.
+    """
+    with open(path, 'r') as file:
+        yield from parse_medline(file)
+
+
+def write_ndjson(records, f):
+    """
+    Write records as newline-delimited JSON.
+
+    Returns:
+        int: Number of records written.
+    """
+    count = 0
+    for record in records:
+        f.write(json.dumps(record) + "\n")
+        count += 1
+    return count
+
+
+def _convert_file(args):
+    path, part_path = args
+    with open(part_path, "w") as f:
+        return write_ndjson(iter_medline_file(path), f)
+
+
+def convert_to_ndjson(paths, output_path, processes=None):
+    """
+    Parse MEDLINE files in parallel, one file per worker process, into a
+    single NDJSON file. Each worker streams into its own part file and the
+    parts are concatenated in input order, so memory stays flat regardless
+    of input size.
+
+    Parameters:
+        paths (list[str]): MEDLINE export files.
+        output_path (str): NDJSON file to write.
+        processes (int): Worker processes (defaults to the CPU count).
+
+    Returns:
+        int: Number of records written.
+    """
+    part_paths = [f"{output_path}.part{i}" for i in range(len(paths))]
+    try:
+        with Pool(processes=min(processes or os.cpu_count(), len(paths)) or 1) as pool:
+            total = sum(pool.imap(_convert_file, zip(paths, part_paths)))
+
+        with open(output_path, "w") as out:
+            for part_path in part_paths:
+                with open(part_path, "r") as part:
+                    shutil.copyfileobj(part, out)
+    finally:
+        for part_path in part_paths:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+    return total
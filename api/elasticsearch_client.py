@@ -1,7 +1,10 @@
-from elasticsearch import Elasticsearch
+from elasticsearch import ApiError, AsyncElasticsearch, Elasticsearch, TransportError
+
+from config.config import ES_CONNECTIONS_PER_NODE
 
 class ElasticsearchClient:
     _client = None
+    _async_client = None
 
     @classmethod
     def get_client(cls, hosts=["https://localhost:9200"]):
@@ -16,3 +19,30 @@ class ElasticsearchClient:
                 ssl_show_warn=False
             )
         return cls._client
+
+    @staticmethod
+    def is_unavailable(error):
+        """
+        Returns:
+            bool: Whether `error` means the cluster is down or degraded (as
+            opposed to, say, a malformed query).
+        """
+        if isinstance(error, TransportError):
+            return True
+        return isinstance(error, ApiError) and error.meta.status >= 500
+
+    @classmethod
+    def get_async_client(cls, hosts=["https://localhost:9200"]):
+        # One pooled client per process, shared by every request on the event loop
+        if cls._async_client is None:
+            cls._async_client = AsyncElasticsearch(
+                hosts,
+                # httpx is in environment.yml; the default node class needs aiohttp
+                node_class="httpxasync",
+                basic_auth=('elastic', 'bennyMan'),
+                verify_certs=False,
+                ssl_assert_hostname=False,
+                ssl_show_warn=False,
+                connections_per_node=ES_CONNECTIONS_PER_NODE
+            )
+        return cls._async_client
@@ -1,17 +1,76 @@
-from elasticsearch import Elasticsearch
+import hashlib
+import json
+import time
 
+from contextlib import contextmanager
+
+from elasticsearch import Elasticsearch, NotFoundError
+
+from indexing.vector_compression import VectorCompressor
+from monitoring.metrics import stage
 from preprocessing.embeddings import BioBertEmbedding 
 from preprocessing.named_entity import NamedEntityExtraction
+from preprocessing.terms import TermExtraction
+
+# Index settings relaxed while a bulk load runs, and restored afterwards
+BULK_LOAD_SETTINGS = {"refresh_interval": "-1", "number_of_replicas": 0}
+
+
+def versioned_index_name(alias):
+    """
+    Returns:
+        str: A new, timestamped index name to build behind `alias`.
+    """
+    now = time.time()
+    return f"{alias}-{time.strftime('%Y%m%d%H%M%S', time.gmtime(now))}{int(now * 1000) % 1000:03d}"
+
+
+def current_index(es_client, alias):
+    """
+    Returns:
+        str: The index `alias` points to, or None when the alias does not exist.
+    """
+    try:
+        indices = list(es_client.indices.get_alias(name=alias))
+    except NotFoundError:
+        return None
+    return indices[0] if indices else None
+
+
+def swap_alias(es_client, alias, index_name, delete_old=True):
+    """
+    Point `alias` at `index_name` in a single atomic update, so readers
+    switch from the old index to the new one without a gap.
+
+    Returns:
+        list: The indices the alias pointed to before.
+    """
+    try:
+        old_indices = [name for name in es_client.indices.get_alias(name=alias) if name != index_name]
+    except NotFoundError:
+        old_indices = []
+    actions = [{"remove": {"index": name, "alias": alias}} for name in old_indices]
+    actions.append({"add": {"index": index_name, "alias": alias}})
+    es_client.indices.update_aliases(actions=actions)
+    if delete_old:
+        for name in old_indices:
+            es_client.indices.delete(index=name)
+    return old_indices
+
 
 class ElasticsearchIndex:
-    def __init__(self, es_client, index_name):
+    def __init__(self, es_client, index_name, compressor=None):
         self.es_client = es_client
         self.index_name = index_name
+        # Fitted by the caller before any document is built when it uses PCA
+        self.compressor = compressor if compressor is not None else VectorCompressor.from_config()
         self.embedder = BioBertEmbedding()
         self.ner = NamedEntityExtraction()
+        self.terms = TermExtraction()
 
         self.es_index_schema = {
                 "mappings": {
+                    "_meta": {"vector_compression": self.compressor.describe()},
                     "properties": {
                         "title": {
                             "type": "text"
@@ -22,9 +81,19 @@ class ElasticsearchIndex:
                         "doi": {
                              "type": "text"
                         },
+                        "pmid": {
+                            "type": "keyword"
+                        },
+                        "content_hash": {
+                            "type": "keyword",
+                            "index": False
+                        },
                         "authors": {
                              "type": "text"
                         },
+                        "expansion_terms": {
+                            "type": "keyword"
+                        },
                         "entities": {
                             "type": "nested",
                             "properties": {
@@ -32,32 +101,91 @@ class ElasticsearchIndex:
                                 "label": {"type": "keyword"}
                             }
                         },
-                        "title_embedding": {
-                            "type": "dense_vector",
-                            "dims": 768,
-                            "index": True,
-                            "similarity": "cosine",
-                            "index_options": {
-                                "type": "hnsw",
-                                "m": 16,  # Number of bi-directional links created for each element
-                                "ef_construction": 200  # Defines accuracy/performance during indexing
-                            }
-                        },
-                        "biobert_embedding": {
-                            "type": "dense_vector",
-                            "dims": 768,
-                            "index": True,
-                            "similarity": "cosine",
-                            "index_options": {
-                                "type": "hnsw",
-                                "m": 16,  # Number of bi-directional links created for each element
-                                "ef_construction": 200  # Defines accuracy/performance during indexing
-                            }
-                        }
+                        "title_embedding": self.compressor.field_mapping(),
+                        "biobert_embedding": self.compressor.field_mapping()
                     }
                 }
         }
 
+    @staticmethod
+    def document_id(text):
+        """
+        Deterministic document id, so re-indexing a record overwrites it
+        instead of adding a duplicate: the PMID, else a digest of the DOI,
+        else a digest of title and abstract.
+        """
+        if text.get("pmid"):
+            return f"pmid-{text['pmid']}"
+        if text.get("doi"):
+            return "doi-" + hashlib.sha1(text["doi"].strip().lower().encode("utf-8")).hexdigest()
+        return "text-" + hashlib.sha1((text["title"] + "\n" + text["abstract"]).encode("utf-8")).hexdigest()
+
+    def content_hash(self, text):
+        """
+        Digest of everything an indexed document is derived from: the record
+        fields, the embedding model and the vector compression. A document
+        whose stored hash matches is up to date and can be skipped.
+        """
+        content = {field: text.get(field) for field in ("pmid", "title", "abstract", "authors", "doi")}
+        content["pipeline"] = [self.embedder.cache_model_id, self.compressor.name]
+        return hashlib.sha1(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def stored_hashes(self, doc_ids):
+        """
+        Returns:
+            dict: doc id -> content_hash of the ids that are already indexed.
+        """
+        response = self.es_client.mget(index=self.index_name, ids=doc_ids, source=["content_hash"])
+        return {doc["_id"]: doc["_source"].get("content_hash")
+                for doc in response["docs"] if doc.get("found")}
+
+    @contextmanager
+    def bulk_load_settings(self, replicas=True):
+        """
+        Turn off refreshes (and replicas, when `replicas` is set) for the
+        duration of a bulk load, then restore the previous settings and refresh.
+        """
+        relaxed = {key: value for key, value in BULK_LOAD_SETTINGS.items()
+                   if replicas or key != "number_of_replicas"}
+        current = self.es_client.indices.get_settings(index=self.index_name)
+        index_settings = next(iter(current.values()))["settings"]["index"]
+        # None resets a setting that was never set explicitly to its default
+        previous = {key: index_settings.get(key) for key in relaxed}
+        self.es_client.indices.put_settings(index=self.index_name, settings={"index": relaxed})
+        try:
+            yield
+        finally:
+            self.es_client.indices.put_settings(index=self.index_name, settings={"index": previous})
+            self.es_client.indices.refresh(index=self.index_name)
+
+    def record_global_facets(self, size=1000):
+        """
+        Count the entities of the whole index once, after a load, and store
+        the counts in the index _meta with a new content version. Searches
+        read them from there (search.index_state) instead of running a
+        whole-index nested aggregation per request.
+
+        Returns:
+            dict: The recorded "entity_facets" meta entry.
+        """
+        response = self.es_client.search(index=self.index_name, size=0, track_total_hits=True, aggs={
+            "entities": {
+                "nested": {"path": "entities"},
+                "aggs": {"labels": {"terms": {"field": "entities.entity", "size": size}}}
+            }
+        })
+        facets = {
+            "documents": response["hits"]["total"]["value"],
+            "counts": {bucket["key"]: bucket["doc_count"]
+                       for bucket in response["aggregations"]["entities"]["labels"]["buckets"]}
+        }
+        mapping = self.es_client.indices.get_mapping(index=self.index_name)
+        meta = next(iter(mapping.values()))["mappings"].get("_meta", {})
+        meta.update(entity_facets=facets, content_version=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()) +
+                    f".{int(time.time() * 1000) % 1000:03d}")
+        self.es_client.indices.put_mapping(index=self.index_name, meta=meta)
+        return facets
+
     def create_index(self, drop=True):
         if self.es_client.indices.exists(index=self.index_name) and drop==True:
                 self.es_client.indices.delete(index=self.index_name)
@@ -67,18 +195,63 @@ class ElasticsearchIndex:
             print(f"Index '{self.index_name}' created with HNSW and NER fields.")
 
 
-    def insert_doc(self, text):
-        biobert_embedding = self.embedder.generate_embedding(text["abstract"])
-        title_embedding = self.embedder.generate_embedding(text["title"])
-        ner_entities = self.ner.extract_ner(text["abstract"])
+    def embed_batch(self, texts, batch_size=32):
+        """
+        Embed the abstracts and titles of a batch of documents.
 
-        doc = {
-            "biobert_embedding": biobert_embedding.tolist(),
-            "title_embedding": title_embedding.tolist(),
+        Parameters:
+            texts (list[dict]): Documents with "abstract" and "title" fields.
+            batch_size (int): Sequences per BioBERT forward pass.
+
+        Returns:
+            tuple: (abstract embeddings, title embeddings) as float32 matrices.
+        """
+        embeddings = self.embedder.generate_embeddings(
+            [text["abstract"] for text in texts] + [text["title"] for text in texts],
+            batch_size=batch_size)
+        return embeddings[:len(texts)], embeddings[len(texts):]
+
+    def extract_expansion_terms(self, texts, batch_size=64):
+        """
+        Extract the query-expansion terms of a batch of documents and embed
+        every distinct term, so query-time expansion finds them all in the
+        embedding cache.
+
+        Parameters:
+            texts (list[dict]): Documents with an "abstract" field.
+
+        Returns:
+            list: One list of terms per document.
+        """
+        term_lists = self.terms.extract_terms_batch([text["abstract"] for text in texts], batch_size)
+        self.embedder.generate_embeddings(list({term for terms in term_lists for term in terms}))
+        return term_lists
+
+    def build_doc(self, text, biobert_embedding, title_embedding, ner_entities, expansion_terms,
+                  content_hash=None):
+        return {
+            "biobert_embedding": self.compressor.encode(biobert_embedding).tolist(),
+            "title_embedding": self.compressor.encode(title_embedding).tolist(),
             "entities": ner_entities,
+            "expansion_terms": expansion_terms,
             "title": text["title"],
             "abstract": text["abstract"],
             "authors": text["authors"],
-            "doi": "https://doi.org/" + text["doi"]
+            "doi": "https://doi.org/" + text["doi"],
+            "pmid": text.get("pmid", ""),
+            "content_hash": content_hash or self.content_hash(text)
         }
-        self.es_client.index(index=self.index_name, body=doc)
\ No newline at end of file
+
+    def insert_doc(self, text):
+        # Abstract and title share a single batched forward pass
+        with stage("insert_doc", "embed"):
+            biobert_embedding, title_embedding = self.embedder.generate_embeddings(
+                [text["abstract"], text["title"]])
+        with stage("insert_doc", "ner"):
+            ner_entities = self.ner.extract_ner(text["abstract"])
+        with stage("insert_doc", "expansion_terms"):
+            expansion_terms = self.extract_expansion_terms([text])[0]
+
+        doc = self.build_doc(text, biobert_embedding, title_embedding, ner_entities, expansion_terms)
+        with stage("insert_doc", "index"):
+            self.es_client.index(index=self.index_name, id=self.document_id(text), body=doc)
@@ -0,0 +1,376 @@
+import json
+import os
+import random
+import re
+import time
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+
+from elasticsearch import helpers
+
+from monitoring.metrics import observe_stage
+
+_SEPARATOR = re.compile(r"[\s,]*")
+
+# NamedEntityExtraction of a NER worker process
+_worker_ner = None
+
+
+def iter_documents(path, read_size=1 << 20):
+    """
+    Lazily yield documents from a newline-delimited JSON file (.ndjson/.jsonl)
+    or from a JSON array file, without loading the whole file into memory.
+
+    Parameters:
+        path (str): Input file.
+        read_size (int): Characters read per chunk for JSON array files.
+
+    Yields:
+        dict: One document at a time.
+    """
+    with open(path, "r") as f:
+        if path.endswith((".ndjson", ".jsonl")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = f.read(read_size).lstrip()
+        if not buffer.startswith("["):
+            raise ValueError(f"{path} is neither NDJSON nor a JSON array.")
+        pos = 1
+        eof = False
+        while True:
+            pos = _SEPARATOR.match(buffer, pos).end()
+            if buffer.startswith("]", pos):
+                return
+            try:
+                doc, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # The next element is cut off by the end of the buffer
+                if eof:
+                    raise
+                more = f.read(read_size)
+                eof = not more
+                buffer = buffer[pos:] + more
+                pos = 0
+                continue
+            yield doc
+            pos = end
+
+
+def sample_documents(documents, n, seed=0):
+    """
+    Reservoir-sample `n` documents from a stream. The seed keeps the sample
+    (and its order) stable across runs so checkpoints stay valid.
+    """
+    rng = random.Random(seed)
+    reservoir = []
+    for i, doc in enumerate(documents):
+        if i < n:
+            reservoir.append(doc)
+        else:
+            j = rng.randint(0, i)
+            if j < n:
+                reservoir[j] = doc
+    return reservoir
+
+
+def _init_ner_worker():
+    global _worker_ner
+    from preprocessing.named_entity import NamedEntityExtraction
+    _worker_ner = NamedEntityExtraction()
+
+
+def _extract_ner_timed(ner, texts, batch_size):
+    # Module level so it can run in a NER worker process, where `ner` is None
+    start = time.perf_counter()
+    entities = (ner or _worker_ner).extract_ner_batch(texts, batch_size=batch_size)
+    return entities, time.perf_counter() - start
+
+
+class Checkpoint:
+    """
+    Number of input documents already acknowledged by Elasticsearch (up to
+    the first failed one), and the index they went to, persisted so an
+    interrupted run can resume where it stopped.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.done = 0
+        self.index_name = None
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                state = json.load(f)
+            self.done = state["done"]
+            self.index_name = state.get("index")
+
+    def save(self, done):
+        self.done = done
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"done": done, "index": self.index_name}, f)
+        # Atomic, so a crash never leaves a truncated checkpoint behind
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.done = 0
+        self.index_name = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.docs = 0
+        self.seconds = 0.0
+
+    def add(self, docs, seconds):
+        self.docs += docs
+        self.seconds += seconds
+
+    def report(self):
+        rate = self.docs / self.seconds if self.seconds else 0.0
+        return {"docs": self.docs, "seconds": round(self.seconds, 2), "docs_per_sec": round(rate, 1)}
+
+
+class IndexingPipeline:
+    """
+    Streaming indexer: documents are read lazily, embedded, NER-tagged and
+    mined for expansion terms in batches on worker pools, and sent to
+    Elasticsearch with the bulk helpers. Acknowledged vectors are also
+    appended to `vector_store` (a VectorStoreWriter) when one is given.
+
+    Document ids are deterministic, so indexing a record again overwrites
+    it. With `skip_unchanged`, records whose stored content hash matches
+    (and whose vectors are in the store) are not processed at all, which
+    makes re-running over a grown corpus an incremental update.
+
+    At most `max_in_flight` batches are being processed at any time, so a slow
+    Elasticsearch cluster throttles reading and inference instead of letting
+    work pile up in memory.
+    """
+    def __init__(self, es_index, batch_size=32, chunk_size=500, embed_workers=1,
+                 ner_workers=1, ner_processes=1, terms_workers=1, max_in_flight=4, bulk_threads=1,
+                 checkpoint_path=None, vector_store=None, skip_unchanged=False):
+        self.es_index = es_index
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.embed_workers = embed_workers
+        self.ner_workers = ner_workers
+        self.ner_processes = ner_processes
+        self.terms_workers = terms_workers
+        self.max_in_flight = max_in_flight
+        self.bulk_threads = bulk_threads
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.vector_store = vector_store
+        self.skip_unchanged = skip_unchanged
+        # Documents sent to Elasticsearch but not acknowledged yet: per id, in
+        # the order they were sent (an id may repeat), the number of unchanged
+        # documents skipped right before each one, so the checkpoint still
+        # counts the input stream in order, and its vector store entry
+        self._pending = {}
+        self._trailing_skipped = 0
+        self.unchanged = 0
+        self.stats = {name: StageStats(name) for name in ("read", "lookup", "embed", "ner", "terms", "bulk")}
+
+    def _timed(self, stage, fn, batch):
+        start = time.perf_counter()
+        result = fn(batch)
+        seconds = time.perf_counter() - start
+        self.stats[stage].add(len(batch), seconds)
+        observe_stage("indexing", stage, seconds)
+        return result
+
+    def _embed(self, batch):
+        return self.es_index.embed_batch(batch, batch_size=self.batch_size)
+
+    def _terms(self, batch):
+        return self.es_index.extract_expansion_terms(batch)
+
+    def _ner_pool(self):
+        # spaCy holds the GIL for most of its work: separate processes, each
+        # with its own model, scale where threads do not
+        if self.ner_processes > 1:
+            return ProcessPoolExecutor(self.ner_processes, initializer=_init_ner_worker)
+        return ThreadPoolExecutor(self.ner_workers)
+
+    def _submit_ner(self, ner_pool, batch):
+        ner = None if isinstance(ner_pool, ProcessPoolExecutor) else self.es_index.ner
+        return ner_pool.submit(_extract_ner_timed, ner, [text["abstract"] for text in batch], self.batch_size)
+
+    def _batches(self, documents):
+        documents = iter(documents)
+        while True:
+            start = time.perf_counter()
+            batch = list(islice(documents, self.batch_size))
+            self.stats["read"].add(len(batch), time.perf_counter() - start)
+            if not batch:
+                return
+            yield batch
+
+    def _changed(self, batch):
+        """
+        Returns:
+            list: (document, id, content hash, unchanged documents skipped
+            right before it) of the documents in `batch` that need indexing.
+        """
+        keyed = [(text, self.es_index.document_id(text), self.es_index.content_hash(text)) for text in batch]
+        stored = {}
+        if self.skip_unchanged:
+            start = time.perf_counter()
+            stored = self.es_index.stored_hashes([doc_id for _, doc_id, _ in keyed])
+            self.stats["lookup"].add(len(batch), time.perf_counter() - start)
+        changed = []
+        for text, doc_id, content_hash in keyed:
+            # Documents indexed before the vector store existed are redone to fill it
+            if stored.get(doc_id) == content_hash and (self.vector_store is None or doc_id in self.vector_store):
+                self.unchanged += 1
+                self._trailing_skipped += 1
+                continue
+            changed.append((text, doc_id, content_hash, self._trailing_skipped))
+            self._trailing_skipped = 0
+        return changed
+
+    def _actions(self, documents, embed_pool, ner_pool, terms_pool):
+        in_flight = deque()
+        for batch in self._batches(documents):
+            keyed = self._changed(batch)
+            if not keyed:
+                continue
+            batch = [text for text, _, _, _ in keyed]
+            in_flight.append((keyed,
+                              embed_pool.submit(self._timed, "embed", self._embed, batch),
+                              self._submit_ner(ner_pool, batch),
+                              terms_pool.submit(self._timed, "terms", self._terms, batch)))
+            if len(in_flight) >= self.max_in_flight:
+                yield from self._batch_actions(*in_flight.popleft())
+        while in_flight:
+            yield from self._batch_actions(*in_flight.popleft())
+
+    def _batch_actions(self, keyed, embed_future, ner_future, terms_future):
+        biobert_embeddings, title_embeddings = embed_future.result()
+        ner_entities, ner_seconds = ner_future.result()
+        self.stats["ner"].add(len(keyed), ner_seconds)
+        observe_stage("indexing", "ner", ner_seconds)
+        expansion_terms = terms_future.result()
+        for (text, doc_id, content_hash, skipped), biobert_embedding, title_embedding, entities, terms in zip(
+                keyed, biobert_embeddings, title_embeddings, ner_entities, expansion_terms):
+            source = self.es_index.build_doc(text, biobert_embedding, title_embedding, entities, terms,
+                                             content_hash=content_hash)
+            pending_vectors = None
+            if self.vector_store is not None:
+                vectors = {"biobert_embedding": biobert_embedding, "title_embedding": title_embedding}
+                stored_source = {field: value for field, value in source.items() if field not in vectors} \
+                    if self.vector_store.sources else None
+                pending_vectors = (vectors, stored_source)
+            self._pending.setdefault(doc_id, deque()).append((skipped, pending_vectors))
+            yield {
+                "_index": self.es_index.index_name,
+                "_id": doc_id,
+                "_source": source
+            }
+
+    def _timed_iter(self, iterable):
+        self._producer_seconds = 0.0
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._producer_seconds += time.perf_counter() - start
+            yield item
+
+    def _bulk(self, actions):
+        client = self.es_index.es_client
+        if self.bulk_threads > 1:
+            return helpers.parallel_bulk(client, actions, thread_count=self.bulk_threads,
+                                         chunk_size=self.chunk_size, queue_size=self.bulk_threads,
+                                         raise_on_error=False)
+        return helpers.streaming_bulk(client, actions, chunk_size=self.chunk_size,
+                                      max_retries=3, raise_on_error=False)
+
+    def run(self, documents):
+        """
+        Index `documents`, skipping the ones a previous run already checkpointed.
+
+        Parameters:
+            documents (iterable[dict]): Documents in a stable order.
+
+        Returns:
+            dict: Indexed/failed counts and docs/sec for every stage.
+        """
+        skipped = self.checkpoint.done
+        if skipped:
+            print(f"Resuming after {skipped} already indexed documents.")
+        documents = islice(documents, skipped, None)
+
+        done = skipped
+        saved = skipped
+        failed = 0
+        # Position of the first failed document: the checkpoint never moves
+        # past it, so a resumed run retries it
+        retry_from = None
+        self.unchanged = 0
+        self._trailing_skipped = 0
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.embed_workers) as embed_pool, \
+                self._ner_pool() as ner_pool, \
+                ThreadPoolExecutor(self.terms_workers) as terms_pool:
+            actions = self._timed_iter(self._actions(documents, embed_pool, ner_pool, terms_pool))
+            for ok, item in self._bulk(actions):
+                doc_id = item["index"]["_id"]
+                sent = self._pending[doc_id]
+                skipped_before, pending_vectors = sent.popleft()
+                if not sent:
+                    del self._pending[doc_id]
+                if not ok:
+                    failed += 1
+                    if retry_from is None:
+                        retry_from = done + skipped_before
+                    if failed <= 10:
+                        print(f"Failed to index document: {item}")
+                elif pending_vectors is not None:
+                    self.vector_store.add(doc_id, *pending_vectors)
+                done += 1 + skipped_before
+                if done - saved >= self.chunk_size:
+                    saved = done
+                    self._save_checkpoint(done if retry_from is None else retry_from)
+                    self._print_progress(done - skipped, start)
+        done += self._trailing_skipped
+        self._save_checkpoint(done if retry_from is None else retry_from)
+        if retry_from is not None:
+            print(f"{failed} documents failed; a resumed run starts again from document {retry_from}.")
+
+        elapsed = time.perf_counter() - start
+        # Whatever was not spent producing actions was spent in bulk requests
+        self.stats["bulk"].add(done - skipped - self.unchanged, max(elapsed - self._producer_seconds, 0.0))
+        return {
+            "indexed": done - skipped - failed - self.unchanged,
+            "unchanged": self.unchanged,
+            "failed": failed,
+            "seconds": round(elapsed, 2),
+            "docs_per_sec": round((done - skipped) / elapsed, 1) if elapsed else 0.0,
+            "stages": {name: stage.report() for name, stage in self.stats.items()}
+        }
+
+    def _save_checkpoint(self, done):
+        # Vectors first, so a resumed run never skips documents missing from the store
+        if self.vector_store is not None:
+            self.vector_store.flush()
+        self.checkpoint.save(done)
+
+    def _print_progress(self, count, start):
+        rate = count / (time.perf_counter() - start)
+        stages = ", ".join(f"{name} {stage.report()['docs_per_sec']}/s"
+                           for name, stage in self.stats.items() if name != "bulk" and stage.docs)
+        print(f"Indexed {count} documents ({rate:.1f} docs/sec; {stages}).")
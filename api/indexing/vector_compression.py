@@ -0,0 +1,271 @@
+"""
+Compact document vectors for Elasticsearch: optional dimensionality
+reduction (PCA fitted at index time, or Matryoshka-style truncation to the
+first dims), int8 ("byte") element storage and quantized HNSW index options.
+
+The same VectorCompressor encodes the document vectors at index time and
+the query vectors at search time, so both live in the same space. The
+memory-mapped vector store always keeps the full-precision vectors.
+"""
+import os
+
+import numpy as np
+
+from config.config import (VECTOR_COMPRESSION_PATH, VECTOR_DIMS, VECTOR_ELEMENT_TYPE, VECTOR_INDEX_TYPE,
+                           VECTOR_REDUCTION)
+
+REDUCTIONS = (None, "pca", "truncate")
+ELEMENT_TYPES = ("float", "byte")
+# int8_hnsw/int4_hnsw quantize the vectors the HNSW graph is searched with
+# (4x/8x less memory) and keep the float vectors for rescoring
+INDEX_TYPES = ("hnsw", "int8_hnsw", "int4_hnsw")
+INPUT_DIMS = 768
+# Options compared by `flask compare-vector-options`, the baseline first
+DEFAULT_OPTIONS = (
+    "none:768:float:hnsw",
+    "none:768:float:int8_hnsw",
+    "none:768:float:int4_hnsw",
+    "none:768:byte:hnsw",
+    "truncate:256:float:hnsw",
+    "pca:256:float:hnsw",
+    "pca:256:float:int8_hnsw",
+    "pca:256:byte:hnsw"
+)
+
+
+class VectorCompressor:
+    """
+    Maps 768-dim BioBERT vectors to what is stored in the dense_vector fields.
+
+    Parameters:
+        reduction (str): None, "pca" or "truncate".
+        dims (int): Output dimensions of the reduction.
+        element_type (str): "float", or "byte" for int8 vectors.
+        index_type (str): HNSW index_options type of the mapping.
+    """
+    _shared = None
+
+    def __init__(self, reduction=None, dims=INPUT_DIMS, element_type="float", index_type="hnsw"):
+        if reduction not in REDUCTIONS:
+            raise ValueError(f"Unknown vector reduction '{reduction}', expected one of {REDUCTIONS}.")
+        if element_type not in ELEMENT_TYPES:
+            raise ValueError(f"Unknown element type '{element_type}', expected one of {ELEMENT_TYPES}.")
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}.")
+        if element_type == "byte" and index_type != "hnsw":
+            raise ValueError(f"'{index_type}' quantizes float vectors; byte vectors need 'hnsw'.")
+        self.reduction = reduction
+        self.dims = dims if reduction else INPUT_DIMS
+        self.element_type = element_type
+        self.index_type = index_type
+        # PCA parameters, set by fit() or load()
+        self.mean = None
+        self.components = None
+        self.loaded_mtime = None
+
+    @classmethod
+    def from_config(cls):
+        """
+        Returns:
+            VectorCompressor: The compressor configured in config.py, not fitted yet.
+        """
+        return cls(VECTOR_REDUCTION, VECTOR_DIMS, VECTOR_ELEMENT_TYPE, VECTOR_INDEX_TYPE)
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns:
+            VectorCompressor: The compressor configured in config.py, with its
+            fitted PCA loaded from VECTOR_COMPRESSION_PATH when it has one.
+            The projection is reloaded when a rebuild publishes a new one.
+        """
+        compressor = cls._shared
+        if compressor is None:
+            compressor = cls.from_config()
+            if compressor.needs_fit:
+                compressor = cls._load_published()
+            cls._shared = compressor
+        elif compressor.loaded_mtime is not None and \
+                os.path.getmtime(VECTOR_COMPRESSION_PATH) != compressor.loaded_mtime:
+            cls._shared = compressor = cls._load_published()
+        return compressor
+
+    @classmethod
+    def _load_published(cls):
+        if not os.path.exists(VECTOR_COMPRESSION_PATH):
+            raise RuntimeError(f"VECTOR_REDUCTION is 'pca' but {VECTOR_COMPRESSION_PATH} does not exist; "
+                               "re-create the index to fit it.")
+        compressor = cls.from_config()
+        compressor.loaded_mtime = os.path.getmtime(VECTOR_COMPRESSION_PATH)
+        return compressor.load(VECTOR_COMPRESSION_PATH)
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        Parameters:
+            spec (str): "<reduction>:<dims>:<element_type>:<index_type>", e.g.
+                "pca:256:float:int8_hnsw" ("none" for no reduction).
+
+        Returns:
+            VectorCompressor
+        """
+        reduction, dims, element_type, index_type = spec.split(":")
+        return cls(None if reduction == "none" else reduction, int(dims), element_type, index_type)
+
+    @property
+    def name(self):
+        return f"{self.reduction or 'none'}:{self.dims}:{self.element_type}:{self.index_type}"
+
+    @property
+    def is_identity(self):
+        return self.reduction is None and self.element_type == "float"
+
+    @property
+    def needs_fit(self):
+        return self.reduction == "pca"
+
+    @property
+    def fitted(self):
+        return not self.needs_fit or self.components is not None
+
+    @property
+    def bytes_per_vector(self):
+        """Raw size of one stored vector, before any HNSW or index overhead."""
+        return self.dims * (1 if self.element_type == "byte" else 4)
+
+    def fit(self, vectors):
+        """
+        Fit the PCA projection on a sample of document vectors.
+
+        Parameters:
+            vectors (np.ndarray): Sample matrix, one 768-dim vector per row.
+        """
+        if not self.needs_fit:
+            return self
+        vectors = np.asarray(vectors, dtype=np.float64)
+        if len(vectors) < self.dims:
+            raise ValueError(f"PCA to {self.dims} dims needs at least {self.dims} sample vectors, "
+                             f"got {len(vectors)}.")
+        self.mean = vectors.mean(axis=0)
+        # Right singular vectors of the centred sample are the principal axes
+        _, _, vt = np.linalg.svd(vectors - self.mean, full_matrices=False)
+        self.components = vt[:self.dims].astype(np.float32)
+        self.mean = self.mean.astype(np.float32)
+        return self
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, name=np.str_(self.name), mean=self.mean, components=self.components)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        with np.load(path) as data:
+            if str(data["name"]).split(":")[:2] != self.name.split(":")[:2]:
+                raise ValueError(f"{path} holds a '{data['name']}' projection, not '{self.name}'.")
+            self.mean, self.components = data["mean"], data["components"]
+        return self
+
+    def reduce(self, vectors):
+        """
+        Returns:
+            np.ndarray: `vectors` (one per row) in the reduced float32 space.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.reduction == "pca":
+            return (vectors - self.mean) @ self.components.T
+        if self.reduction == "truncate":
+            return vectors[..., :self.dims]
+        return vectors
+
+    def encode(self, vectors):
+        """
+        Parameters:
+            vectors (np.ndarray): One 768-dim vector, or one per row.
+
+        Returns:
+            np.ndarray: What the dense_vector fields store: float32, or int8
+            scaled per vector so its largest component is +-127 (cosine
+            similarity does not depend on the scale).
+        """
+        reduced = self.reduce(vectors)
+        if self.element_type == "float":
+            return reduced
+        scale = np.max(np.abs(reduced), axis=-1, keepdims=True)
+        return np.round(reduced / np.where(scale == 0, 1, scale) * 127).astype(np.int8)
+
+    def encode_query(self, vector):
+        """
+        Returns:
+            list: `vector` as a query_vector for the compressed fields.
+        """
+        if self.is_identity:
+            return vector if isinstance(vector, list) else np.asarray(vector).tolist()
+        return self.encode(vector).tolist()
+
+    def decode(self, vectors):
+        """
+        Map stored vectors back to (an approximation of) the BioBERT space,
+        for pseudo-relevance feedback when vectors come from Elasticsearch
+        instead of the vector store. Byte vectors come back with unit norm.
+
+        Returns:
+            np.ndarray: float32, one 768-dim vector per row.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.is_identity:
+            return vectors
+        if self.element_type == "byte":
+            norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+            vectors = vectors / np.where(norms == 0, 1, norms)
+        if self.reduction == "pca":
+            return vectors @ self.components + self.mean
+        if self.reduction == "truncate":
+            padding = [(0, 0)] * (vectors.ndim - 1) + [(0, INPUT_DIMS - self.dims)]
+            return np.pad(vectors, padding)
+        return vectors
+
+    def field_mapping(self, m=16, ef_construction=200):
+        """
+        Returns:
+            dict: dense_vector mapping of a document vector field.
+        """
+        mapping = {
+            "type": "dense_vector",
+            "dims": self.dims,
+            "index": True,
+            "similarity": "cosine",
+            "index_options": {
+                "type": self.index_type,
+                "m": m,  # Number of bi-directional links created for each element
+                "ef_construction": ef_construction  # Defines accuracy/performance during indexing
+            }
+        }
+        if self.element_type == "byte":
+            mapping["element_type"] = "byte"
+        return mapping
+
+    def describe(self):
+        """Settings recorded in the index _meta, so a mismatch can be traced."""
+        return {"name": self.name, "reduction": self.reduction, "dims": self.dims,
+                "element_type": self.element_type, "index_type": self.index_type}
+
+
+def fit_compressor(compressor, embedder, texts, batch_size=32):
+    """
+    Fit `compressor` on the BioBERT embeddings of a document sample (titles
+    and abstracts, which share one projection). The embeddings land in the
+    embedding cache, so indexing the same documents afterwards is free.
+
+    Parameters:
+        compressor (VectorCompressor): Compressor to fit.
+        embedder (BioBertEmbedding): Embedding model.
+        texts (list[dict]): Documents with "abstract" and "title" fields.
+
+    Returns:
+        VectorCompressor: `compressor`, fitted.
+    """
+    vectors = embedder.generate_embeddings([text["abstract"] for text in texts] +
+                                           [text["title"] for text in texts], batch_size=batch_size)
+    print(f"Fitting {compressor.name} on {len(vectors)} vectors.")
+    return compressor.fit(vectors)
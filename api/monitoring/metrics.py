@@ -0,0 +1,195 @@
+"""
+Prometheus metrics of the search and indexing paths (prometheus_client,
+rendered on /metrics by exposition()), plus per-stage timing of single
+requests for the X-Timing header.
+
+Under the pre-fork server (serve.py) every process writes its samples to
+PROMETHEUS_MULTIPROC_DIR and /metrics sums them over all workers; elsewhere
+they are the samples of the one serving process.
+
+Stage timing is a no-op when METRICS_ENABLED is off: stage() hands back a
+shared null context and the observe_* helpers return immediately.
+"""
+import contextvars
+import os
+import time
+
+from contextlib import contextmanager, nullcontext
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+from config.config import METRICS_ENABLED
+
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+BYTES_BUCKETS = [1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216]
+
+_enabled = METRICS_ENABLED
+_null_stage = nullcontext()
+# Timing of the request being handled, when it asked for an X-Timing header
+_current_timing = contextvars.ContextVar("current_timing", default=None)
+
+
+STAGE_SECONDS = Histogram("pubmed_stage_seconds", "Time spent in each stage of an operation.",
+                          ("operation", "stage"), buckets=LATENCY_BUCKETS)
+ES_TOOK_SECONDS = Histogram("pubmed_elasticsearch_took_seconds",
+                            "Server-side time reported by Elasticsearch ('took').",
+                            ("operation", "stage"), buckets=LATENCY_BUCKETS)
+ES_RESPONSE_BYTES = Histogram("pubmed_elasticsearch_response_bytes", "Size of Elasticsearch response bodies.",
+                              ("operation", "stage"), buckets=BYTES_BUCKETS)
+MODEL_CALLS = Counter("pubmed_model_calls_total", "Model invocations (forward passes or pipe batches).", ("model",))
+MODEL_INPUTS = Counter("pubmed_model_inputs_total", "Texts processed by each model.", ("model",))
+RESULT_CACHE_LOOKUPS = Counter("pubmed_result_cache_lookups_total",
+                               "Result cache lookups by entry kind and outcome (ram_hit, shared_hit, miss).",
+                               ("kind", "outcome"))
+
+
+def snapshot(histogram, **labels):
+    """
+    Returns:
+        dict: Cumulative count per upper bound ("+Inf" last), total count and
+        sum of the series of `histogram` with `labels`, in this process.
+    """
+    buckets, count, total = {}, 0, 0.0
+    for sample in histogram.collect()[0].samples:
+        sample_labels = dict(sample.labels)
+        bound = sample_labels.pop("le", None)
+        if sample_labels != labels:
+            continue
+        if sample.name.endswith("_bucket"):
+            buckets[bound] = int(sample.value)
+        elif sample.name.endswith("_count"):
+            count = int(sample.value)
+        elif sample.name.endswith("_sum"):
+            total = sample.value
+    return {"buckets": buckets, "count": count, "sum": round(total, 6)}
+
+
+def exposition():
+    """
+    Returns:
+        bytes: Every metric in the Prometheus text format, summed over the
+        live and exited processes of the pre-fork server when
+        PROMETHEUS_MULTIPROC_DIR is set.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return generate_latest()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry)
+
+
+def set_enabled(enabled):
+    """Switch stage timing and the observe_* helpers on or off at runtime."""
+    global _enabled
+    _enabled = enabled
+
+
+def is_enabled():
+    return _enabled
+
+
+class Timing:
+    """
+    Stage durations of a single request, in the order they finished.
+    """
+    def __init__(self):
+        self.stages = []
+
+    def add(self, name, seconds):
+        self.stages.append((name, seconds))
+
+    def as_dict(self):
+        """
+        Returns:
+            dict: Milliseconds per stage (repeated stages are summed).
+        """
+        totals = {}
+        for name, seconds in self.stages:
+            totals[name] = totals.get(name, 0.0) + seconds * 1000
+        return totals
+
+    def header(self):
+        """
+        Returns:
+            str: The X-Timing header value, e.g. "embed;dur=12.3, prf_query;dur=8.1".
+        """
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in self.as_dict().items())
+
+
+@contextmanager
+def request_timing():
+    """
+    Collect the stages of the current request (thread or asyncio task) into
+    the yielded Timing.
+    """
+    timing = Timing()
+    token = _current_timing.set(timing)
+    try:
+        yield timing
+    finally:
+        _current_timing.reset(token)
+
+
+def observe_stage(operation, name, seconds):
+    if not _enabled:
+        return
+    STAGE_SECONDS.labels(operation=operation, stage=name).observe(seconds)
+    timing = _current_timing.get()
+    if timing is not None:
+        timing.add(name, seconds)
+
+
+class _StageTimer:
+    __slots__ = ("operation", "name", "start")
+
+    def __init__(self, operation, name):
+        self.operation = operation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe_stage(self.operation, self.name, time.perf_counter() - self.start)
+        return False
+
+
+def stage(operation, name):
+    """
+    Time the enclosed block as stage `name` of `operation`:
+
+        with stage("search", "embed"):
+            ...
+
+    Returns:
+        A context manager; a shared no-op one when metrics are disabled.
+    """
+    if not _enabled:
+        return _null_stage
+    return _StageTimer(operation, name)
+
+
+def observe_elasticsearch(operation, name, took_ms, payload_bytes):
+    """Record the server-side 'took' and the response size of an Elasticsearch call."""
+    if not _enabled:
+        return
+    if took_ms is not None:
+        ES_TOOK_SECONDS.labels(operation=operation, stage=name).observe(took_ms / 1000)
+    if payload_bytes:
+        ES_RESPONSE_BYTES.labels(operation=operation, stage=name).observe(payload_bytes)
+
+
+def count_model_call(model, inputs):
+    """Count one invocation of `model` over `inputs` texts."""
+    if not _enabled:
+        return
+    MODEL_CALLS.labels(model=model).inc()
+    MODEL_INPUTS.labels(model=model).inc(inputs)
+
+
+def count_cache_lookup(kind, outcome):
+    """Count one result cache lookup of a `kind` entry."""
+    if not _enabled:
+        return
+    RESULT_CACHE_LOOKUPS.labels(kind=kind, outcome=outcome).inc()
@@ -0,0 +1,119 @@
+import queue
+import threading
+import time
+
+from concurrent.futures import Future
+
+import numpy as np
+
+from config.config import (EMBEDDING_BATCH_MAX_QUEUE, EMBEDDING_BATCH_MAX_SIZE,
+                           EMBEDDING_BATCH_MAX_WAIT_MS)
+from prometheus_client import Histogram
+
+from monitoring.metrics import snapshot
+from preprocessing.embeddings import BioBertEmbedding
+
+# Shared by every batcher of the process
+QUEUE_SECONDS = Histogram("embedding_batch_queue_seconds", "Time a text waits before its batch starts.",
+                          buckets=[0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0])
+BATCH_SIZE = Histogram("embedding_batch_size", "Texts per batched forward pass.",
+                       buckets=[1, 2, 4, 8, 16, 32, 64, 128])
+
+
+class EmbeddingBatcher:
+    """
+    Dynamic batcher in front of BioBertEmbedding.
+
+    Concurrent request handlers submit single texts; a background thread
+    gathers them for up to `max_wait_ms` after the first one arrives, or until
+    `max_batch` texts are waiting, and embeds them in one batched forward
+    pass. It exposes the same generate_embedding/generate_embeddings API as
+    BioBertEmbedding, so it is a drop-in replacement.
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, embedder, max_wait_ms=5, max_batch=32, max_queue=1024):
+        self.embedder = embedder
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.queue_time = QUEUE_SECONDS
+        self.batch_size = BATCH_SIZE
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns:
+            EmbeddingBatcher: The process-wide batcher configured in config.py.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(BioBertEmbedding(), max_wait_ms=EMBEDDING_BATCH_MAX_WAIT_MS,
+                                  max_batch=EMBEDDING_BATCH_MAX_SIZE, max_queue=EMBEDDING_BATCH_MAX_QUEUE)
+        return cls._shared
+
+    @property
+    def cache_model_id(self):
+        return self.embedder.cache_model_id
+
+    def submit(self, text):
+        """
+        Queue one text for embedding.
+
+        Returns:
+            Future: Resolves to the float32 embedding of `text`.
+        """
+        future = Future()
+        try:
+            self._queue.put_nowait((text, future, time.perf_counter()))
+        except queue.Full:
+            raise RuntimeError("Embedding queue is full, try again later.")
+        return future
+
+    def generate_embedding(self, doc):
+        return self.submit(doc).result()
+
+    def generate_embeddings(self, texts, batch_size=None):
+        futures = [self.submit(text) for text in texts]
+        if not futures:
+            return np.empty((0, self.embedder.model.hidden_size), dtype=np.float32)
+        return np.stack([future.result() for future in futures])
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                self.queue_time.observe(started - enqueued)
+            self.batch_size.observe(len(batch))
+
+            try:
+                embeddings = self.embedder.generate_embeddings([text for text, _, _ in batch],
+                                                               batch_size=self.max_batch)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_time_seconds": snapshot(self.queue_time),
+            "batch_size": snapshot(self.batch_size)
+        }
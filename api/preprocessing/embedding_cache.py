@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import threading
+
+from collections import OrderedDict
+
+import numpy as np
+
+from config.config import EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_DTYPE, EMBEDDING_CACHE_RAM_ENTRIES
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads within one process are synchronised
+    fcntl = None
+
+KEY_BYTES = 16
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed store of embedding vectors.
+
+    On disk the cache is two append-only files: `keys.bin` holds one 16 byte
+    digest per row and `vectors.bin` the matching rows as a raw float32 (or
+    float16) matrix, which is memory-mapped so a lookup is a plain array read.
+    A vector is always written before its key, under an exclusive file lock,
+    so readers in other processes never see a key without its vector.
+
+    Recently used vectors are also kept in an in-RAM LRU tier.
+    """
+    _shared = None
+
+    def __init__(self, path, dim=768, dtype="float32", ram_entries=10000):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.ram_entries = ram_entries
+        os.makedirs(path, exist_ok=True)
+
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            if meta != {"dim": dim, "dtype": self.dtype.name}:
+                raise ValueError(f"Embedding cache at {path} was created with {meta}.")
+        else:
+            with open(meta_path, "w") as f:
+                json.dump({"dim": dim, "dtype": self.dtype.name}, f)
+
+        self.keys_path = os.path.join(path, "keys.bin")
+        self.vectors_path = os.path.join(path, "vectors.bin")
+        self.lock_path = os.path.join(path, "cache.lock")
+        for file_path in (self.keys_path, self.vectors_path, self.lock_path):
+            open(file_path, "ab").close()
+
+        self.row_bytes = dim * self.dtype.itemsize
+        self._rows = {}
+        self._key_count = 0
+        self._vectors = None
+        self._lock = threading.Lock()
+        self._ram = OrderedDict()
+        self.counters = {"ram_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0}
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns:
+            EmbeddingCache: The process-wide cache configured in config.py, or
+            None when caching is disabled.
+        """
+        if cls._shared is None and EMBEDDING_CACHE_DIR:
+            cls._shared = cls(EMBEDDING_CACHE_DIR, dtype=EMBEDDING_CACHE_DTYPE,
+                              ram_entries=EMBEDDING_CACHE_RAM_ENTRIES)
+        return cls._shared
+
+    @staticmethod
+    def key(model_id, pooling_version, text):
+        digest = hashlib.blake2b(digest_size=KEY_BYTES)
+        digest.update(f"{model_id}\0{pooling_version}\0".encode("utf-8"))
+        digest.update(text.encode("utf-8"))
+        return digest.digest()
+
+    def _refresh(self):
+        # Pick up rows appended by this or any other process since the last refresh
+        key_count = os.path.getsize(self.keys_path) // KEY_BYTES
+        known = self._key_count
+        if key_count > known:
+            with open(self.keys_path, "rb") as f:
+                f.seek(known * KEY_BYTES)
+                data = f.read((key_count - known) * KEY_BYTES)
+            for row in range(known, key_count):
+                offset = (row - known) * KEY_BYTES
+                self._rows.setdefault(data[offset:offset + KEY_BYTES], row)
+            self._key_count = key_count
+        if self._rows and (self._vectors is None or len(self._vectors) < key_count):
+            rows = os.path.getsize(self.vectors_path) // self.row_bytes
+            self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(rows, self.dim))
+
+    def _remember(self, key, vector):
+        self._ram[key] = vector
+        self._ram.move_to_end(key)
+        if len(self._ram) > self.ram_entries:
+            self._ram.popitem(last=False)
+
+    def get_many(self, keys):
+        """
+        Parameters:
+            keys (list[bytes]): Keys from `EmbeddingCache.key`.
+
+        Returns:
+            dict: key -> float32 vector for every key found in the cache.
+        """
+        found = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                vector = self._ram.get(key)
+                if vector is not None:
+                    self._ram.move_to_end(key)
+                    self.counters["ram_hits"] += 1
+                    found[key] = vector
+                else:
+                    missing.append(key)
+
+            if missing and any(key not in self._rows for key in missing):
+                self._refresh()
+            for key in missing:
+                row = self._rows.get(key)
+                if row is None:
+                    self.counters["misses"] += 1
+                    continue
+                vector = np.asarray(self._vectors[row], dtype=np.float32)
+                self.counters["disk_hits"] += 1
+                self._remember(key, vector)
+                found[key] = vector
+        return found
+
+    def put_many(self, keys, vectors):
+        """
+        Append vectors that are not cached yet.
+
+        Parameters:
+            keys (list[bytes]): Keys from `EmbeddingCache.key`.
+            vectors (np.ndarray): Matrix with one row per key.
+        """
+        with self._lock, open(self.lock_path, "r+b") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                new_rows = [(key, vector) for key, vector in zip(keys, vectors) if key not in self._rows]
+                # Drop duplicates within this call as well
+                new_rows = list(dict(new_rows).items())
+                if not new_rows:
+                    return
+                # Trim torn rows a crashed writer may have left behind
+                key_count = os.path.getsize(self.keys_path) // KEY_BYTES
+                os.truncate(self.keys_path, key_count * KEY_BYTES)
+                os.truncate(self.vectors_path, key_count * self.row_bytes)
+                with open(self.vectors_path, "ab") as f:
+                    f.write(np.asarray([vector for _, vector in new_rows], dtype=self.dtype).tobytes())
+                with open(self.keys_path, "ab") as f:
+                    f.write(b"".join(key for key, _ in new_rows))
+                self._refresh()
+                self.counters["writes"] += len(new_rows)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+            for key, vector in new_rows:
+                # Round-trip through the storage dtype so RAM and disk hits agree
+                self._remember(key, np.asarray(vector, dtype=self.dtype).astype(np.float32))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["ram_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = lookups - self.counters["misses"]
+            return dict(self.counters, entries=len(self._rows), ram_entries=len(self._ram),
+                        hit_rate=round(hits / lookups, 4) if lookups else 0.0)
@@ -1,36 +1,114 @@
 import numpy as np
 
-import torch
-import transformers
-from transformers import AutoTokenizer, AutoModel
+from config.config import BIOBERT_BACKEND, BIOBERT_MODEL_NAME
+from monitoring.metrics import count_model_call
+from preprocessing.embedding_cache import EmbeddingCache
+from preprocessing.model_registry import ModelRegistry
+
+MAX_LENGTH = 512
+# Bump whenever the pooling changes so cached vectors are not reused
+POOLING_VERSION = "last-layer-attention-mean-v1"
 
 
 class BioBertEmbedding:
-    def __init__(self):
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            "dmis-lab/biobert-base-cased-v1.1")
-        self.model = AutoModel.from_pretrained(
-            "dmis-lab/biobert-base-cased-v1.1", output_attentions=True)
+    def __init__(self, cache=None, backend=BIOBERT_BACKEND, model_name=BIOBERT_MODEL_NAME):
+        # Tokenizer and model are shared by every instance in the process
+        self.tokenizer, self.model = ModelRegistry.get_biobert(backend, model_name)
+        self.cache = cache if cache is not None else EmbeddingCache.shared()
+        # Approximate backends get their own cache entries so they never
+        # mix with (or serve) vectors of the exact model
+        self.cache_model_id = model_name if self.model.exact else f"{model_name}:{backend}"
 
     def generate_embedding(self, doc):
-        inputs = self.tokenizer(doc, return_tensors="pt",
-                                truncation=True, max_length=512, padding=True)
-        with torch.no_grad():
-            outputs = self.model(**inputs)
+        """
+        Embed a single text.
+
+        Parameters:
+            doc (str): Input text.
+
+        Returns:
+            np.ndarray: L2-normalised float32 vector of shape (hidden_size,).
+        """
+        return self.generate_embeddings([doc])[0]
+
+    def generate_embeddings(self, texts, batch_size=32):
+        """
+        Embed many texts with length-bucketed dynamic padding.
+
+        Texts are sorted by token length and batched so each batch is only
+        padded to its own longest sequence. Rows come back in input order.
+
+        Parameters:
+            texts (list[str]): Input texts.
+            batch_size (int): Maximum number of sequences per forward pass.
+
+        Returns:
+            np.ndarray: Contiguous float32 matrix of shape (len(texts), hidden_size).
+        """
+        if self.cache is None:
+            return self._compute_embeddings(texts, batch_size)
+
+        keys = [EmbeddingCache.key(self.cache_model_id, POOLING_VERSION, text) for text in texts]
+        cached = self.cache.get_many(keys)
+        missing = list({key: text for key, text in zip(keys, texts) if key not in cached}.items())
+        if missing:
+            computed = self._compute_embeddings([text for _, text in missing], batch_size)
+            self.cache.put_many([key for key, _ in missing], computed)
+            # Return what the cache stores, so hits and misses agree bit for bit
+            cached.update(zip((key for key, _ in missing), computed.astype(self.cache.dtype, copy=False)))
+
+        embeddings = np.empty((len(texts), self.model.hidden_size), dtype=np.float32)
+        for i, key in enumerate(keys):
+            embeddings[i] = cached[key]
+        return embeddings
+
+    def _compute_embeddings(self, texts, batch_size):
+        import torch
+
+        embeddings = np.empty((len(texts), self.model.hidden_size), dtype=np.float32)
+        if not texts:
+            return embeddings
+
+        encodings = self.tokenizer(list(texts), truncation=True, max_length=MAX_LENGTH)
+        lengths = [len(ids) for ids in encodings["input_ids"]]
+        order = np.argsort(lengths, kind="stable")
+
+        for start in range(0, len(order), batch_size):
+            batch_idx = order[start:start + batch_size]
+            batch = self.tokenizer.pad(
+                {key: [encodings[key][i] for i in batch_idx] for key in encodings.keys()},
+                return_tensors="pt")
+            with torch.no_grad():
+                hidden_states, last_attention = self.model(**batch)
+            count_model_call("biobert", len(batch_idx))
+            pooled = self._attention_pool(last_attention, hidden_states, batch["attention_mask"])
+            embeddings[batch_idx] = pooled.numpy()
+
+        return embeddings
+
+    @staticmethod
+    def _attention_pool(last_attention, hidden_states, attention_mask):
+        """
+        Attention-weighted mean pooling over the last layer, masked so that
+        padding tokens neither receive weight nor dilute the averages. For an
+        unpadded sequence this is exactly the original single-text pooling.
+        """
+        import torch
+
+        mask = attention_mask.bool()
+        lengths = attention_mask.sum(dim=1, keepdim=True).to(hidden_states.dtype)
+
         # Shape: [batch_size, num_heads, seq_len, seq_len]
-        attention_scores = torch.softmax(outputs.attentions[-1], dim=-1)
-        average_attention = attention_scores.mean(
-            dim=1)  # Average across attention heads
-        average_attention = average_attention.mean(
-            dim=2)  # Average across tokens
-        # Shape: (batch_size, seq_length, 1)
-        average_attention_expanded = average_attention.unsqueeze(-1)
-
-        weighted_hidden_states = average_attention_expanded * \
-            outputs.last_hidden_state  # Shape: (batch_size, seq_length, hidden_size)
-        weighted_hidden_states = weighted_hidden_states.mean(
-            dim=1).squeeze(dim=0)  # Shape: (batch_size, hidden_size)
-
-        # embedding = outputs.last_hidden_state[:, 0, :].squeeze()
-        # embedding = embedding/np.linalg.norm(embedding)
-        return weighted_hidden_states/np.linalg.norm(weighted_hidden_states)
+        attention_scores = last_attention.masked_fill(~mask[:, None, None, :], float("-inf"))
+        attention_scores = torch.softmax(attention_scores, dim=-1)
+        average_attention = attention_scores.mean(dim=1)  # Average across attention heads
+        # Average across the real tokens only. Shape: (batch_size, seq_length)
+        average_attention = average_attention.sum(dim=2) / lengths
+        average_attention = average_attention * mask
+
+        weighted_hidden_states = average_attention.unsqueeze(-1) * \
+            hidden_states  # Shape: (batch_size, seq_length, hidden_size)
+        weighted_hidden_states = weighted_hidden_states.sum(
+            dim=1) / lengths  # Shape: (batch_size, hidden_size)
+
+        return weighted_hidden_states / torch.linalg.norm(weighted_hidden_states, dim=-1, keepdim=True)
@@ -0,0 +1,206 @@
+import threading
+
+import torch
+
+from preprocessing.model_registry import BACKENDS, EXACT_BACKENDS
+
+
+class ReferenceAttentionModel(torch.nn.Module):
+    """
+    The original setup: the model is loaded with output_attentions=True, so
+    every forward pass materialises the attention tensors of all layers.
+    """
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask,
+                             token_type_ids=token_type_ids, output_attentions=True)
+        return outputs.last_hidden_state, outputs.attentions[-1]
+
+
+class LastLayerAttentionModel(torch.nn.Module):
+    """
+    Returns the last hidden state and the attention probabilities of the
+    last layer only. Hooks switch attention output on for the last
+    self-attention module alone, so the other layers never keep theirs.
+    """
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self._captured = threading.local()
+        last_self_attention = model.encoder.layer[-1].attention.self
+        last_self_attention.register_forward_pre_hook(self._request_attentions, with_kwargs=True)
+        last_self_attention.register_forward_hook(self._capture_attentions)
+
+    @staticmethod
+    def _request_attentions(module, args, kwargs):
+        # Older transformers pass output_attentions positionally (7th argument)
+        if "output_attentions" not in kwargs and len(args) > 6:
+            args = args[:6] + (True,) + args[7:]
+        else:
+            kwargs["output_attentions"] = True
+        return args, kwargs
+
+    def _capture_attentions(self, module, args, output):
+        self._captured.attentions = output[1]
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask,
+                             token_type_ids=token_type_ids)
+        attentions = self._captured.attentions
+        self._captured.attentions = None
+        return outputs.last_hidden_state, attentions
+
+
+class BioBertBackend:
+    """
+    A loaded BioBERT inference backend: called with a tokenized batch, it
+    returns (last_hidden_state, last-layer attention probabilities).
+    """
+    def __init__(self, name, module, hidden_size):
+        self.name = name
+        self.module = module
+        self.hidden_size = hidden_size
+        self.exact = name in EXACT_BACKENDS
+
+    def __call__(self, input_ids, attention_mask, token_type_ids=None):
+        if token_type_ids is None:
+            token_type_ids = torch.zeros_like(input_ids)
+        return self.module(input_ids, attention_mask, token_type_ids)
+
+
+def load_backend(name, model_name, num_threads=None):
+    """
+    Load BioBERT for the given inference backend.
+
+    Parameters:
+        name (str): "reference" (all-layer attentions, the original setup),
+            "last_layer" (last-layer attention only), "int8" (last_layer with
+            dynamic int8 quantization of the Linear layers), "compile"
+            (last_layer through torch.compile) or "torchscript" (last_layer
+            traced with torch.jit.trace).
+        model_name (str): Hugging Face model id.
+        num_threads (int): torch intra-op threads, when set.
+
+    Returns:
+        BioBertBackend
+    """
+    from transformers import AutoModel
+
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{name}', expected one of {BACKENDS}.")
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+    # Eager attention is the implementation that can return attention probabilities
+    model = AutoModel.from_pretrained(model_name, attn_implementation="eager")
+    model.eval()
+    hidden_size = model.config.hidden_size
+
+    if name == "reference":
+        return BioBertBackend(name, ReferenceAttentionModel(model), hidden_size)
+
+    if name == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    module = LastLayerAttentionModel(model).eval()
+
+    if name == "compile":
+        module = torch.compile(module, dynamic=True)
+    elif name == "torchscript":
+        example = torch.ones((2, 16), dtype=torch.long)
+        with torch.no_grad():
+            module = torch.jit.trace(module, (example, example, torch.zeros_like(example)),
+                                     check_trace=False)
+    return BioBertBackend(name, module, hidden_size)
+
+
+def _benchmark_backend(name, model_name, texts, batch_size, num_threads, repeats):
+    # Runs in a fresh process, so ru_maxrss is the peak of this backend alone
+    import resource
+    import time
+
+    from preprocessing.embeddings import BioBertEmbedding
+    from preprocessing.model_registry import ModelRegistry
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    start = time.perf_counter()
+    embedder = BioBertEmbedding(backend=name, model_name=model_name)
+    load_seconds = time.perf_counter() - start
+
+    # The first pass pays tracing/compilation and allocator warm-up
+    embeddings = embedder._compute_embeddings(texts, batch_size)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        embeddings = embedder._compute_embeddings(texts, batch_size)
+    seconds = (time.perf_counter() - start) / repeats
+
+    return {
+        "backend": name,
+        "load_seconds": round(load_seconds, 3),
+        "texts_per_second": round(len(texts) / seconds, 1),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "models": ModelRegistry.stats()["models"],
+        "embeddings": embeddings
+    }
+
+
+def compare_backends(texts, backends=BACKENDS, model_name=None, batch_size=32,
+                     num_threads=None, repeats=3, min_cosine=0.99):
+    """
+    Check every backend against the reference embeddings and report its
+    throughput and peak memory. Each backend runs in its own spawned process.
+
+    Parameters:
+        texts (list[str]): Texts to embed, ideally a sample of real abstracts.
+        backends (iterable[str]): Backends to compare; "reference" is always run.
+        model_name (str): Hugging Face model id (defaults to BIOBERT_MODEL_NAME).
+        batch_size (int): Sequences per forward pass.
+        num_threads (int): torch intra-op threads, when set.
+        repeats (int): Timed passes over `texts` after one warm-up pass.
+        min_cosine (float): Lowest per-text cosine similarity to the reference
+            that still passes the parity check.
+
+    Returns:
+        list[dict]: One report per backend, reference first.
+    """
+    import multiprocessing
+
+    import numpy as np
+
+    from config.config import BIOBERT_MODEL_NAME
+
+    model_name = model_name or BIOBERT_MODEL_NAME
+    names = ["reference"] + [name for name in backends if name != "reference"]
+    context = multiprocessing.get_context("spawn")
+
+    reports = []
+    reference = None
+    for name in names:
+        print(f"Benchmarking backend '{name}'...")
+        with context.Pool(processes=1) as pool:
+            try:
+                report = pool.apply(_benchmark_backend,
+                                    (name, model_name, list(texts), batch_size, num_threads, repeats))
+            except Exception as e:
+                if name == "reference":
+                    raise
+                # e.g. torch.compile without a working C++ toolchain
+                reports.append({"backend": name, "error": str(e)})
+                continue
+
+        embeddings = report.pop("embeddings")
+        if reference is None:
+            reference = embeddings
+        # Both sides are L2-normalised, so the row-wise dot product is the cosine
+        cosines = np.sum(reference.astype(np.float64) * embeddings, axis=1)
+        report["min_cosine"] = round(float(cosines.min()), 6) if len(cosines) else None
+        report["mean_cosine"] = round(float(cosines.mean()), 6) if len(cosines) else None
+        report["parity"] = bool(len(cosines) == 0 or cosines.min() >= min_cosine)
+        report["speedup"] = round(report["texts_per_second"] / reports[0]["texts_per_second"], 2) \
+            if reports else 1.0
+        reports.append(report)
+    return reports
@@ -0,0 +1,126 @@
+import threading
+import time
+
+import psutil
+
+from config.config import (BIOBERT_BACKEND, BIOBERT_MODEL_NAME, SCISPACY_NER_MODEL,
+                           SCISPACY_SEARCH_MODEL, TORCH_NUM_THREADS)
+
+WARM_UP_TEXT = "Periprosthetic joint infection after total knee arthroplasty."
+# BioBERT inference backends (preprocessing.inference_backends), named here so
+# they can be listed without importing torch. Backends whose embeddings match
+# "reference" up to float rounding; vectors from the others are cached under a
+# backend-specific model id
+EXACT_BACKENDS = ("reference", "last_layer", "compile", "torchscript")
+BACKENDS = EXACT_BACKENDS + ("int8",)
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of the heavy NLP models.
+
+    Every model is loaded at most once per process, no matter how many
+    SemanticSearch / ElasticsearchIndex / BioBertEmbedding /
+    NamedEntityExtraction instances ask for it.
+    """
+    _models = {}
+    _stats = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, name, loader):
+        """
+        Return the model registered under `name`, loading it with `loader` on first use.
+
+        Parameters:
+            name (str): Registry key.
+            loader (callable): Zero-argument function that builds the model.
+
+        Returns:
+            object: The shared model instance.
+        """
+        model = cls._models.get(name)
+        if model is not None:
+            return model
+
+        with cls._lock:
+            # Another thread may have finished loading while we waited
+            if name not in cls._models:
+                process = psutil.Process()
+                rss_before = process.memory_info().rss
+                start = time.perf_counter()
+                cls._models[name] = loader()
+                load_seconds = time.perf_counter() - start
+                cls._stats[name] = {
+                    "load_seconds": round(load_seconds, 3),
+                    "rss_delta_mb": round((process.memory_info().rss - rss_before) / 2**20, 1)
+                }
+                print(f"Loaded model '{name}' in {load_seconds:.2f}s "
+                      f"(+{cls._stats[name]['rss_delta_mb']} MB RSS).")
+        return cls._models[name]
+
+    @classmethod
+    def get_biobert(cls, backend=BIOBERT_BACKEND, model_name=BIOBERT_MODEL_NAME):
+        """
+        Parameters:
+            backend (str): Inference backend, see preprocessing.inference_backends.
+            model_name (str): Hugging Face model id.
+
+        Returns:
+            tuple: (tokenizer, BioBertBackend). The tokenizer is shared by all backends.
+        """
+        def load_tokenizer():
+            from transformers import AutoTokenizer
+
+            return AutoTokenizer.from_pretrained(model_name)
+
+        def load_model():
+            from preprocessing.inference_backends import load_backend
+
+            return load_backend(backend, model_name, num_threads=TORCH_NUM_THREADS)
+
+        tokenizer = cls.get(f"{model_name}:tokenizer", load_tokenizer)
+        return tokenizer, cls.get(f"{model_name}:{backend}", load_model)
+
+    @classmethod
+    def get_spacy(cls, name):
+        """
+        Returns:
+            spacy.language.Language: The ScispaCy pipeline `name`.
+        """
+        def load():
+            import spacy
+
+            return spacy.load(name)
+
+        return cls.get(name, load)
+
+    @classmethod
+    def warm_up(cls, spacy_models=(SCISPACY_SEARCH_MODEL, SCISPACY_NER_MODEL)):
+        """
+        Eagerly load BioBERT and the given ScispaCy pipelines and run one
+        inference through each, so the first real request pays no lazy
+        initialisation cost.
+        """
+        import torch
+
+        tokenizer, model = cls.get_biobert()
+        with torch.no_grad():
+            # Twice, so compiled backends are also past their first specialisation
+            for _ in range(2):
+                model(**tokenizer(WARM_UP_TEXT, return_tensors="pt"))
+
+        for name in spacy_models:
+            cls.get_spacy(name)(WARM_UP_TEXT)
+
+    @classmethod
+    def stats(cls):
+        """
+        Returns:
+            dict: Load time and resident memory delta for every loaded model.
+        """
+        process = psutil.Process()
+        return {
+            "models": dict(cls._stats),
+            "process_rss_mb": round(process.memory_info().rss / 2**20, 1)
+        }
@@ -1,9 +1,12 @@
 import re
-import spacy
+
+from config.config import SCISPACY_NER_MODEL
+from monitoring.metrics import count_model_call
+from preprocessing.model_registry import ModelRegistry
 
 class NamedEntityExtraction:
     def __init__(self):
-        self.nlp = spacy.load("en_ner_bc5cdr_md")
+        self.nlp = ModelRegistry.get_spacy(SCISPACY_NER_MODEL)
 
         # Define patterns and replacements for arthroplasty mapping
         self.replacements = [
@@ -24,6 +27,12 @@ class NamedEntityExtraction:
             (r'(?i)(joint\s+procedure)', 'TJA')
         ]
 
+        # All replacements as one alternation, tried in list order at each
+        # position, so the text is scanned once instead of once per pattern
+        self._normalizer = re.compile(
+            "|".join(f"(?P<r{i}>{pattern[len('(?i)'):]})" for i, (pattern, _) in enumerate(self.replacements)),
+            re.IGNORECASE)
+
     def normalize_entities(self, text):
         """
         Normalize entities in the text using predefined patterns.
@@ -34,9 +43,11 @@ class NamedEntityExtraction:
         Returns:
             str: Normalized text.
         """
-        for pattern, replacement in self.replacements:
-            text = re.sub(pattern, replacement, text)
-        return text
+        return self._normalizer.sub(self._replace, text)
+
+    def _replace(self, match):
+        replacement = self.replacements[int(match.lastgroup[1:])][1]
+        return replacement(match) if callable(replacement) else replacement
 
     def extract_ner(self, text):
         """
@@ -48,15 +59,43 @@ class NamedEntityExtraction:
         Returns:
             list: List of extracted and normalized entities.
         """
+        return self.extract_ner_batch([text])[0]
+
+    def extract_ner_batch(self, texts, batch_size=64, n_process=1):
+        """
+        Extract named entities from many texts, streamed through nlp.pipe
+        with every component the NER does not need disabled.
+
+        Parameters:
+            texts (iterable[str]): Input texts.
+            batch_size (int): Texts per nlp.pipe batch.
+            n_process (int): spaCy worker processes.
+
+        Returns:
+            list: One list of extracted and normalized entities per text.
+        """
+        # Normalize text before entity extraction
+        normalized_texts = (self.normalize_entities(text) for text in texts)
+        docs = self.nlp.pipe(normalized_texts, batch_size=batch_size, n_process=n_process,
+                             disable=self._unused_components())
+        entities = [self._entities_for_indexing(doc) for doc in docs]
+        count_model_call("scispacy_ner", len(entities))
+        return entities
+
+    def _unused_components(self):
+        # Keep the NER and whatever embedding layer it listens to
+        needed = {"ner"}
+        for name, component in self.nlp.pipeline:
+            if "ner" in getattr(component, "listening_components", []):
+                needed.add(name)
+        return [name for name in self.nlp.pipe_names if name not in needed]
+
+    def _entities_for_indexing(self, doc):
         entities = {
             "DISEASE": [],
             "CHEMICAL": []
         }
 
-        # Normalize text before entity extraction
-        normalized_text = self.normalize_entities(text)
-
-        doc = self.nlp(normalized_text)
         for ent in doc.ents:
             entities[ent.label_].append(ent.text)
 
@@ -75,4 +114,4 @@ class NamedEntityExtraction:
         if not has_arthroplasty_term:
             entities_for_indexing.append({"entity": "General", "label": "CATEGORY"})
 
-        return entities_for_indexing
\ No newline at end of file
+        return entities_for_indexing
@@ -0,0 +1,37 @@
+from config.config import SCISPACY_SEARCH_MODEL
+from monitoring.metrics import count_model_call
+from preprocessing.model_registry import ModelRegistry
+
+
+class TermExtraction:
+    """
+    Candidate query-expansion terms: the ScispaCy entities of a text, in
+    document order and with repeats, exactly as SemanticSearch counts them.
+    """
+    def __init__(self):
+        self.nlp = ModelRegistry.get_spacy(SCISPACY_SEARCH_MODEL)
+
+    def extract_terms(self, text):
+        """
+        Parameters:
+            text (str): Input text.
+
+        Returns:
+            list: Entity texts found in `text`.
+        """
+        doc = self.nlp(text)
+        count_model_call("scispacy_terms", 1)
+        return [ent.text for ent in doc.ents]
+
+    def extract_terms_batch(self, texts, batch_size=64):
+        """
+        Parameters:
+            texts (list[str]): Input texts.
+            batch_size (int): Texts per nlp.pipe batch.
+
+        Returns:
+            list: One list of entity texts per input text.
+        """
+        terms = [[ent.text for ent in doc.ents] for doc in self.nlp.pipe(texts, batch_size=batch_size)]
+        count_model_call("scispacy_terms", len(terms))
+        return terms
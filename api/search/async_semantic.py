@@ -0,0 +1,243 @@
+import asyncio
+import contextvars
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from config.config import KNN_K, KNN_NUM_CANDIDATES, SEARCH_MODE
+from monitoring.metrics import observe_elasticsearch, stage
+from search.index_state import IndexState
+from search.semantic import SemanticSearch, response_bytes
+
+
+class InferenceExecutor:
+    """
+    Bounded thread pool for model inference called from the event loop.
+
+    At most `max_workers` calls run at once and at most `max_pending` wait
+    for a worker; callers beyond that wait on the semaphore instead of
+    piling work into the pool's unbounded queue.
+    """
+    def __init__(self, max_workers=4, max_pending=64):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._slots = asyncio.Semaphore(max_workers + max_pending)
+
+    async def run(self, fn, *args, **kwargs):
+        # Run in a copy of the caller's context, so stage timings reach its request
+        context = contextvars.copy_context()
+        async with self._slots:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, partial(context.run, fn, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+class AsyncSemanticSearch(SemanticSearch):
+    """
+    SemanticSearch for the asyncio serving path: Elasticsearch round-trips go
+    through AsyncElasticsearch and every model call runs on the inference
+    executor, so the event loop never blocks.
+    """
+    def __init__(self, es_client, index_name, executor, vector_store=None):
+        super().__init__(es_client, index_name, vector_store=vector_store)
+        self.executor = executor
+
+    async def index_version_async(self):
+        return (await IndexState.shared(self.index_name).refresh_async(self.es_client)).version
+
+    async def _embed(self, text):
+        if hasattr(self.embedder, "submit"):
+            # The batcher resolves a future from its own thread: await it
+            # directly instead of parking an executor thread on it
+            return await asyncio.wrap_future(self.embedder.submit(text))
+        return await self.executor.run(self.embedder.generate_embedding, text)
+
+    async def apply_pseudo_relevant_feedback_async(self, query_embedding, topK, alpha=0.4, categories=None):
+        start = time.perf_counter()
+        response = await self.es_client.search(index=self.index_name,
+                                               body=self.build_prf_query(query_embedding, topK, categories))
+        request_end = time.perf_counter()
+        payload_bytes = response_bytes(response)
+        observe_elasticsearch("search", "prf_query", response["took"], payload_bytes)
+
+        hits = response["hits"]["hits"]
+        # May fall back to ScispaCy for documents without stored terms
+        topK_terms, topK_vectors, missing = await self.executor.run(self.read_prf_hits, hits)
+        if missing:
+            missing_response = await self.es_client.search(index=self.index_name,
+                                                           body=self.build_missing_vectors_query(missing))
+            self.fill_missing_vectors(hits, topK_vectors, missing_response)
+            payload_bytes += response_bytes(missing_response)
+            observe_elasticsearch("search", "prf_missing_vectors", missing_response["took"],
+                                  response_bytes(missing_response))
+        decode_end = time.perf_counter()
+
+        pseudo_embedding = self.pseudo_relevance_embedding(query_embedding, topK_vectors, alpha)
+        return pseudo_embedding, topK_terms, self.prf_stats(response, payload_bytes, start,
+                                                            request_end, decode_end)
+
+    async def prepare_query_vectors_async(self, query, alpha=0.7, categories=None):
+        """
+        Returns:
+            tuple: (query embedding as a list, expanded embedding as an np.ndarray, PRF stats)
+        """
+        with stage("search", "embed"):
+            query_embedding = (await self._embed(query)).tolist()
+
+        with stage("search", "prf_query"):
+            pseudo_relevance_embedding, topK_terms, prf_stats = \
+                await self.apply_pseudo_relevant_feedback_async(query_embedding, 100, categories=categories)
+
+        with stage("search", "expansion"):
+            expanded_query, expanded_query_embeddings = await self.executor.run(
+                self.expand_query, query, topK_terms, top_n=5)
+
+        # Merge with pseudo-relevance embedding
+        expanded_embedding = alpha * \
+            pseudo_relevance_embedding + \
+                (1 - alpha) * expanded_query_embeddings
+
+        return query_embedding, expanded_embedding, prf_stats
+
+    async def cached_query_vectors_async(self, key, query, alpha=0.7, categories=None):
+        # The shared cache tier does file or network I/O: keep it off the event loop
+        entry, tier = await self.executor.run(self.result_cache.get, "vectors", key)
+        if entry is not None:
+            return self.cached_vectors(entry, tier)
+        query_embedding, expanded_embedding, prf_stats = await self.prepare_query_vectors_async(
+            query, alpha, categories)
+        await self.executor.run(self.result_cache.put, "vectors", key,
+                                self.vectors_entry(query_embedding, expanded_embedding, prf_stats))
+        return query_embedding, expanded_embedding, prf_stats
+
+    async def execute_semantic_search_async(self, query, alpha=0.7, mode=SEARCH_MODE,
+                                            k=KNN_K, num_candidates=KNN_NUM_CANDIDATES, categories=None):
+        """
+        Async SemanticSearch.execute_semantic_search, through the same result cache.
+
+        Returns:
+            tuple: (Elasticsearch response, PRF stats)
+        """
+        cache = self.result_cache
+        with stage("search", "total"):
+            if cache is None:
+                query_embedding, expanded_embedding, prf_stats = await self.prepare_query_vectors_async(
+                    query, alpha, categories)
+            else:
+                with stage("search", "result_cache"):
+                    version = await self.index_version_async()
+                    results_key = self.results_key(version, query, alpha, mode, k, num_candidates, categories)
+                    entry, tier = await self.executor.run(cache.get, "results", results_key)
+                if entry is not None:
+                    return self.cached_results(entry, tier)
+                query_embedding, expanded_embedding, prf_stats = await self.cached_query_vectors_async(
+                    self.vectors_key(version, query, alpha, categories), query, alpha, categories)
+
+            es_query = self.build_final_query(query_embedding, expanded_embedding, mode=mode, k=k,
+                                              num_candidates=num_candidates, categories=categories)
+            with stage("search", "final_query"):
+                response = await self.es_client.search(index=self.index_name, body=es_query)
+        observe_elasticsearch("search", "final_query", response["took"], response_bytes(response))
+        if cache is not None:
+            await self.executor.run(self.cache_results, results_key, response, prf_stats)
+        return response, prf_stats
+
+    async def merge_batch_async(self, queries, keys, cached, searched):
+        """
+        Async SemanticSearch.merge_batch, over an async iterator of searched items.
+        """
+        for i, query in enumerate(queries):
+            if i in cached:
+                yield (query,) + self.cached_results(*cached[i])
+                continue
+            item = await searched.__anext__()
+            # Failed queries have no stats and are not cached
+            if item[2] is not None:
+                await self.executor.run(self.cache_results, keys[i], item[1], item[2])
+            yield item
+
+    async def execute_semantic_search_batch_async(self, queries, alpha=0.7, mode=SEARCH_MODE,
+                                                  k=KNN_K, num_candidates=KNN_NUM_CANDIDATES, categories=None):
+        """
+        Async SemanticSearch.execute_semantic_search_batch: one embedding
+        pass, one PRF _msearch and concurrent final _msearch requests for
+        the queries of `queries` that are not in the result cache.
+
+        Yields:
+            tuple: (query, response, prf stats) in query order, as soon as each is ready.
+        """
+        cache = self.result_cache
+        # Spans the whole stream, including the time its consumer takes
+        with stage("search_batch", "total"):
+            if cache is None:
+                async for item in self.search_uncached_batch_async(queries, alpha, mode, k, num_candidates,
+                                                                   categories):
+                    yield item
+                return
+            with stage("search_batch", "result_cache"):
+                version = await self.index_version_async()
+                keys = [self.results_key(version, query, alpha, mode, k, num_candidates, categories)
+                        for query in queries]
+                cached = await self.executor.run(self.cached_batch, keys)
+            pending = [query for i, query in enumerate(queries) if i not in cached]
+            searched = self.search_uncached_batch_async(pending, alpha, mode, k, num_candidates, categories)
+            try:
+                async for item in self.merge_batch_async(queries, keys, cached, searched):
+                    yield item
+            finally:
+                # Cancels the final queries still in flight when the stream is abandoned
+                await searched.aclose()
+
+    async def search_uncached_batch_async(self, queries, alpha=0.7, mode=SEARCH_MODE,
+                                          k=KNN_K, num_candidates=KNN_NUM_CANDIDATES, categories=None):
+        if not queries:
+            return
+        with stage("search_batch", "embed"):
+            query_embeddings = await self.executor.run(self.embedder.generate_embeddings, queries)
+
+        with stage("search_batch", "prf_query"):
+            start = time.perf_counter()
+            prf_responses = await self.msearch([self.build_prf_query(embedding, 100, categories)
+                                                for embedding in query_embeddings])
+            request_end = time.perf_counter()
+            payload_bytes = response_bytes(prf_responses)
+            observe_elasticsearch("search_batch", "prf_query", prf_responses["took"], payload_bytes)
+
+            # May fall back to ScispaCy for documents without stored terms
+            prf_hits, missing = await self.executor.run(self.read_prf_batch, prf_responses)
+            if missing:
+                missing_response = await self.es_client.search(index=self.index_name,
+                                                               body=self.build_missing_vectors_query(missing))
+                self.fill_missing_batch_vectors(prf_hits, missing_response)
+                payload_bytes += response_bytes(missing_response)
+                observe_elasticsearch("search_batch", "prf_missing_vectors", missing_response["took"],
+                                      response_bytes(missing_response))
+            decode_end = time.perf_counter()
+
+        with stage("search_batch", "expansion"):
+            final_queries = await self.executor.run(self.build_final_queries, queries, query_embeddings,
+                                                    prf_hits, alpha, mode=mode, k=k,
+                                                    num_candidates=num_candidates, categories=categories)
+        prf_stats = self.prf_stats(prf_responses, payload_bytes, start, request_end, decode_end)
+
+        chunks = self.final_query_chunks(final_queries)
+        # Every chunk is in flight at once; results go out in query order
+        tasks = [asyncio.ensure_future(self.msearch([final_queries[i] for i in chunk])) for chunk in chunks]
+        try:
+            requests = iter(zip(chunks, tasks))
+            final_responses = {}
+            for i, query in enumerate(queries):
+                if i in final_queries and i not in final_responses:
+                    chunk, task = next(requests)
+                    with stage("search_batch", "final_query"):
+                        response = await task
+                    observe_elasticsearch("search_batch", "final_query", response["took"],
+                                          response_bytes(response))
+                    final_responses.update(zip(chunk, response["responses"]))
+                yield self.batch_item(query, prf_responses["responses"][i], final_responses.get(i),
+                                      prf_stats, len(queries))
+        finally:
+            for task in tasks:
+                task.cancel()
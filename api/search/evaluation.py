@@ -0,0 +1,173 @@
+import time
+
+import numpy as np
+
+
+def recall_at_k(reference_ids, candidate_ids, k=50):
+    """
+    Fraction of the top-k reference ids that also appear in the top-k candidates.
+    """
+    reference = set(reference_ids[:k])
+    if not reference:
+        return 1.0
+    return len(reference & set(candidate_ids[:k])) / len(reference)
+
+
+def compare_retrieval_modes(search, queries, k=50, knn_k=100, num_candidates=500):
+    """
+    Compare "ann" retrieval against the exhaustive "exact" mode.
+
+    The query vectors are prepared once per query so both modes score the
+    exact same embeddings; only the final query differs.
+
+    Parameters:
+        search (SemanticSearch): Search instance bound to the index.
+        queries (list[str]): Evaluation queries.
+        k (int): Cut-off for recall@k.
+        knn_k (int): Nearest neighbours per field in "ann" mode.
+        num_candidates (int): HNSW candidates per shard in "ann" mode.
+
+    Returns:
+        dict: Per-query recall and latency, plus their means.
+    """
+    per_query = []
+    for query in queries:
+        query_embedding, expanded_embedding = search.prepare_query_vectors(query)
+
+        ids, latency, took = {}, {}, {}
+        for mode in ("exact", "ann"):
+            es_query = search.build_final_query(query_embedding, expanded_embedding, mode=mode,
+                                                k=knn_k, num_candidates=num_candidates)
+            es_query["size"] = k
+            start = time.perf_counter()
+            response = search.es_client.search(index=search.index_name, body=es_query)
+            latency[mode] = (time.perf_counter() - start) * 1000
+            took[mode] = response["took"]
+            ids[mode] = [hit["_id"] for hit in response["hits"]["hits"]]
+
+        per_query.append({
+            "query": query,
+            f"recall@{k}": recall_at_k(ids["exact"], ids["ann"], k),
+            "latency_ms": {mode: round(value, 1) for mode, value in latency.items()},
+            "took_ms": took
+        })
+
+    return {
+        "k": k,
+        "knn_k": knn_k,
+        "num_candidates": num_candidates,
+        f"mean_recall@{k}": float(np.mean([row[f"recall@{k}"] for row in per_query])) if per_query else None,
+        "mean_latency_ms": {
+            mode: round(float(np.mean([row["latency_ms"][mode] for row in per_query])), 1)
+            for mode in ("exact", "ann")
+        } if per_query else None,
+        "queries": per_query
+    }
+
+
+def _unit_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def compare_vector_options(es_client, store, query_vectors, options, k=10, num_candidates=100,
+                           field="biobert_embedding", fit_sample=5000, index_prefix="pubmed-tja-vectors",
+                           chunk_size=500, keep_indices=False):
+    """
+    Index the full-precision vectors of the vector store once per compression
+    option and compare knn search on each index against the exact
+    full-precision neighbours.
+
+    Parameters:
+        es_client (Elasticsearch): Cluster the scratch indices are created on.
+        store (VectorStore): Source of the document vectors.
+        query_vectors (np.ndarray): BioBERT query embeddings, one per row.
+        options (list[str]): VectorCompressor specs; the first is the baseline
+            the sizes and latencies are compared to.
+        k (int): Cut-off for recall@k.
+        num_candidates (int): HNSW candidates per shard.
+        fit_sample (int): Document vectors PCA options are fitted on.
+        keep_indices (bool): Leave the scratch indices behind for inspection.
+
+    Returns:
+        dict: recall@k, index size and query latency per option.
+    """
+    from elasticsearch import helpers
+
+    from indexing.vector_compression import VectorCompressor
+
+    matrix = np.asarray(store.matrix(field), dtype=np.float32)
+    ids = store.ids[:len(matrix)]
+    # Exact neighbours in the uncompressed space are the reference for every option
+    similarities = _unit_rows(query_vectors) @ _unit_rows(matrix).T
+    reference = [[ids[i] for i in np.argsort(-row, kind="stable")[:k]] for row in similarities]
+    rng = np.random.default_rng(0)
+    fit_rows = np.sort(rng.choice(len(matrix), min(fit_sample, len(matrix)), replace=False))
+
+    per_option = []
+    for i, option in enumerate(options):
+        compressor = VectorCompressor.parse(option).fit(matrix[fit_rows])
+        index_name = f"{index_prefix}-{i}"
+        if es_client.indices.exists(index=index_name):
+            es_client.indices.delete(index=index_name)
+        es_client.indices.create(index=index_name, body={
+            "mappings": {"properties": {field: compressor.field_mapping()}}
+        })
+
+        start = time.perf_counter()
+        actions = (
+            {"_index": index_name, "_id": ids[row], "_source": {field: vector.tolist()}}
+            for offset in range(0, len(matrix), chunk_size)
+            for row, vector in enumerate(compressor.encode(matrix[offset:offset + chunk_size]), start=offset)
+        )
+        helpers.bulk(es_client, actions, chunk_size=chunk_size)
+        es_client.indices.refresh(index=index_name)
+        # One segment per index, so the sizes compare like for like
+        es_client.indices.forcemerge(index=index_name, max_num_segments=1)
+        index_seconds = time.perf_counter() - start
+        stats = es_client.indices.stats(index=index_name, metric="store")
+        size_bytes = stats["_all"]["primaries"]["store"]["size_in_bytes"]
+
+        recalls, latency, took = [], [], []
+        for query_vector, expected in zip(query_vectors, reference):
+            body = {
+                "query": {"knn": {"field": field, "query_vector": compressor.encode_query(query_vector),
+                                  "k": k, "num_candidates": num_candidates}},
+                "_source": False,
+                "size": k
+            }
+            start = time.perf_counter()
+            response = es_client.search(index=index_name, body=body)
+            latency.append((time.perf_counter() - start) * 1000)
+            took.append(response["took"])
+            recalls.append(recall_at_k(expected, [hit["_id"] for hit in response["hits"]["hits"]], k))
+
+        if not keep_indices:
+            es_client.indices.delete(index=index_name)
+        per_option.append({
+            "option": compressor.name,
+            "index": index_name,
+            f"recall@{k}": round(float(np.mean(recalls)), 4) if recalls else None,
+            "size_bytes": size_bytes,
+            "vector_bytes": compressor.bytes_per_vector * len(matrix),
+            "index_seconds": round(index_seconds, 2),
+            "mean_latency_ms": round(float(np.mean(latency)), 2) if latency else None,
+            "p95_latency_ms": round(float(np.percentile(latency, 95)), 2) if latency else None,
+            "mean_took_ms": round(float(np.mean(took)), 2) if took else None
+        })
+
+    baseline = per_option[0] if per_option else None
+    for row in per_option:
+        row["size_vs_baseline"] = round(row["size_bytes"] / baseline["size_bytes"], 3) \
+            if baseline["size_bytes"] else None
+        row["latency_vs_baseline"] = round(row["mean_latency_ms"] / baseline["mean_latency_ms"], 3) \
+            if baseline["mean_latency_ms"] else None
+    return {
+        "field": field,
+        "documents": len(matrix),
+        "queries": len(query_vectors),
+        "k": k,
+        "num_candidates": num_candidates,
+        "options": per_option
+    }
@@ -0,0 +1,76 @@
+"""
+Entity facets for search responses and the CATEGORY filter.
+
+Facets of a search are counted from the entities of the hits it returns,
+so no request aggregates the whole index. Corpus-wide counts are
+computed once at index time and read from the index _meta (IndexState).
+"""
+from collections import Counter
+
+# Values of the CATEGORY entities NamedEntityExtraction assigns to every document
+CATEGORIES = ("TSA", "THA", "TKA", "TJA", "General")
+FACET_NAME = "tja-agg"
+
+
+def parse_categories(value):
+    """
+    Parameters:
+        value: The "categories" request parameter: None, one category or a list.
+
+    Returns:
+        tuple: The requested categories, or None for no filter.
+    """
+    if value is None or value == []:
+        return None
+    categories = [value] if isinstance(value, str) else value
+    if not isinstance(categories, list) or not all(category in CATEGORIES for category in categories):
+        raise ValueError(f"categories must be a list of {', '.join(CATEGORIES)}")
+    return tuple(sorted(set(categories)))
+
+
+def category_filter(categories):
+    """
+    Returns:
+        dict: Query matching the documents with a CATEGORY entity in `categories`.
+    """
+    return {
+        "nested": {
+            "path": "entities",
+            "query": {
+                "bool": {
+                    "filter": [
+                        {"term": {"entities.label": "CATEGORY"}},
+                        {"terms": {"entities.entity": list(categories)}}
+                    ]
+                }
+            }
+        }
+    }
+
+
+def facet_aggregation(counts, size=10):
+    """
+    Returns:
+        dict: Entity `counts` in the response shape of the nested "tja-agg"
+        terms aggregation the search used to run.
+    """
+    buckets = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return {
+        FACET_NAME: {
+            "doc_count": sum(counts.values()),
+            "labels": {
+                "doc_count_error_upper_bound": 0,
+                "sum_other_doc_count": sum(count for _, count in buckets[size:]),
+                "buckets": [{"key": key, "doc_count": count} for key, count in buckets[:size]]
+            }
+        }
+    }
+
+
+def entity_facets(hits, size=10):
+    """
+    Returns:
+        dict: Facets of the entities of the returned `hits`.
+    """
+    return facet_aggregation(Counter(entity["entity"] for hit in hits
+                                     for entity in hit["_source"].get("entities", [])), size)
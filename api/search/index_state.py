@@ -0,0 +1,84 @@
+"""
+Per-process view of the index an alias points to: its name and the _meta
+the indexer records (content version, global entity facet counts).
+
+It is re-read at most every INDEX_STATE_TTL seconds, so searches never pay
+a metadata round trip, and a rebuild (alias swap) or an incremental update
+(new content version) is picked up within that interval.
+"""
+import threading
+import time
+
+from config.config import INDEX_STATE_TTL
+from search.facets import facet_aggregation
+
+
+class IndexState:
+    """
+    Parameters:
+        alias (str): Alias (or index name) searches go through.
+        ttl (float): Seconds a read of the index metadata stays valid.
+    """
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, alias, ttl=INDEX_STATE_TTL):
+        self.alias = alias
+        self.ttl = ttl
+        self.index_name = None
+        self.meta = {}
+        self.checked_at = None
+
+    @classmethod
+    def shared(cls, alias):
+        """
+        Returns:
+            IndexState: The process-wide state of `alias`.
+        """
+        with cls._shared_lock:
+            if alias not in cls._shared:
+                cls._shared[alias] = cls(alias)
+            return cls._shared[alias]
+
+    @property
+    def stale(self):
+        return self.checked_at is None or time.monotonic() - self.checked_at > self.ttl
+
+    def invalidate(self):
+        self.checked_at = None
+
+    def update(self, mapping):
+        """
+        Parameters:
+            mapping (dict): Response of GET /<alias>/_mapping.
+        """
+        index_name, body = next(iter(mapping.items()))
+        self.index_name = index_name
+        self.meta = body["mappings"].get("_meta", {})
+        self.checked_at = time.monotonic()
+
+    def refresh(self, es_client, force=False):
+        if force or self.stale:
+            self.update(es_client.indices.get_mapping(index=self.alias))
+        return self
+
+    async def refresh_async(self, es_client, force=False):
+        if force or self.stale:
+            self.update(await es_client.indices.get_mapping(index=self.alias))
+        return self
+
+    @property
+    def version(self):
+        """Changes whenever the alias moves or the index content is updated."""
+        return f"{self.index_name}:{self.meta.get('content_version', '')}"
+
+    def global_facets(self, size=10):
+        """
+        Returns:
+            dict: Corpus-wide entity facets recorded at index time, or None
+            for an index that was built before they were recorded.
+        """
+        facets = self.meta.get("entity_facets")
+        if facets is None:
+            return None
+        return dict(facet_aggregation(facets["counts"], size), documents=facets["documents"])
@@ -0,0 +1,423 @@
+import os
+import threading
+import time
+
+from collections import Counter
+
+import numpy as np
+
+from config.config import (KNN_K, KNN_NUM_CANDIDATES, LOCAL_IVF_NPROBE, LOCAL_SEARCH_FALLBACK, SEARCH_ENGINE,
+                           SEARCH_MODE, VECTOR_STORE_DIR)
+from elasticsearch_client import ElasticsearchClient
+from monitoring.metrics import stage
+from search.facets import facet_aggregation
+from search.semantic import SemanticSearch
+from search.vector_store import FIELDS, VectorStore
+
+# Fields the final query returns, as in SemanticSearch.build_final_query
+RESULT_FIELDS = ("title", "abstract", "authors", "doi", "entities")
+# Constant terms of the two script_score clauses of the final query
+BIOBERT_SCORE_OFFSET = 2.5
+TITLE_SCORE_OFFSET = 1.5
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def top_k(scores, k):
+    """
+    Returns:
+        np.ndarray: Indices of the `k` highest scores, best first.
+    """
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+class IVFIndex:
+    """
+    Inverted-file index over one vector field: rows are clustered around
+    `n_lists` spherical k-means centroids and a query only scores the rows
+    of its `nprobe` nearest lists. Rows appended to the store after the
+    index was built are always scored exhaustively, so nothing is missed.
+
+    On disk it is a single `ivf-<field>.npz` in the vector store directory.
+    """
+    def __init__(self, centroids, list_offsets, list_rows, rows):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.rows = rows
+
+    @staticmethod
+    def file_path(store_path, field):
+        return os.path.join(store_path, f"ivf-{field}.npz")
+
+    @classmethod
+    def build(cls, matrix, n_lists, iterations=10, sample_size=100000, seed=0):
+        """
+        Parameters:
+            matrix (np.ndarray): L2-normalised vectors, one row per document.
+            n_lists (int): Number of clusters (around 4 * sqrt(rows) works well).
+            iterations (int): k-means iterations over the training sample.
+            sample_size (int): Rows the centroids are trained on.
+
+        Returns:
+            IVFIndex
+        """
+        rng = np.random.default_rng(seed)
+        rows = len(matrix)
+        n_lists = max(1, min(n_lists, rows))
+        sample = np.asarray(matrix[np.sort(rng.choice(rows, min(sample_size, rows), replace=False))],
+                            dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty clusters keep their previous centroid
+            centroids = np.where(norms > 0, sums / np.where(norms > 0, norms, 1), centroids)
+
+        # Assign every row in chunks, so memory stays flat on large stores
+        assignment = np.concatenate([np.argmax(np.asarray(matrix[start:start + 65536]) @ centroids.T, axis=1)
+                                     for start in range(0, rows, 65536)])
+        list_rows = np.argsort(assignment, kind="stable").astype(np.int64)
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+        return cls(centroids.astype(np.float32), list_offsets.astype(np.int64), list_rows, rows)
+
+    def save(self, path):
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, list_offsets=self.list_offsets,
+                 list_rows=self.list_rows, rows=np.int64(self.rows))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["centroids"], data["list_offsets"], data["list_rows"], int(data["rows"]))
+
+    def candidates(self, query_vector, nprobe, total_rows):
+        """
+        Returns:
+            np.ndarray: Rows to score for `query_vector`.
+        """
+        lists = top_k(self.centroids @ query_vector, min(nprobe, len(self.centroids)))
+        rows = [self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]] for i in lists]
+        rows.append(np.arange(self.rows, total_rows))
+        rows = np.concatenate(rows)
+        # An index left over from a larger, since rebuilt store
+        return rows[rows < total_rows] if self.rows > total_rows else rows
+
+
+class LocalSearchEngine:
+    """
+    In-process retrieval over a VectorStore written with sources: exact
+    top-k is one BLAS matrix-vector product plus argpartition, approximate
+    top-k goes through an IVFIndex when one has been built. Rows superseded
+    by a re-indexed document are never returned. Responses have the shape
+    of Elasticsearch search responses.
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, store, nprobe=LOCAL_IVF_NPROBE):
+        if not store.has_sources:
+            raise ValueError(f"The vector store at '{store.path}' has no document sources; "
+                             "re-create the index to use the local search engine.")
+        self.store = store
+        self.nprobe = nprobe
+        self.ivf = {}
+        self._entities = {}
+        self._category_matches = {}
+        self._global_entity_counts = None
+        self._generation = store.generation
+        self._lock = threading.Lock()
+        self.load_ivf()
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns:
+            LocalSearchEngine: The engine over the vector store configured in
+            config.py, or None when that store does not exist or has no sources.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                store = VectorStore.shared()
+                if store is not None and store.has_sources:
+                    cls._shared = cls(store)
+        return cls._shared
+
+    def sync(self):
+        """
+        Pick up rows appended to the store and, when it was swapped for a
+        rebuilt one, the new store's IVF indexes.
+        """
+        self.store.sync()
+        if self.store.generation != self._generation:
+            with self._lock:
+                self.ivf = {}
+                self._entities = {}
+                self._category_matches = {}
+                self._global_entity_counts = None
+                self._generation = self.store.generation
+                self.load_ivf()
+
+    def load_ivf(self):
+        for field in self.store.fields:
+            path = IVFIndex.file_path(self.store.path, field)
+            if os.path.exists(path):
+                self.ivf[field] = IVFIndex.load(path)
+
+    def knn(self, field, query_vector, k, approximate=False, mask=None):
+        """
+        Nearest neighbours of `query_vector` by cosine similarity.
+
+        Parameters:
+            field (str): Vector field name.
+            query_vector (array-like): Query vector (need not be normalised).
+            k (int): Number of neighbours.
+            approximate (bool): Use the IVF index of `field` when there is one.
+            mask (np.ndarray): Rows that may be returned (see category_mask);
+                all the rows that are not superseded when None.
+
+        Returns:
+            tuple: (rows, cosine similarities), best first.
+        """
+        query_vector = _unit(query_vector)
+        matrix = self.store.matrix(field)
+        superseded = self.store.superseded
+        if approximate and field in self.ivf:
+            # Sorted rows make the gather from the memory map sequential
+            rows = np.sort(self.ivf[field].candidates(query_vector, self.nprobe, len(matrix)))
+            if mask is not None:
+                rows = rows[mask[rows]]
+            elif len(superseded):
+                rows = rows[~np.isin(rows, superseded)]
+            scores = matrix[rows] @ query_vector
+            available = len(scores)
+        else:
+            rows = None
+            scores = matrix @ query_vector
+            if mask is not None:
+                scores[~mask] = -np.inf
+                available = int(np.count_nonzero(mask))
+            else:
+                scores[superseded] = -np.inf
+                available = len(scores) - len(superseded)
+        best = top_k(scores, min(k, available))
+        return (best if rows is None else rows[best]), scores[best]
+
+    def hit(self, row, score, fields=None):
+        source = self.store.source(int(row))
+        if fields is not None:
+            source = {field: source[field] for field in fields if field in source}
+        return {"_id": self.store.ids[row], "_score": float(score), "_source": source}
+
+    def entities(self, row):
+        """
+        Returns:
+            tuple: (entity, label) pairs of the document in `row` (read once, then cached).
+        """
+        entities = self._entities.get(row)
+        if entities is None:
+            entities = tuple((entity["entity"], entity["label"])
+                             for entity in self.store.source(row).get("entities", []))
+            self._entities[row] = entities
+        return entities
+
+    def category_mask(self, categories):
+        """
+        Returns:
+            np.ndarray: Boolean mask of the rows that are not superseded and
+            have a CATEGORY entity in `categories`. Rows are classified once,
+            and only the rows appended since are classified on later calls.
+        """
+        categories = frozenset(categories)
+        with self._lock:
+            matches = self._category_matches.get(categories, np.zeros(0, dtype=bool))
+            total = len(self.store)
+            if len(matches) < total:
+                appended = [any(label == "CATEGORY" and entity in categories
+                                for entity, label in self.entities(row))
+                            for row in range(len(matches), total)]
+                matches = np.concatenate([matches, np.asarray(appended, dtype=bool)])
+                self._category_matches[categories] = matches
+        mask = matches.copy()
+        mask[self.store.superseded] = False
+        return mask
+
+    def global_facets(self, size=10):
+        """
+        Returns:
+            dict: Entity facets of the whole store (counted once per store
+            size), shaped like IndexState.global_facets.
+        """
+        with self._lock:
+            total = len(self.store)
+            if self._global_entity_counts is None or self._global_entity_counts[0] != total:
+                superseded = set(self.store.superseded.tolist())
+                live = [row for row in range(total) if row not in superseded]
+                self._global_entity_counts = (total, len(live), Counter(entity for row in live
+                                                                        for entity, _ in self.entities(row)))
+            _, documents, counts = self._global_entity_counts
+        return dict(facet_aggregation(counts, size), documents=documents)
+
+    def dual_field_search(self, query_embedding, expanded_embedding, mode=SEARCH_MODE,
+                          k=KNN_K, num_candidates=KNN_NUM_CANDIDATES, size=50, categories=None):
+        """
+        The final query of SemanticSearch: every candidate scores
+        cos(expanded, biobert_embedding) + 2.5 + cos(query, title_embedding) + 1.5.
+
+        Parameters:
+            mode (str): "exact" scores every document; "ann" scores the union
+                of the k nearest neighbours on both vector fields.
+            k (int): Nearest neighbours per field in "ann" mode.
+            num_candidates (int): Unused; the IVF index is tuned with nprobe.
+            categories (tuple): CATEGORY entities to narrow to before scoring.
+
+        Returns:
+            dict: Elasticsearch-shaped search response.
+        """
+        start = time.perf_counter()
+        expanded_unit, query_unit = _unit(expanded_embedding), _unit(query_embedding)
+        mask = self.category_mask(categories) if categories else None
+        if mode == "exact":
+            rows = None
+            scores = self.store.matrix("biobert_embedding") @ expanded_unit + \
+                self.store.matrix("title_embedding") @ query_unit
+            if mask is not None:
+                scores[~mask] = -np.inf
+                matched = int(np.count_nonzero(mask))
+            else:
+                scores[self.store.superseded] = -np.inf
+                matched = len(scores) - len(self.store.superseded)
+        elif mode == "ann":
+            rows = np.union1d(self.knn("biobert_embedding", expanded_unit, k, approximate=True, mask=mask)[0],
+                              self.knn("title_embedding", query_unit, k, approximate=True, mask=mask)[0])
+            scores = self.store.matrix("biobert_embedding")[rows] @ expanded_unit + \
+                self.store.matrix("title_embedding")[rows] @ query_unit
+            matched = len(scores)
+        else:
+            raise ValueError(f"Unknown search mode '{mode}', expected 'ann' or 'exact'.")
+        scores = scores + BIOBERT_SCORE_OFFSET + TITLE_SCORE_OFFSET
+
+        best = top_k(scores, min(size, matched))
+        best_rows = best if rows is None else rows[best]
+        hits = [self.hit(row, score, RESULT_FIELDS) for row, score in zip(best_rows, scores[best])]
+        return {
+            "took": int((time.perf_counter() - start) * 1000),
+            "timed_out": False,
+            "hits": {
+                "total": {"value": matched, "relation": "eq"},
+                "max_score": hits[0]["_score"] if hits else None,
+                "hits": hits
+            }
+        }
+
+    def get_document(self, doc_id):
+        """
+        Returns:
+            dict: The stored fields of `doc_id`, or None when it is not in the store.
+        """
+        row = self.store.row(doc_id)
+        return None if row is None else self.store.source(row)
+
+
+class LocalSemanticSearch(SemanticSearch):
+    """
+    SemanticSearch with the same PRF, expansion and dual-field scoring
+    steps, answered by a LocalSearchEngine instead of Elasticsearch.
+    """
+    def __init__(self, engine):
+        super().__init__(None, None, vector_store=engine.store)
+        self.engine = engine
+
+    def apply_pseudo_relevant_feedback(self, query_embedding, topK, alpha=0.4, categories=None):
+        start = time.perf_counter()
+        # The PRF query keeps the best 50 of its topK knn hits
+        mask = self.engine.category_mask(categories) if categories else None
+        rows, _ = self.engine.knn("biobert_embedding", query_embedding, min(topK, 50), approximate=True, mask=mask)
+        request_end = time.perf_counter()
+
+        sources = [self.engine.store.source(int(row)) for row in rows]
+        topK_terms = [source["expansion_terms"] if "expansion_terms" in source
+                      else self.extract_terms(source["abstract"]) for source in sources]
+        topK_vectors = np.asarray(self.engine.store.matrix("biobert_embedding")[np.sort(rows)], dtype=np.float32)
+        decode_end = time.perf_counter()
+
+        pseudo_embedding = self.pseudo_relevance_embedding(query_embedding, topK_vectors, alpha)
+        self.last_prf_stats = {
+            "vector_source": "local",
+            "response_bytes": 0,
+            "took_ms": round((request_end - start) * 1000, 2),
+            "request_ms": round((request_end - start) * 1000, 2),
+            "decode_ms": round((decode_end - request_end) * 1000, 2),
+            "compute_ms": round((time.perf_counter() - decode_end) * 1000, 2)
+        }
+        return pseudo_embedding, topK_terms
+
+    def execute_semantic_search(self, query, alpha=0.7, mode=SEARCH_MODE,
+                                k=KNN_K, num_candidates=KNN_NUM_CANDIDATES, categories=None):
+        self.engine.sync()
+        with stage("search", "total"):
+            query_embedding, expanded_embedding = self.prepare_query_vectors(query, alpha, categories)
+            with stage("search", "final_query"):
+                return self.engine.dual_field_search(query_embedding, expanded_embedding, mode=mode,
+                                                     k=k, num_candidates=num_candidates, categories=categories)
+
+    def execute_semantic_search_batch(self, queries, alpha=0.7, mode=SEARCH_MODE,
+                                      k=KNN_K, num_candidates=KNN_NUM_CANDIDATES, categories=None):
+        # No round trips to save in-process: answer the queries one by one,
+        # so each result can be streamed as soon as it is ready
+        for query in queries:
+            response = self.execute_semantic_search(query, alpha, mode=mode, k=k, num_candidates=num_candidates,
+                                                    categories=categories)
+            yield query, response, self.last_prf_stats
+
+
+def local_engine_for(error=None):
+    """
+    The local engine to answer a request with: always when SEARCH_ENGINE is
+    "local", and as a fallback when Elasticsearch failed with `error`.
+
+    Returns:
+        LocalSearchEngine: Or None to use (or keep the error of) Elasticsearch.
+    """
+    if SEARCH_ENGINE == "local":
+        engine = LocalSearchEngine.shared()
+        if engine is None:
+            raise RuntimeError("SEARCH_ENGINE is 'local' but there is no vector store with document sources.")
+        return engine
+    if error is not None and LOCAL_SEARCH_FALLBACK and ElasticsearchClient.is_unavailable(error):
+        engine = LocalSearchEngine.shared()
+        if engine is not None:
+            print(f"Elasticsearch unavailable ({error}), answering from the local search engine.")
+        return engine
+    return None
+
+
+def build_ivf_indexes(path=VECTOR_STORE_DIR, n_lists=None, fields=FIELDS):
+    """
+    Build and save an IVF index for every vector field of the store at `path`.
+
+    Parameters:
+        n_lists (int): Lists per index (defaults to 4 * sqrt(rows)).
+
+    Returns:
+        dict: Build time and list count per field.
+    """
+    store = VectorStore(path)
+    report = {}
+    for field in fields:
+        start = time.perf_counter()
+        lists = n_lists or max(1, int(4 * np.sqrt(len(store))))
+        IVFIndex.build(store.matrix(field), lists).save(IVFIndex.file_path(path, field))
+        report[field] = {"lists": lists, "rows": len(store), "seconds": round(time.perf_counter() - start, 2)}
+        print(f"Built IVF index for '{field}' with {lists} lists over {len(store)} rows.")
+    return report
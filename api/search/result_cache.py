@@ -0,0 +1,259 @@
+"""
+Two-tier cache in front of SemanticSearch: final ranked results, and the
+query vectors (query embedding plus the PRF/expansion blend) they were
+scored with, so a repeated query skips the model passes and both
+Elasticsearch round trips, and the same query with another mode or k
+skips everything but the final query.
+
+Keys hold the normalised query, the search parameters, the embedding
+model and the index version (IndexState.version: the index the alias
+points to and its content version). An alias swap or an incremental
+reindex therefore makes every older entry unreachable; those entries
+then age out through the LRU bound and the TTL.
+
+The first tier is an in-process LRU. The optional second tier is shared
+by all workers: a SQLite file for the processes of one host, or Redis
+for several hosts.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from collections import OrderedDict
+
+from config.config import (RESULT_CACHE_ENABLED, RESULT_CACHE_RAM_ENTRIES, RESULT_CACHE_SHARED,
+                           RESULT_CACHE_SHARED_ENTRIES, RESULT_CACHE_TTL)
+from monitoring.metrics import count_cache_lookup
+
+
+def normalise_query(query):
+    """
+    Collapse whitespace, which the tokenizer ignores anyway. Case is kept:
+    BioBERT is cased, so "TKA" and "tka" embed (and rank) differently.
+    """
+    return " ".join(query.split())
+
+
+def encode_entry(value):
+    return zlib.compress(json.dumps(value).encode("utf-8"), 1)
+
+
+def decode_entry(data):
+    return json.loads(zlib.decompress(data))
+
+
+class SqliteResultStore:
+    """
+    Shared tier in a SQLite file that every worker process of the host
+    opens. Expired rows, and the least recently used ones beyond
+    `max_entries`, are pruned every `prune_every` writes.
+    """
+    def __init__(self, path, max_entries=5000, timeout=0.5, prune_every=64):
+        self.path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.prune_every = prune_every
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = None
+        self._pid = None
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # A connection must not cross a fork: every process opens its own
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                                         check_same_thread=False)
+            # Readers never wait for the writer
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                               "expires_at REAL NOT NULL, used_at REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS results_used_at ON results (used_at)")
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT value FROM results WHERE key = ? AND expires_at > ?",
+                                     (key, now)).fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE results SET used_at = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key, data, ttl):
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (key, data, now + ttl, now))
+            self._writes += 1
+            if self._writes % self.prune_every == 0:
+                connection.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+                connection.execute("DELETE FROM results WHERE key IN (SELECT key FROM results "
+                                   "ORDER BY used_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def clear(self):
+        with self._lock:
+            self._connect().execute("DELETE FROM results")
+
+
+class RedisResultStore:
+    """
+    Shared tier in Redis. Entries expire through the key TTL; the size
+    bound is the server's maxmemory with an allkeys-lru policy.
+    """
+    def __init__(self, url, timeout=0.5, prefix="pubmed-results:"):
+        import redis
+
+        # redis-py replaces its pooled connections after a fork by itself
+        self.client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def put(self, key, data, ttl):
+        self.client.set(self.prefix + key, data, ex=max(1, int(ttl)))
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+def shared_store(location, max_entries=5000):
+    """
+    Returns:
+        The shared tier at `location`: a redis:// (or rediss://) URL, or
+        the path of a SQLite file. None for no shared tier.
+    """
+    if not location:
+        return None
+    if location.startswith(("redis://", "rediss://", "unix://")):
+        return RedisResultStore(location)
+    return SqliteResultStore(location, max_entries=max_entries)
+
+
+class ResultCache:
+    """
+    Parameters:
+        ram_entries (int): Entries kept in the in-process LRU tier.
+        ttl (float): Seconds an entry stays valid in either tier.
+        store: Shared tier (SqliteResultStore or RedisResultStore), or None.
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, ram_entries=256, ttl=600, store=None):
+        self.ram_entries = ram_entries
+        self.ttl = ttl
+        self.store = store
+        self._ram = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"ram_hits": 0, "shared_hits": 0, "misses": 0, "writes": 0, "shared_errors": 0}
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns:
+            ResultCache: The process-wide cache configured in config.py, or
+            None when result caching is disabled.
+        """
+        with cls._shared_lock:
+            if cls._shared is None and RESULT_CACHE_ENABLED:
+                cls._shared = cls(RESULT_CACHE_RAM_ENTRIES, RESULT_CACHE_TTL,
+                                  shared_store(RESULT_CACHE_SHARED, RESULT_CACHE_SHARED_ENTRIES))
+        return cls._shared
+
+    @staticmethod
+    def key(kind, **parts):
+        """
+        Returns:
+            str: Digest of the entry `kind` and every part of its key.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(json.dumps([kind, parts], sort_keys=True).encode("utf-8"))
+        return f"{kind}:{digest.hexdigest()}"
+
+    def _remember(self, key, value, expires_at):
+        self._ram[key] = (expires_at, value)
+        self._ram.move_to_end(key)
+        if len(self._ram) > self.ram_entries:
+            self._ram.popitem(last=False)
+
+    def _shared_error(self, action, error):
+        # The shared tier is an optimisation: a search never fails because of it
+        with self._lock:
+            self.counters["shared_errors"] += 1
+        print(f"Result cache: could not {action} the shared tier ({error}).")
+
+    def get(self, kind, key):
+        """
+        Returns:
+            tuple: (value, "ram" or "shared") on a hit, (None, None) on a
+            miss. Values are shared between hits: do not modify them.
+        """
+        with self._lock:
+            entry = self._ram.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._ram.move_to_end(key)
+                self.counters["ram_hits"] += 1
+                count_cache_lookup(kind, "ram_hit")
+                return entry[1], "ram"
+            if entry is not None:
+                del self._ram[key]
+
+        data = None
+        if self.store is not None:
+            try:
+                data = self.store.get(key)
+            except Exception as e:
+                self._shared_error("read", e)
+        if data is None:
+            with self._lock:
+                self.counters["misses"] += 1
+            count_cache_lookup(kind, "miss")
+            return None, None
+
+        # Wall-clock expiry, which every process agrees on
+        expires_at, value = decode_entry(data)
+        with self._lock:
+            self._remember(key, value, time.monotonic() + expires_at - time.time())
+            self.counters["shared_hits"] += 1
+        count_cache_lookup(kind, "shared_hit")
+        return value, "shared"
+
+    def put(self, kind, key, value):
+        """
+        Parameters:
+            value: JSON-serialisable entry, which must not be modified afterwards.
+        """
+        with self._lock:
+            self._remember(key, value, time.monotonic() + self.ttl)
+            self.counters["writes"] += 1
+        if self.store is not None:
+            try:
+                self.store.put(key, encode_entry([time.time() + self.ttl, value]), self.ttl)
+            except Exception as e:
+                self._shared_error("write", e)
+
+    def clear(self):
+        with self._lock:
+            self._ram.clear()
+        if self.store is not None:
+            self.store.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["ram_hits"] + self.counters["shared_hits"] + self.counters["misses"]
+            return dict(self.counters, ram_entries=len(self._ram),
+                        shared=type(self.store).__name__ if self.store is not None else None,
+                        hit_rate=round((lookups - self.counters["misses"]) / lookups, 4) if lookups else 0.0)
@@ -1,130 +1,601 @@
+import time
+
 import numpy as np
-import spacy
 
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from elasticsearch import Elasticsearch
+from itertools import chain
+
+from config.config import (EMBEDDING_BATCHER_ENABLED, KNN_K, KNN_NUM_CANDIDATES, SEARCH_BATCH_STREAM_CHUNK,
+                           SEARCH_MODE)
+from indexing.vector_compression import VectorCompressor
+from monitoring.metrics import observe_elasticsearch, stage
+from preprocessing.batcher import EmbeddingBatcher
 from preprocessing.embeddings import BioBertEmbedding
+from search.facets import category_filter, entity_facets
+from search.index_state import IndexState
+from search.result_cache import ResultCache, normalise_query
+from search.vector_store import VectorStore
+
+
+def response_bytes(response):
+    """Size of an Elasticsearch response body on the wire, when known."""
+    meta = getattr(response, "meta", None)
+    length = meta.headers.get("content-length") if meta is not None else None
+    return int(length) if length is not None else 0
+
+
+def format_search_response(query, response, prf_stats, engine):
+    """
+    Returns:
+        dict: The /search response body of `query`.
+    """
+    hits = response.get("hits", {}).get("hits", [])
+
+    # Format the results
+    results = [
+        {
+            "id": hit["_id"],
+            "score": hit["_score"],
+            "source": hit["_source"]
+        } for hit in hits
+    ]
+
+    return {
+        "total_results": response.get("hits").get("total", {}).get("value", 0),
+        "returned_results": len(hits),
+        "query": query,
+        "results": results,
+        # Facets of the returned hits, not of the whole index
+        "agg_data": entity_facets(hits),
+        "prf_stats": prf_stats,
+        "engine": engine
+    }
 
 
 class SemanticSearch:
-    def __init__(self, es_client, index_name):
+    def __init__(self, es_client, index_name, vector_store=None, result_cache=None):
         self.es_client = es_client
         self.index_name = index_name
-        self.embedder = BioBertEmbedding()
-        # Load ScispaCy biomedical model
-        self.nlp = spacy.load("en_core_sci_md")
+        # Concurrent searches share batched forward passes through the batcher
+        self.embedder = EmbeddingBatcher.shared() if EMBEDDING_BATCHER_ENABLED else BioBertEmbedding()
+        self.vector_store = vector_store if vector_store is not None else VectorStore.shared()
+        # Query vectors are encoded the way the indexed document vectors were
+        self.compressor = VectorCompressor.shared()
+        # None when RESULT_CACHE_ENABLED is off
+        self.result_cache = result_cache if result_cache is not None else ResultCache.shared()
+        self.last_prf_stats = None
+        self._term_extraction = None
 
     def extract_terms(self, text):
-        doc = self.nlp(text)
-        terms = [ent.text for ent in doc.ents]
-        return terms
-
-    def expand_query(self, original_query, top_documents, top_n=5):
-        print("Expanding query...")
-        expanded_terms = []
-        for doc in top_documents:
-            expanded_terms.extend(self.extract_terms(doc))
-        expanded_terms = Counter(expanded_terms).most_common(top_n)
-        expanded_query_terms = [term[0] for term in expanded_terms]
-        expanded_query = original_query + " " + " ".join(expanded_query_terms)
+        # Only needed for documents indexed before expansion terms were stored
+        if self._term_extraction is None:
+            from preprocessing.terms import TermExtraction
+            self._term_extraction = TermExtraction()
+        with stage("search", "term_extraction"):
+            return self._term_extraction.extract_terms(text)
+
+    def expand_query(self, original_query, top_document_terms, top_n=5):
+        """
+        Expand the query with the most frequent terms of the pseudo-relevant
+        documents. The terms were extracted at index time, so this is only
+        counting plus embedding lookups.
+
+        Parameters:
+            original_query (str): User query.
+            top_document_terms (list[list[str]]): Expansion terms per document, in hit order.
+            top_n (int): Number of terms to add.
+        """
+        expanded_query, expanded_query_terms = self.expansion_terms(original_query, top_document_terms, top_n)
 
         # Generate embeddings for the expanded terms
-        expanded_term_embeddings = [
-            self.embedder.generate_embedding(term) for term in expanded_query_terms
-        ]
+        expanded_term_embeddings = self.embedder.generate_embeddings(expanded_query_terms)
         expanded_term_embeddings = np.mean(expanded_term_embeddings, axis=0)
         return expanded_query, np.array(expanded_term_embeddings)
 
-    def apply_pseudo_relevant_feedback(self, query_embedding, topK, alpha=0.4):
+    @staticmethod
+    def expansion_terms(original_query, top_document_terms, top_n=5):
+        """
+        Returns:
+            tuple: (expanded query text, the `top_n` most frequent terms)
+        """
+        expanded_terms = Counter(chain.from_iterable(top_document_terms)).most_common(top_n)
+        expanded_query_terms = [term[0] for term in expanded_terms]
+        return original_query + " " + " ".join(expanded_query_terms), expanded_query_terms
+
+    @staticmethod
+    def knn_clause(field, query_vector, k, num_candidates=None, categories=None):
+        knn = {"field": field, "query_vector": query_vector, "k": k}
+        if num_candidates is not None:
+            knn["num_candidates"] = num_candidates
+        if categories:
+            # Pre-filter: the k neighbours are all taken from the requested categories
+            knn["filter"] = category_filter(categories)
+        return {"knn": knn}
+
+    def build_prf_query(self, query_embedding, topK, categories=None):
+        # Document vectors come from the memory-mapped store when there is
+        # one, so Elasticsearch does not have to JSON-encode 50 x 768 floats
+        use_store = self.vector_store is not None
         # Construct a hybrid search query with HNSW
-        es_query = {
+        return {
             "query": {
                 "bool": {
                     "must": [
-                        {
-                            "knn": {
-                                "field": "biobert_embedding",
-                                "query_vector": query_embedding,
-                                "k": topK  # Number of nearest neighbors to retrieve
-                            }
-                        }
+                        # topK: number of nearest neighbors to retrieve
+                        self.knn_clause("biobert_embedding", self.compressor.encode_query(query_embedding), topK,
+                                        categories=categories)
                     ]
                 },
             },
+            "_source": ["abstract", "expansion_terms"] + ([] if use_store else ["biobert_embedding"]),
             "size": 50
         }
 
-        response = self.es_client.search(index=self.index_name, body=es_query)
+    def read_prf_hits(self, hits):
+        """
+        Returns:
+            tuple: (expansion terms per hit, vector per hit, ids of the hits
+            whose vector is not in the vector store)
+        """
+        topK_terms = [
+            hit["_source"]["expansion_terms"] if "expansion_terms" in hit["_source"]
+            else self.extract_terms(hit["_source"]["abstract"])
+            for hit in hits
+        ]
+        if self.vector_store is None:
+            return topK_terms, self.compressor.decode([hit["_source"]["biobert_embedding"] for hit in hits]), []
+        # Re-indexed documents keep their ids: only sync() sees their new vectors
+        self.vector_store.sync()
+        topK_vectors, missing = self.vector_store.get("biobert_embedding", [hit["_id"] for hit in hits])
+        return topK_terms, topK_vectors, missing
 
-        hits = response["hits"]["hits"]
-        topK_documents = [hit["_source"]["abstract"] for hit in hits]
-        topK_embeddings = np.mean(
-            [hit["_source"]["biobert_embedding"] for hit in hits], axis=0)
+    @staticmethod
+    def build_missing_vectors_query(missing):
+        # Documents indexed after the vector store was last written
+        return {
+            "query": {"ids": {"values": missing}},
+            "_source": ["biobert_embedding"],
+            "size": len(missing)
+        }
+
+    def fill_missing_vectors(self, hits, vectors, response):
+        fetched = {hit["_id"]: hit["_source"]["biobert_embedding"] for hit in response["hits"]["hits"]}
+        for i, hit in enumerate(hits):
+            if hit["_id"] in fetched:
+                vectors[i] = self.compressor.decode(fetched[hit["_id"]])
 
-        pseudo_embedding = alpha * \
+    @staticmethod
+    def pseudo_relevance_embedding(query_embedding, topK_vectors, alpha=0.4):
+        # Average in float64 like the JSON path does, so the centroid is identical
+        topK_embeddings = np.mean(np.asarray(topK_vectors, dtype=np.float64), axis=0)
+
+        return alpha * \
             np.array(query_embedding) + (1 - alpha) * topK_embeddings
 
-        return pseudo_embedding, topK_documents
+    def prf_stats(self, response, payload_bytes, start, request_end, decode_end):
+        return {
+            "vector_source": "json" if self.vector_store is None else "store",
+            "response_bytes": payload_bytes,
+            "took_ms": response["took"],
+            "request_ms": round((request_end - start) * 1000, 2),
+            "decode_ms": round((decode_end - request_end) * 1000, 2),
+            "compute_ms": round((time.perf_counter() - decode_end) * 1000, 2)
+        }
+
+    def apply_pseudo_relevant_feedback(self, query_embedding, topK, alpha=0.4, categories=None):
+        start = time.perf_counter()
+        response = self.es_client.search(index=self.index_name,
+                                         body=self.build_prf_query(query_embedding, topK, categories))
+        request_end = time.perf_counter()
+        payload_bytes = response_bytes(response)
+        observe_elasticsearch("search", "prf_query", response["took"], payload_bytes)
+
+        hits = response["hits"]["hits"]
+        topK_terms, topK_vectors, missing = self.read_prf_hits(hits)
+        if missing:
+            missing_response = self.es_client.search(index=self.index_name,
+                                                     body=self.build_missing_vectors_query(missing))
+            self.fill_missing_vectors(hits, topK_vectors, missing_response)
+            payload_bytes += response_bytes(missing_response)
+            observe_elasticsearch("search", "prf_missing_vectors", missing_response["took"],
+                                  response_bytes(missing_response))
+        decode_end = time.perf_counter()
+
+        pseudo_embedding = self.pseudo_relevance_embedding(query_embedding, topK_vectors, alpha)
 
-    def execute_semantic_search(self, query, alpha=0.7):
-        query_embedding = self.embedder.generate_embedding(query).tolist()
+        self.last_prf_stats = self.prf_stats(response, payload_bytes, start, request_end, decode_end)
+        return pseudo_embedding, topK_terms
 
-        pseudo_relevance_embedding, topK_docs = self.apply_pseudo_relevant_feedback(
-            query_embedding, 100)
+    def prepare_query_vectors(self, query, alpha=0.7, categories=None):
+        """
+        Run the query embedding, pseudo-relevance feedback and query expansion steps.
+        With `categories`, the feedback documents come from those categories only.
+
+        Returns:
+            tuple: (query embedding as a list, expanded embedding as an np.ndarray)
+        """
+        with stage("search", "embed"):
+            query_embedding = self.embedder.generate_embedding(query).tolist()
+
+        with stage("search", "prf_query"):
+            pseudo_relevance_embedding, topK_terms = self.apply_pseudo_relevant_feedback(
+                query_embedding, 100, categories=categories)
 
          # Query Expansion
-        expanded_query, expanded_query_embeddings = self.expand_query(
-            query, topK_docs, top_n=5)
+        with stage("search", "expansion"):
+            expanded_query, expanded_query_embeddings = self.expand_query(
+                query, topK_terms, top_n=5)
 
         # Merge with pseudo-relevance embedding
         expanded_embedding = alpha * \
             pseudo_relevance_embedding + \
                 (1 - alpha) * expanded_query_embeddings
 
+        return query_embedding, expanded_embedding
+
+    def build_final_query(self, query_embedding, expanded_embedding, mode=SEARCH_MODE,
+                          k=KNN_K, num_candidates=KNN_NUM_CANDIDATES, categories=None):
+        """
+        Build the dual-field scored query.
+
+        Parameters:
+            mode (str): "exact" scores every document in the index; "ann" takes
+                the union of the HNSW knn candidates on both vector fields and
+                scores only those, with the same weighted blend.
+            k (int): Nearest neighbours retrieved per field in "ann" mode.
+            num_candidates (int): HNSW candidates considered per shard in "ann" mode.
+            categories (tuple): CATEGORY entities to narrow to before scoring
+                (all documents when None).
+
+        Returns:
+            dict: Elasticsearch search body. Facets are counted from its
+            hits (format_search_response), so it has no aggregation.
+        """
+        expanded_vector = self.compressor.encode_query(expanded_embedding)
+        query_vector = self.compressor.encode_query(query_embedding)
+        if mode == "exact":
+            candidates = {"bool": {"filter": [category_filter(categories)]}} if categories else {"match_all": {}}
+        elif mode == "ann":
+            candidates = {
+                "bool": {
+                    "should": [
+                        self.knn_clause("biobert_embedding", expanded_vector, k, num_candidates, categories),
+                        self.knn_clause("title_embedding", query_vector, k, num_candidates, categories)
+                    ]
+                }
+            }
+        else:
+            raise ValueError(f"Unknown search mode '{mode}', expected 'ann' or 'exact'.")
+
         # Construct a hybrid search query with HNSW
-        es_query = {
+        return {
             "_source": ["title", "abstract", "authors", "doi", "entities"],
             "query": {
                 "bool": {
                     "should": [
                         {
                             "script_score": {
-                                "query": {"match_all": {}},
+                                "query": candidates,
                                 "script": {
                                     "source": "cosineSimilarity(params.query_vector, 'biobert_embedding') + 2.5",
-                                    "params": {"query_vector": expanded_embedding.tolist()}
+                                    "params": {"query_vector": expanded_vector}
                                 }
                             }
                         },
                         {
                             "script_score": {
-                                "query": {"match_all": {}},
+                                "query": candidates,
                                 "script": {
                                     "source": "cosineSimilarity(params.query_vector, 'title_embedding') + 1.5",
-                                    "params": {"query_vector": query_embedding}
+                                    "params": {"query_vector": query_vector}
                                 }
                             }
                         }
                     ]
                 }
             },
-            "aggs": {
-                "tja-agg": {
-                    "nested": {
-                        "path": "entities"
-                    },
-                    "aggs": {
-                        "labels": {
-                            "terms": {
-                                "field": "entities.entity",
-                                "size": 10  # Number of top labels to return
-                            }
-                        }
-                    }
-                }
-            },
-       
             "size": 50  # Number of results to return in the response
         }
 
-        return self.es_client.search(index=self.index_name, body=es_query)
+    def index_version(self):
+        """Version of the index behind `index_name`, part of every result cache key."""
+        return IndexState.shared(self.index_name).refresh(self.es_client).version
+
+    def cache_key(self, kind, version, query, **params):
+        return ResultCache.key(kind, query=normalise_query(query), version=version,
+                               model=self.embedder.cache_model_id, compression=self.compressor.name, **params)
+
+    def results_key(self, version, query, alpha, mode, k, num_candidates, categories):
+        return self.cache_key("results", version, query, alpha=alpha, mode=mode, k=k,
+                              num_candidates=num_candidates, categories=categories)
+
+    def vectors_key(self, version, query, alpha, categories):
+        # The query vectors do not depend on the mode or k of the final query
+        return self.cache_key("vectors", version, query, alpha=alpha, categories=categories)
+
+    @staticmethod
+    def cached_results(entry, tier):
+        """
+        Returns:
+            tuple: (response, PRF stats) of a "results" cache entry.
+        """
+        return entry["response"], dict(entry["prf_stats"], cache=tier)
+
+    def cache_results(self, key, response, prf_stats):
+        # Partial results (a timeout or failed shards) are not worth repeating
+        if response.get("timed_out") or response.get("_shards", {}).get("failed"):
+            return
+        self.result_cache.put("results", key, {"response": getattr(response, "body", response),
+                                               "prf_stats": prf_stats})
+
+    @staticmethod
+    def vectors_entry(query_embedding, expanded_embedding, prf_stats):
+        # JSON floats round-trip float64 exactly, so a hit scores like a miss
+        return {"query_embedding": query_embedding, "expanded_embedding": expanded_embedding.tolist(),
+                "prf_stats": prf_stats}
+
+    @staticmethod
+    def cached_vectors(entry, tier):
+        """
+        Returns:
+            tuple: (query embedding, expanded embedding, PRF stats) of a "vectors" cache entry.
+        """
+        return (entry["query_embedding"], np.array(entry["expanded_embedding"]),
+                dict(entry["prf_stats"], cache=tier))
+
+    def cached_query_vectors(self, key, query, alpha=0.7, categories=None):
+        """
+        prepare_query_vectors through the result cache.
+
+        Returns:
+            tuple: (query embedding as a list, expanded embedding as an np.ndarray)
+        """
+        entry, tier = self.result_cache.get("vectors", key)
+        if entry is not None:
+            query_embedding, expanded_embedding, self.last_prf_stats = self.cached_vectors(entry, tier)
+            return query_embedding, expanded_embedding
+        query_embedding, expanded_embedding = self.prepare_query_vectors(query, alpha, categories)
+        self.result_cache.put("vectors", key, self.vectors_entry(query_embedding, expanded_embedding,
+                                                                 self.last_prf_stats))
+        return query_embedding, expanded_embedding
+
+    def execute_semantic_search(self, query, alpha=0.7, mode=SEARCH_MODE,
+                                k=KNN_K, num_candidates=KNN_NUM_CANDIDATES, categories=None):
+        """
+        Answer from the result cache when the same query and parameters ran
+        against the current index version, else run the pipeline (reusing
+        cached query vectors when only the mode or k differ) and cache it.
+        """
+        cache = self.result_cache
+        with stage("search", "total"):
+            if cache is None:
+                query_embedding, expanded_embedding = self.prepare_query_vectors(query, alpha, categories)
+            else:
+                with stage("search", "result_cache"):
+                    version = self.index_version()
+                    results_key = self.results_key(version, query, alpha, mode, k, num_candidates, categories)
+                    entry, tier = cache.get("results", results_key)
+                if entry is not None:
+                    response, self.last_prf_stats = self.cached_results(entry, tier)
+                    return response
+                query_embedding, expanded_embedding = self.cached_query_vectors(
+                    self.vectors_key(version, query, alpha, categories), query, alpha, categories)
+            es_query = self.build_final_query(query_embedding, expanded_embedding, mode=mode, k=k,
+                                              num_candidates=num_candidates, categories=categories)
+            with stage("search", "final_query"):
+                response = self.es_client.search(index=self.index_name, body=es_query)
+        observe_elasticsearch("search", "final_query", response["took"], response_bytes(response))
+        if cache is not None:
+            self.cache_results(results_key, response, self.last_prf_stats)
+        return response
+
+    def msearch(self, bodies):
+        """
+        Send several search bodies to the index in one _msearch round trip.
+
+        Returns:
+            ObjectApiResponse: {"took", "responses"}, one response (or
+            {"error", "status"}) per body, in order.
+        """
+        searches = []
+        for body in bodies:
+            searches.extend(({"index": self.index_name}, body))
+        return self.es_client.msearch(searches=searches)
+
+    def read_prf_batch(self, prf_responses):
+        """
+        Read the hits of every PRF response of a batch.
+
+        Returns:
+            tuple: ({query position: (hits, expansion terms per hit, vector
+            per hit, missing ids)} for the queries that did not fail, ids of
+            all the hits whose vector is not in the vector store)
+        """
+        prf_hits = {}
+        for i, response in enumerate(prf_responses["responses"]):
+            if "error" not in response:
+                hits = response["hits"]["hits"]
+                prf_hits[i] = (hits,) + self.read_prf_hits(hits)
+        missing = sorted(set(chain.from_iterable(item[3] for item in prf_hits.values())))
+        return prf_hits, missing
+
+    def fill_missing_batch_vectors(self, prf_hits, missing_response):
+        for hits, _, topK_vectors, _ in prf_hits.values():
+            self.fill_missing_vectors(hits, topK_vectors, missing_response)
+
+    def build_final_queries(self, queries, query_embeddings, prf_hits, alpha=0.7, mode=SEARCH_MODE,
+                            k=KNN_K, num_candidates=KNN_NUM_CANDIDATES, categories=None):
+        """
+        Run query expansion for every query of a batch, with one embedding
+        call for all the expansion terms, and build the final queries.
+
+        Returns:
+            dict: Final search body per query position, in query order.
+        """
+        expansions = {i: self.expansion_terms(queries[i], topK_terms, top_n=5)[1]
+                      for i, (_, topK_terms, _, _) in prf_hits.items()}
+        term_embeddings = self.embedder.generate_embeddings(list(chain.from_iterable(expansions.values())))
+        final_queries, offset = {}, 0
+        for i, (_, _, topK_vectors, _) in prf_hits.items():
+            terms = expansions[i]
+            expanded_query_embeddings = np.array(np.mean(term_embeddings[offset:offset + len(terms)], axis=0))
+            offset += len(terms)
+            query_embedding = query_embeddings[i].tolist()
+            pseudo_relevance_embedding = self.pseudo_relevance_embedding(query_embedding, topK_vectors)
+            # Merge with pseudo-relevance embedding
+            expanded_embedding = alpha * \
+                pseudo_relevance_embedding + \
+                    (1 - alpha) * expanded_query_embeddings
+            final_queries[i] = self.build_final_query(query_embedding, expanded_embedding, mode=mode, k=k,
+                                                      num_candidates=num_candidates, categories=categories)
+        return final_queries
+
+    @staticmethod
+    def final_query_chunks(final_queries):
+        """
+        Returns:
+            list[list[int]]: Positions of the final queries of a batch, in
+            query order, SEARCH_BATCH_STREAM_CHUNK per _msearch request.
+        """
+        positions = list(final_queries)
+        return [positions[i:i + SEARCH_BATCH_STREAM_CHUNK]
+                for i in range(0, len(positions), SEARCH_BATCH_STREAM_CHUNK)]
+
+    @staticmethod
+    def batch_item(query, prf_response, final_response, prf_stats, batch_size):
+        """
+        Returns:
+            tuple: (query, response, prf stats) of one query of a batch. A
+            query that failed in Elasticsearch gets its {"error", "status"}
+            response and no stats.
+        """
+        if final_response is None:
+            return query, prf_response, None
+        if "error" in final_response:
+            return query, final_response, None
+        # Request and payload figures cover the whole PRF round trip of the batch
+        return query, final_response, dict(prf_stats, took_ms=prf_response["took"], batch_size=batch_size)
+
+    def cached_batch(self, keys):
+        """
+        Returns:
+            dict: (entry, tier) per position of the `keys` found in the result cache.
+        """
+        hits = {}
+        for i, key in enumerate(keys):
+            entry, tier = self.result_cache.get("results", key)
+            if entry is not None:
+                hits[i] = (entry, tier)
+        return hits
+
+    def merge_batch(self, queries, keys, cached, searched):
+        """
+        Interleave the cached results of a batch with the searched ones,
+        caching those as they arrive.
+
+        Parameters:
+            cached (dict): (entry, tier) per query position, from cached_batch.
+            searched (iterator): Items of the other queries, in order.
+
+        Yields:
+            tuple: (query, response, prf stats) in query order.
+        """
+        for i, query in enumerate(queries):
+            if i in cached:
+                yield (query,) + self.cached_results(*cached[i])
+                continue
+            item = next(searched)
+            # Failed queries have no stats and are not cached
+            if item[2] is not None:
+                self.cache_results(keys[i], item[1], item[2])
+            yield item
+
+    def execute_semantic_search_batch(self, queries, alpha=0.7, mode=SEARCH_MODE,
+                                      k=KNN_K, num_candidates=KNN_NUM_CANDIDATES, categories=None):
+        """
+        Run many searches with one batched embedding pass, one _msearch for
+        every PRF query and concurrent _msearch requests for the final
+        queries, instead of two searches per query. Queries found in the
+        result cache are answered from it and left out of the round trips.
+        Each response is what execute_semantic_search returns for the same
+        query.
+
+        Parameters:
+            queries (list[str]): User queries.
+
+        Yields:
+            tuple: (query, response, prf stats) in query order, as soon as
+            each is ready; see batch_item.
+        """
+        cache = self.result_cache
+        # Spans the whole stream, including the time its consumer takes
+        with stage("search_batch", "total"):
+            if cache is None:
+                yield from self.search_uncached_batch(queries, alpha, mode, k, num_candidates, categories)
+                return
+            with stage("search_batch", "result_cache"):
+                version = self.index_version()
+                keys = [self.results_key(version, query, alpha, mode, k, num_candidates, categories)
+                        for query in queries]
+                cached = self.cached_batch(keys)
+            pending = [query for i, query in enumerate(queries) if i not in cached]
+            searched = self.search_uncached_batch(pending, alpha, mode, k, num_candidates, categories) \
+                if pending else iter(())
+            yield from self.merge_batch(queries, keys, cached, searched)
+
+    def search_uncached_batch(self, queries, alpha=0.7, mode=SEARCH_MODE,
+                              k=KNN_K, num_candidates=KNN_NUM_CANDIDATES, categories=None):
+        """
+        The round trips of execute_semantic_search_batch, for queries that
+        are not in the result cache.
+        """
+        with stage("search_batch", "embed"):
+            query_embeddings = self.embedder.generate_embeddings(queries)
+
+        with stage("search_batch", "prf_query"):
+            start = time.perf_counter()
+            prf_responses = self.msearch([self.build_prf_query(embedding, 100, categories)
+                                          for embedding in query_embeddings])
+            request_end = time.perf_counter()
+            payload_bytes = response_bytes(prf_responses)
+            observe_elasticsearch("search_batch", "prf_query", prf_responses["took"], payload_bytes)
+
+            prf_hits, missing = self.read_prf_batch(prf_responses)
+            if missing:
+                # One ids query covers the missing vectors of every query
+                missing_response = self.es_client.search(index=self.index_name,
+                                                         body=self.build_missing_vectors_query(missing))
+                self.fill_missing_batch_vectors(prf_hits, missing_response)
+                payload_bytes += response_bytes(missing_response)
+                observe_elasticsearch("search_batch", "prf_missing_vectors", missing_response["took"],
+                                      response_bytes(missing_response))
+            decode_end = time.perf_counter()
+
+        with stage("search_batch", "expansion"):
+            final_queries = self.build_final_queries(queries, query_embeddings, prf_hits, alpha, mode=mode,
+                                                     k=k, num_candidates=num_candidates,
+                                                     categories=categories)
+        prf_stats = self.prf_stats(prf_responses, payload_bytes, start, request_end, decode_end)
+
+        chunks = self.final_query_chunks(final_queries)
+        pool = ThreadPoolExecutor(len(chunks)) if chunks else None
+        try:
+            # Every chunk is in flight at once; results go out in query order
+            requests = iter([(chunk, pool.submit(self.msearch, [final_queries[i] for i in chunk]))
+                             for chunk in chunks])
+            final_responses = {}
+            for i, query in enumerate(queries):
+                if i in final_queries and i not in final_responses:
+                    chunk, request = next(requests)
+                    with stage("search_batch", "final_query"):
+                        response = request.result()
+                    observe_elasticsearch("search_batch", "final_query", response["took"],
+                                          response_bytes(response))
+                    final_responses.update(zip(chunk, response["responses"]))
+                yield self.batch_item(query, prf_responses["responses"][i], final_responses.get(i),
+                                      prf_stats, len(queries))
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
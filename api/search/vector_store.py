@@ -0,0 +1,296 @@
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from config.config import VECTOR_STORE_DIR
+
+FIELDS = ("biobert_embedding", "title_embedding")
+
+
+class VectorStore:
+    """
+    Memory-mapped id -> vector store for the document embeddings.
+
+    Written by the indexer next to Elasticsearch so the search path can read
+    document vectors straight from the page cache instead of having them
+    JSON-encoded into every response. On disk it is `ids.txt` (one document
+    id per line) plus one raw float32 matrix file per vector field, rows in
+    the same order. Vectors are appended before their ids, so a reader never
+    sees an id whose vectors are incomplete.
+
+    A store written with sources=True also keeps every document's
+    non-vector fields, one JSON line per row in `sources.ndjson` with the end
+    offset of each line in `sources.idx`, which is what the local search
+    engine serves results from.
+
+    Re-indexing a document appends a new row under the same id; the older
+    row stays in the files but is listed in `superseded`. `path` may be a
+    symlink that publish_store() atomically repoints to a rebuilt store;
+    refresh() then reopens it and bumps `generation`. Readers call sync()
+    before every search, so both are picked up by the next one.
+    """
+    _shared = None
+
+    def __init__(self, path):
+        self.path = path
+        self.generation = 0
+        self._sources_fd = None
+        self._lock = threading.Lock()
+        self._open()
+        self.refresh()
+
+    def _open(self):
+        self._real_path = os.path.realpath(self.path)
+        with open(os.path.join(self._real_path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.fields = meta["fields"]
+        self.dtype = np.dtype(meta["dtype"])
+        self.has_sources = meta.get("sources", False)
+        self.ids_path = os.path.join(self._real_path, "ids.txt")
+        self._ids = []
+        self._rows = {}
+        self._superseded = []
+        # Sorted rows that were replaced by a later row of the same id
+        self.superseded = np.zeros(0, dtype=np.int64)
+        self._ids_offset = 0
+        self._matrices = {}
+        self._source_ends = np.zeros(0, dtype=np.uint64)
+        if self._sources_fd is not None:
+            os.close(self._sources_fd)
+        self._sources_fd = os.open(os.path.join(self._real_path, "sources.ndjson"), os.O_RDONLY) \
+            if self.has_sources else None
+        self.generation += 1
+
+    @classmethod
+    def shared(cls):
+        """
+        Returns:
+            VectorStore: The process-wide store configured in config.py, or
+            None when it is disabled or has not been built yet.
+        """
+        if cls._shared is None and VECTOR_STORE_DIR and \
+                os.path.exists(os.path.join(VECTOR_STORE_DIR, "meta.json")):
+            cls._shared = cls(VECTOR_STORE_DIR)
+        return cls._shared
+
+    def refresh(self):
+        """Pick up rows the indexer appended since the last refresh."""
+        with self._lock:
+            if os.path.realpath(self.path) != self._real_path or \
+                    os.path.getsize(self.ids_path) < self._ids_offset:
+                # The store was rebuilt from scratch or swapped: start over
+                self._open()
+            with open(self.ids_path, "rb") as f:
+                f.seek(self._ids_offset)
+                data = f.read()
+            # Ignore a trailing id whose newline has not been written yet
+            complete = data[:data.rfind(b"\n") + 1]
+            self._ids_offset += len(complete)
+            superseded = len(self._superseded)
+            for doc_id in complete.decode("utf-8").splitlines():
+                if doc_id in self._rows:
+                    self._superseded.append(self._rows[doc_id])
+                self._rows[doc_id] = len(self._ids)
+                self._ids.append(doc_id)
+            if len(self._superseded) > superseded:
+                self.superseded = np.sort(np.asarray(self._superseded, dtype=np.int64))
+
+            row_bytes = self.dim * self.dtype.itemsize
+            for field in self.fields:
+                field_path = os.path.join(self._real_path, f"{field}.bin")
+                rows = os.path.getsize(field_path) // row_bytes
+                if rows and (field not in self._matrices or len(self._matrices[field]) < rows):
+                    self._matrices[field] = np.memmap(field_path, dtype=self.dtype, mode="r",
+                                                      shape=(rows, self.dim))
+            if self.has_sources and len(self._source_ends) < len(self._ids):
+                # Only the offsets of the rows appended since the last refresh
+                new_ends = np.fromfile(os.path.join(self._real_path, "sources.idx"), dtype=np.uint64,
+                                       count=len(self._ids) - len(self._source_ends),
+                                       offset=len(self._source_ends) * 8)
+                self._source_ends = np.concatenate([self._source_ends, new_ends])
+
+    def sync(self):
+        """
+        Refresh when the indexer appended rows (a re-indexed document keeps
+        its id, so lookups alone would never notice) or a rebuilt store was
+        published. Costs a readlink and a stat when nothing changed.
+        """
+        try:
+            changed = os.path.realpath(self.path) != self._real_path or \
+                os.path.getsize(self.ids_path) != self._ids_offset
+        except FileNotFoundError:
+            # The old store was deleted after a swap
+            changed = True
+        if changed:
+            self.refresh()
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def ids(self):
+        return self._ids
+
+    def matrix(self, field):
+        """
+        Returns:
+            np.memmap: All stored vectors of `field`, one row per id in `ids`.
+        """
+        return self._matrices[field][:len(self._ids)]
+
+    def source(self, row):
+        """
+        Returns:
+            dict: The non-vector fields of the document in `row`.
+        """
+        start = int(self._source_ends[row - 1]) if row else 0
+        end = int(self._source_ends[row])
+        return json.loads(os.pread(self._sources_fd, end - start, start))
+
+    def row(self, doc_id):
+        """
+        Returns:
+            int: Row of `doc_id`, or None when it is not in the store.
+        """
+        if doc_id not in self._rows:
+            self.refresh()
+        return self._rows.get(doc_id)
+
+    def get(self, field, doc_ids):
+        """
+        Look up the vectors of `doc_ids`.
+
+        Parameters:
+            field (str): Vector field name.
+            doc_ids (list[str]): Elasticsearch document ids.
+
+        Returns:
+            tuple: (float32 matrix with one row per id, zero rows for missing
+            ids; list of the ids that are not in the store)
+        """
+        if any(doc_id not in self._rows for doc_id in doc_ids):
+            self.refresh()
+        vectors = np.zeros((len(doc_ids), self.dim), dtype=np.float32)
+        missing = []
+        for i, doc_id in enumerate(doc_ids):
+            row = self._rows.get(doc_id)
+            if row is None:
+                missing.append(doc_id)
+            else:
+                vectors[i] = self._matrices[field][row]
+        return vectors, missing
+
+
+class VectorStoreWriter:
+    """
+    Append-only writer for a VectorStore. Only one writer (the indexer) may
+    write to a store at a time.
+    """
+    def __init__(self, path, dim=768, fields=FIELDS, dtype="float32", reset=False, sources=False):
+        self.path = path
+        self.fields = fields
+        self.dtype = np.dtype(dtype)
+        if reset and os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path, exist_ok=True)
+
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            with open(meta_path, "w") as f:
+                json.dump({"dim": dim, "fields": list(fields), "dtype": self.dtype.name,
+                           "sources": sources}, f)
+        with open(meta_path, "r") as f:
+            # A resumed store keeps the layout it was created with
+            self.sources = json.load(f).get("sources", False)
+        file_names = ["ids.txt"] + [f"{field}.bin" for field in fields]
+        if self.sources:
+            file_names += ["sources.ndjson", "sources.idx"]
+        for file_name in file_names:
+            open(os.path.join(path, file_name), "ab").close()
+
+        # Drop whatever an interrupted flush left beyond the last complete id
+        ids_path = os.path.join(path, "ids.txt")
+        with open(ids_path, "rb") as f:
+            data = f.read()
+        complete = data[:data.rfind(b"\n") + 1]
+        os.truncate(ids_path, len(complete))
+        rows = complete.count(b"\n")
+        self._ids = set(complete.decode("utf-8").splitlines())
+        for field in fields:
+            os.truncate(os.path.join(path, f"{field}.bin"), rows * dim * self.dtype.itemsize)
+        if self.sources:
+            idx_path = os.path.join(path, "sources.idx")
+            os.truncate(idx_path, rows * 8)
+            ends = np.fromfile(idx_path, dtype=np.uint64)
+            self._sources_size = int(ends[-1]) if rows else 0
+            os.truncate(os.path.join(path, "sources.ndjson"), self._sources_size)
+        self._buffer = []
+
+    def add(self, doc_id, vectors, source=None):
+        """
+        Parameters:
+            doc_id (str): Elasticsearch document id.
+            vectors (dict): field -> vector.
+            source (dict): Non-vector fields, kept when the store has sources.
+        """
+        self._buffer.append((doc_id, vectors, source))
+
+    def __contains__(self, doc_id):
+        """Whether `doc_id` has been flushed to the store."""
+        return doc_id in self._ids
+
+    def flush(self):
+        if not self._buffer:
+            return
+        for field in self.fields:
+            with open(os.path.join(self.path, f"{field}.bin"), "ab") as f:
+                f.write(np.asarray([vectors[field] for _, vectors, _ in self._buffer], dtype=self.dtype).tobytes())
+        if self.sources:
+            lines = [(json.dumps(source) + "\n").encode("utf-8") for _, _, source in self._buffer]
+            ends = self._sources_size + np.cumsum([len(line) for line in lines], dtype=np.uint64)
+            with open(os.path.join(self.path, "sources.ndjson"), "ab") as f:
+                f.write(b"".join(lines))
+            with open(os.path.join(self.path, "sources.idx"), "ab") as f:
+                f.write(ends.astype(np.uint64).tobytes())
+            self._sources_size = int(ends[-1])
+        # Ids go last: they are what makes the rows visible to readers
+        with open(os.path.join(self.path, "ids.txt"), "a") as f:
+            f.write("".join(f"{doc_id}\n" for doc_id, _, _ in self._buffer))
+        self._ids.update(doc_id for doc_id, _, _ in self._buffer)
+        self._buffer = []
+
+
+def build_path(path, version):
+    """
+    Returns:
+        str: Directory to build version `version` of the store at `path` in,
+        next to it, before publish_store() makes it live.
+    """
+    return f"{os.path.abspath(path)}.{version}"
+
+
+def publish_store(path, new_path):
+    """
+    Atomically point `path` at the store built in `new_path` by replacing
+    the `path` symlink, so readers switch over on their next sync().
+
+    Returns:
+        str: The directory `path` pointed to before, or None.
+    """
+    previous = os.path.realpath(path) if os.path.lexists(path) else None
+    if os.path.isdir(path) and not os.path.islink(path):
+        # A store from before versioned rebuilds: move it aside first
+        previous = path + ".legacy"
+        shutil.rmtree(previous, ignore_errors=True)
+        os.rename(path, previous)
+    tmp_link = path + ".tmp-link"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    # Relative, so the store directory can be moved as a whole
+    os.symlink(os.path.relpath(new_path, os.path.dirname(os.path.abspath(path))), tmp_link)
+    os.replace(tmp_link, path)
+    return previous if previous != os.path.realpath(new_path) else None
@@ -0,0 +1,265 @@
+"""
+Pre-fork serving mode for app.py.
+
+The master process imports the app, loads and warms up BioBERT once and
+then forks the workers, which inherit the loaded weights and share them
+copy-on-write instead of each holding its own copy. Every worker accepts
+connections on the one listening socket the master bound.
+
+    python serve.py --workers 4 --port 3000
+
+Once all workers are ready the master prints the startup times and the
+unique (USS) and proportional (PSS) memory of every process as JSON, and
+again on SIGUSR1. A worker that dies is replaced by a fresh fork; one that
+dies before it serves is forked again after a growing delay, and the master
+stops after SERVER_MAX_STARTUP_FAILURES of those in a row.
+
+Workers race for connections, so consecutive requests reach different
+processes. /metrics sums the samples every process writes to
+SERVER_METRICS_DIR (prometheus_client's multiprocess mode), including those
+of exited workers. /healthcheck is per worker: its cache and batcher
+figures belong to the worker whose pid it reports.
+"""
+import gc
+import time
+
+# Measured from here, before the app and its dependencies are imported
+START = time.perf_counter()
+# No collections while the models load; everything loaded is frozen below
+gc.disable()
+
+import argparse
+import json
+import os
+import signal
+import socket
+
+import psutil
+
+from config.config import (SERVER_HOST, SERVER_MAX_STARTUP_FAILURES, SERVER_METRICS_DIR, SERVER_PORT,
+                           SERVER_RESTART_DELAY, SERVER_RESTART_MAX_DELAY, SERVER_TORCH_THREADS, SERVER_WORKERS)
+
+
+def prepare_metrics_dir(path):
+    """
+    Have every process write its metrics under `path` (unless
+    PROMETHEUS_MULTIPROC_DIR is set already), emptied of a previous run's.
+    Must run before prometheus_client is imported.
+    """
+    path = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", path)
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if name.endswith(".db"):
+            os.remove(os.path.join(path, name))
+
+
+def load_app():
+    """
+    Import the app and load and warm up the models in the master process.
+
+    Returns:
+        tuple: (Flask app, {"import": seconds, "models": seconds})
+    """
+    import torch
+
+    from app import app
+    from preprocessing.model_registry import ModelRegistry
+
+    imported = time.perf_counter()
+    ModelRegistry.get_biobert()
+    # A master that never entered a torch parallel region forks safely with
+    # GNU OpenMP; the workers set their own thread count
+    torch.set_num_threads(1)
+    # Expansion terms are precomputed at index time, so serving needs no ScispaCy model
+    ModelRegistry.warm_up(spacy_models=())
+    return app, {"import": round(imported - START, 3), "models": round(time.perf_counter() - imported, 3)}
+
+
+def run_worker(app, listener, ready_fd, torch_threads):
+    """Serve requests from `listener` in a forked worker. Never returns."""
+    import torch
+    from werkzeug.serving import make_server
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    gc.enable()
+    torch.set_num_threads(torch_threads)
+
+    host, port = listener.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+    # Workers race for each connection: the losers' accept() must not block
+    server.socket.setblocking(False)
+    os.write(ready_fd, b"1")
+    os.close(ready_fd)
+    try:
+        server.serve_forever()
+    finally:
+        os._exit(0)
+
+
+def memory_mb(pid):
+    info = psutil.Process(pid).memory_full_info()
+    return {"pid": pid, "uss_mb": round(info.uss / 2**20, 1),
+            "pss_mb": round(getattr(info, "pss", 0) / 2**20, 1), "rss_mb": round(info.rss / 2**20, 1)}
+
+
+class Master:
+    """
+    Forks and supervises the workers.
+
+    Parameters:
+        app (Flask): The loaded app.
+        listener (socket.socket): Bound, listening socket the workers share.
+        workers (int): Number of worker processes.
+        torch_threads (int): torch intra-op threads per worker.
+    """
+    def __init__(self, app, listener, workers, torch_threads):
+        self.app = app
+        self.listener = listener
+        self.workers = workers
+        self.torch_threads = torch_threads
+        self.pids = set()
+        self.startup = {}
+        self._report_requested = False
+        self._stopping = False
+
+    def spawn(self):
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            run_worker(self.app, self.listener, ready_write, self.torch_threads)
+        os.close(ready_write)
+        self.pids.add(pid)
+        return pid, ready_read
+
+    @staticmethod
+    def wait_ready(ready_fd):
+        """
+        Returns:
+            bool: Whether the worker started serving; False if it exited first.
+        """
+        ready = os.read(ready_fd, 1) == b"1"
+        os.close(ready_fd)
+        return ready
+
+    def exited(self, pid):
+        self.pids.discard(pid)
+        if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+            from prometheus_client import multiprocess
+
+            # Its counters and histograms stay in the totals; only live gauges go
+            multiprocess.mark_process_dead(pid)
+
+    def failed_startup(self, pid):
+        _, status = os.waitpid(pid, 0)
+        self.exited(pid)
+        print(f"Worker {pid} exited with status {status} during startup.", flush=True)
+
+    def replace_worker(self):
+        """
+        Start a worker in place of an exited one, retrying with a doubling
+        delay while the new workers die during startup.
+
+        Returns:
+            bool: False after SERVER_MAX_STARTUP_FAILURES failed starts in a row.
+        """
+        delay = SERVER_RESTART_DELAY
+        for attempt in range(1, SERVER_MAX_STARTUP_FAILURES + 1):
+            if self._stopping:
+                return True
+            pid, ready_fd = self.spawn()
+            if self.wait_ready(ready_fd):
+                return True
+            self.failed_startup(pid)
+            if attempt < SERVER_MAX_STARTUP_FAILURES:
+                print(f"Starting a new worker in {delay:g}s.", flush=True)
+                time.sleep(delay)
+                delay = min(delay * 2, SERVER_RESTART_MAX_DELAY)
+        return False
+
+    def report(self):
+        return {
+            "startup_seconds": self.startup,
+            "master": memory_mb(os.getpid()),
+            "workers": [memory_mb(pid) for pid in sorted(self.pids)]
+        }
+
+    def run(self):
+        """
+        Start the workers and supervise them until SIGTERM or SIGINT.
+
+        Returns:
+            bool: False if the master stopped because workers kept dying during startup.
+        """
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGUSR1, self._request_report)
+
+        # Keep the loaded objects out of every collection, so the garbage
+        # collector never writes to (and un-shares) the pages they live on
+        gc.freeze()
+        forked = time.perf_counter()
+        started = [self.spawn() for _ in range(self.workers)]
+        failed = [pid for pid, ready_fd in started if not self.wait_ready(ready_fd)]
+        for pid in failed:
+            self.failed_startup(pid)
+        healthy = all(self.replace_worker() for _ in failed)
+        gc.enable()
+        if healthy:
+            self.startup["workers_ready"] = round(time.perf_counter() - forked, 3)
+            self.startup["total"] = round(time.perf_counter() - START, 3)
+            host, port = self.listener.getsockname()[:2]
+            print(f"Serving on http://{host}:{port} with {self.workers} workers.")
+            print(json.dumps(self.report(), indent=2), flush=True)
+
+        while healthy and not self._stopping:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid in self.pids:
+                self.exited(pid)
+                print(f"Worker {pid} exited with status {status}, starting a new one.", flush=True)
+                healthy = self.replace_worker()
+            if self._report_requested:
+                self._report_requested = False
+                print(json.dumps(self.report(), indent=2), flush=True)
+            time.sleep(0.5)
+
+        if not healthy:
+            print(f"Workers died during startup {SERVER_MAX_STARTUP_FAILURES} times in a row, stopping.",
+                  flush=True)
+        for pid in self.pids:
+            os.kill(pid, signal.SIGTERM)
+        for pid in self.pids:
+            os.waitpid(pid, 0)
+        return healthy
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def _request_report(self, signum, frame):
+        self._report_requested = True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument("--torch-threads", type=int, default=SERVER_TORCH_THREADS,
+                        help="torch intra-op threads per worker (defaults to the CPUs split evenly).")
+    args = parser.parse_args(argv)
+
+    # Before load_app() imports prometheus_client through the app
+    prepare_metrics_dir(SERVER_METRICS_DIR)
+    app, startup = load_app()
+    listener = socket.create_server((args.host, args.port), backlog=1024)
+    torch_threads = args.torch_threads or max(1, (os.cpu_count() or 1) // args.workers)
+    master = Master(app, listener, args.workers, torch_threads)
+    master.startup.update(startup)
+    if not master.run():
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
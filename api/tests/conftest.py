@@ -0,0 +1,127 @@
+"""
+Fixtures that run the service against the in-process Elasticsearch of the
+benchmarks and the offline models, so the tests need no cluster and no
+network. Modules are imported relative to api/, as the servers run them.
+"""
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_elasticsearch import FakeCluster, fake_async_client, fake_client  # noqa: E402
+from benchmarks.fixtures import synthetic_documents  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def offline_models(tmp_path_factory):
+    from benchmarks.run_benchmarks import install_offline_models
+
+    install_offline_models(str(tmp_path_factory.mktemp("models")), 768)
+
+
+@pytest.fixture
+def cluster(offline_models, tmp_path, monkeypatch):
+    """
+    A fresh FakeCluster behind both Elasticsearch clients, with every
+    process-wide singleton that depends on the index reset and the caches
+    and the vector store moved to `tmp_path`.
+    """
+    import app
+    import search.vector_store
+
+    from elasticsearch_client import ElasticsearchClient
+    from indexing.vector_compression import VectorCompressor
+    from preprocessing.embedding_cache import EmbeddingCache
+    from search.index_state import IndexState
+    from search.local_engine import LocalSearchEngine
+    from search.result_cache import ResultCache, SqliteResultStore
+    from search.vector_store import VectorStore
+
+    cluster = FakeCluster()
+    monkeypatch.setattr(ElasticsearchClient, "_client", fake_client(cluster))
+    monkeypatch.setattr(ElasticsearchClient, "_async_client", fake_async_client(cluster))
+    for cls in (VectorStore, LocalSearchEngine, VectorCompressor):
+        monkeypatch.setattr(cls, "_shared", None)
+    monkeypatch.setattr(IndexState, "_shared", {})
+    monkeypatch.setattr(EmbeddingCache, "_shared", EmbeddingCache(str(tmp_path / "embeddings"), dim=768))
+    monkeypatch.setattr(ResultCache, "_shared",
+                        ResultCache(64, 600, SqliteResultStore(str(tmp_path / "results.sqlite"))))
+
+    store_dir = str(tmp_path / "vectors")
+    monkeypatch.setattr(app, "VECTOR_STORE_DIR", store_dir)
+    monkeypatch.setattr(search.vector_store, "VECTOR_STORE_DIR", store_dir)
+    return cluster
+
+
+def write_documents(path, documents):
+    with open(path, "w") as f:
+        for document in documents:
+            f.write(json.dumps(document) + "\n")
+    return str(path)
+
+
+@pytest.fixture
+def documents(tmp_path):
+    """
+    Path of an NDJSON file with 60 synthetic documents.
+    """
+    return write_documents(tmp_path / "documents.ndjson", synthetic_documents(60))
+
+
+def create_index(path, *args):
+    """
+    Run `flask create-index` on the documents at `path`.
+    """
+    import app
+
+    result = app.app.test_cli_runner().invoke(app.create_index, ["--path", path, *args])
+    assert result.exception is None, result.output
+    return result.output
+
+
+@pytest.fixture
+def indexed(cluster, documents):
+    create_index(documents)
+    return cluster
+
+
+@pytest.fixture
+def asgi_client(cluster):
+    """
+    Calls into asgi.app inside one event loop that has run the lifespan
+    startup, as an ASGI server would.
+
+    Returns:
+        function: (method, path, json=None, headers=None) -> (status, headers, body chunks)
+    """
+    import asgi
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(asgi.startup())
+
+    def request(method, path, json_body=None, headers=None):
+        body = json.dumps(json_body).encode("utf-8") if json_body is not None else b""
+        scope = {"type": "http", "method": method, "path": path,
+                 "headers": [(key.lower().encode("ascii"), value.encode("ascii"))
+                             for key, value in (headers or {}).items()]}
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        loop.run_until_complete(asgi.app(scope, receive, send))
+        start = sent[0]
+        chunks = [message["body"] for message in sent[1:] if message["body"]]
+        return start["status"], dict(start["headers"]), chunks
+
+    yield request
+    loop.run_until_complete(asgi.shutdown())
+    loop.close()
+    asgi.state.clear()
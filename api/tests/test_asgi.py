@@ -0,0 +1,56 @@
+import inspect
+import json
+import threading
+
+import pytest
+
+import search.local_engine
+
+from search.local_engine import LocalSearchEngine, LocalSemanticSearch
+
+
+@pytest.fixture
+def local_engine(indexed, monkeypatch):
+    monkeypatch.setattr(search.local_engine, "SEARCH_ENGINE", "local")
+
+
+def record_threads(monkeypatch, cls, name, threads):
+    original = getattr(cls, name)
+
+    def wrapper(*args, **kwargs):
+        threads.add(threading.get_ident())
+        return original(*args, **kwargs)
+
+    def generator_wrapper(*args, **kwargs):
+        # Each step runs on whichever thread advances the generator
+        threads.add(threading.get_ident())
+        for item in original(*args, **kwargs):
+            yield item
+            threads.add(threading.get_ident())
+
+    monkeypatch.setattr(cls, name, generator_wrapper if inspect.isgeneratorfunction(original) else wrapper)
+
+
+def test_local_engine_runs_off_the_event_loop(local_engine, asgi_client, monkeypatch):
+    threads = set()
+    for name in ("shared", "get_document", "sync", "global_facets"):
+        record_threads(monkeypatch, LocalSearchEngine, name, threads)
+    for name in ("__init__", "execute_semantic_search", "execute_semantic_search_batch"):
+        record_threads(monkeypatch, LocalSemanticSearch, name, threads)
+
+    status, _, chunks = asgi_client("POST", "/search", {"query": "knee arthroplasty infection"})
+    assert status == 200
+    hit = json.loads(b"".join(chunks))["results"][0]
+    assert json.loads(b"".join(chunks))["engine"] == "local"
+
+    status, _, chunks = asgi_client("GET", f"/document/{hit['id']}")
+    assert status == 200
+    assert json.loads(b"".join(chunks))["title"] == hit["source"]["title"]
+
+    status, _, _ = asgi_client("GET", "/facets")
+    assert status == 200
+    status, _, chunks = asgi_client("POST", "/search/batch", {"queries": ["hip", "knee pain"]})
+    assert status == 200 and len(chunks) == 2
+
+    # The test's own thread runs the event loop
+    assert threads and threading.get_ident() not in threads
@@ -0,0 +1,16 @@
+import asyncio
+
+from elastic_transport import HttpxAsyncHttpNode
+
+from elasticsearch_client import ElasticsearchClient
+
+
+def test_async_client_uses_an_installed_http_library(monkeypatch):
+    monkeypatch.setattr(ElasticsearchClient, "_async_client", None)
+    client = ElasticsearchClient.get_async_client()
+    try:
+        nodes = client.transport.node_pool.all()
+        assert nodes and all(isinstance(node, HttpxAsyncHttpNode) for node in nodes)
+        assert ElasticsearchClient.get_async_client() is client
+    finally:
+        asyncio.run(client.close())
@@ -0,0 +1,144 @@
+import os
+import re
+
+import numpy as np
+
+from benchmarks.fixtures import synthetic_documents
+from config.config import INDEX_ALIAS
+from elasticsearch_client import ElasticsearchClient
+from indexing.elasticsearch_index import ElasticsearchIndex, current_index
+from indexing.pipeline import Checkpoint, IndexingPipeline
+from search.semantic import SemanticSearch
+from search.vector_store import VectorStore
+
+from conftest import create_index, write_documents
+
+
+def indexed_counts(output):
+    """
+    Returns:
+        tuple: (indexed, unchanged) from the summary line of create-index.
+    """
+    match = re.search(r"Successfully indexed (\d+) documents into index: \S+ \((\d+) unchanged\)", output)
+    return int(match.group(1)), int(match.group(2))
+
+
+def prf_vector(search, doc_id):
+    # Only the id and the expansion terms of a PRF hit are read
+    _, vectors, missing = search.read_prf_hits([{"_id": doc_id, "_source": {"expansion_terms": []}}])
+    assert not missing
+    return vectors[0]
+
+
+def test_reindexing_skips_unchanged_documents(indexed, documents):
+    assert indexed_counts(create_index(documents)) == (0, 60)
+
+
+def test_in_place_update_reaches_searches(indexed, tmp_path):
+    docs = list(synthetic_documents(60))
+    doc_id = ElasticsearchIndex.document_id(docs[5])
+    search = SemanticSearch(ElasticsearchClient.get_client(), INDEX_ALIAS)
+    before = prf_vector(search, doc_id)
+
+    docs[5] = dict(docs[5], abstract="revision arthroplasty for periprosthetic infection")
+    assert indexed_counts(create_index(write_documents(tmp_path / "updated.ndjson", docs))) == (1, 59)
+
+    after = prf_vector(search, doc_id)
+    assert not np.allclose(before, after)
+    fresh = VectorStore(search.vector_store.path)
+    assert np.allclose(after, fresh.get("biobert_embedding", [doc_id])[0][0])
+    source = ElasticsearchClient.get_client().get(index=INDEX_ALIAS, id=doc_id)["_source"]
+    assert source["abstract"] == docs[5]["abstract"]
+
+
+def test_rebuild_swaps_alias_and_vector_store(indexed, documents):
+    es = ElasticsearchClient.get_client()
+    old_index = current_index(es, INDEX_ALIAS)
+    search = SemanticSearch(es, INDEX_ALIAS)
+    old_store = os.path.realpath(search.vector_store.path)
+    generation = search.vector_store.generation
+    doc_id = ElasticsearchIndex.document_id(next(synthetic_documents(1)))
+    before = prf_vector(search, doc_id)
+
+    assert indexed_counts(create_index(documents, "--rebuild")) == (60, 0)
+
+    new_index = current_index(es, INDEX_ALIAS)
+    assert new_index != old_index
+    assert not es.indices.exists(index=old_index)
+    assert not os.path.exists(old_store)
+    # The searcher opened before the swap reads the new store
+    assert np.allclose(prf_vector(search, doc_id), before)
+    assert search.vector_store.generation == generation + 1
+    assert os.path.realpath(search.vector_store.path) != old_store
+
+
+def fail_document(monkeypatch, doc_id):
+    bulk = IndexingPipeline._bulk
+
+    def failing_bulk(self, actions):
+        for ok, item in bulk(self, actions):
+            yield ok and item["index"]["_id"] != doc_id, item
+
+    monkeypatch.setattr(IndexingPipeline, "_bulk", failing_bulk)
+    return bulk
+
+
+def test_checkpoint_stops_at_the_first_failure(cluster, documents, monkeypatch):
+    failing_id = ElasticsearchIndex.document_id(list(synthetic_documents(60))[23])
+    bulk = fail_document(monkeypatch, failing_id)
+    output = create_index(documents, "--chunk-size", "10")
+    assert '"failed": 1' in output
+    # Documents after the failed one were acknowledged, but are not checkpointed
+    checkpoint = Checkpoint(documents + ".checkpoint")
+    assert checkpoint.done == 23
+    # The incomplete first build does not go live
+    es = ElasticsearchClient.get_client()
+    assert current_index(es, INDEX_ALIAS) is None and es.indices.exists(index=checkpoint.index_name)
+
+    monkeypatch.setattr(IndexingPipeline, "_bulk", bulk)
+    output = create_index(documents, "--chunk-size", "10")
+    assert "Resuming after 23 already indexed documents." in output
+    assert indexed_counts(output) == (37, 0)
+    assert current_index(es, INDEX_ALIAS) == checkpoint.index_name
+    assert Checkpoint(documents + ".checkpoint").done == 0
+    assert VectorStore.shared().row(failing_id) is not None
+
+
+def test_failed_rebuild_keeps_the_live_index(indexed, documents, monkeypatch):
+    es = ElasticsearchClient.get_client()
+    old_index = current_index(es, INDEX_ALIAS)
+    search = SemanticSearch(es, INDEX_ALIAS)
+    old_store = os.path.realpath(search.vector_store.path)
+    failing_id = ElasticsearchIndex.document_id(list(synthetic_documents(60))[40])
+
+    bulk = fail_document(monkeypatch, failing_id)
+    output = create_index(documents, "--rebuild")
+    assert f"alias '{INDEX_ALIAS}' still points to {old_index}" in output
+    new_index = Checkpoint(documents + ".checkpoint").index_name
+    assert new_index != old_index and es.indices.exists(index=new_index)
+    assert current_index(es, INDEX_ALIAS) == old_index
+    assert os.path.realpath(search.vector_store.path) == old_store
+    assert search.vector_store.row(failing_id) is not None
+    assert es.search(index=INDEX_ALIAS, size=0, track_total_hits=True)["hits"]["total"]["value"] == 60
+
+    # Resumed without failures, the rebuild goes live and replaces the old index
+    monkeypatch.setattr(IndexingPipeline, "_bulk", bulk)
+    assert indexed_counts(create_index(documents, "--rebuild")) == (20, 0)
+    assert current_index(es, INDEX_ALIAS) == new_index
+    assert not es.indices.exists(index=old_index) and not os.path.exists(old_store)
+    search.vector_store.sync()
+    assert search.vector_store.row(failing_id) is not None
+
+
+def test_repeated_ids_are_all_acknowledged(indexed, tmp_path):
+    docs = list(synthetic_documents(60))
+    first = dict(docs[1], abstract="knee arthroplasty outcomes")
+    second = dict(docs[1], abstract="hip arthroplasty outcomes")
+    doc_id = ElasticsearchIndex.document_id(first)
+    path = write_documents(tmp_path / "repeated.ndjson", [docs[0], first, docs[2], docs[3], second] + docs[4:])
+
+    assert indexed_counts(create_index(path)) == (2, 59)
+    assert Checkpoint(path + ".checkpoint").done == 0
+    store = VectorStore(VectorStore.shared().path)
+    assert len(store) == 62
+    assert store.source(store.row(doc_id))["abstract"] == second["abstract"]
@@ -0,0 +1,36 @@
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client.parser import text_string_to_metric_families
+
+from monitoring.metrics import STAGE_SECONDS, request_timing, snapshot, stage
+
+
+def samples(text):
+    return {(sample.name, tuple(sorted(sample.labels.items()))): sample.value
+            for family in text_string_to_metric_families(text) for sample in family.samples}
+
+
+def test_stage_is_observed_and_timed_per_request():
+    before = snapshot(STAGE_SECONDS, operation="test", stage="step")["count"]
+    with request_timing() as timing:
+        with stage("test", "step"):
+            pass
+    assert snapshot(STAGE_SECONDS, operation="test", stage="step")["count"] == before + 1
+    assert [name for name, _ in timing.stages] == ["step"]
+    assert timing.header().startswith("step;dur=")
+
+
+def test_metrics_endpoints_render_the_prometheus_format(indexed, asgi_client):
+    import app
+
+    client = app.app.test_client()
+    client.post("/search", json={"query": "knee arthroplasty"})
+    response = client.get("/metrics")
+    assert response.status_code == 200 and response.headers["Content-Type"] == CONTENT_TYPE_LATEST
+    flask_samples = samples(response.get_data(as_text=True))
+    key = ("pubmed_stage_seconds_count", (("operation", "search"), ("stage", "total")))
+    assert flask_samples[key] >= 1
+    assert flask_samples[("pubmed_model_calls_total", (("model", "biobert"),))] >= 1
+
+    status, headers, chunks = asgi_client("GET", "/metrics")
+    assert status == 200 and headers[b"content-type"] == CONTENT_TYPE_LATEST.encode("ascii")
+    assert samples(b"".join(chunks).decode("utf-8"))[key] == flask_samples[key]
@@ -0,0 +1,134 @@
+import json
+import time
+
+import pytest
+
+from benchmarks.fixtures import synthetic_documents, synthetic_queries
+from config.config import INDEX_ALIAS
+from search.index_state import IndexState
+from search.result_cache import ResultCache, SqliteResultStore, normalise_query
+from search.semantic import SemanticSearch
+
+from conftest import create_index, write_documents
+
+QUERIES = synthetic_queries(4)
+
+
+@pytest.fixture
+def client():
+    import app
+
+    return app.app.test_client()
+
+
+def search(client, query, **params):
+    return client.post("/search", json=dict(params, query=query)).get_json()
+
+
+def ranking(result):
+    return [(hit["id"], round(hit["score"], 5)) for hit in result["results"]]
+
+
+def test_normalise_query_keeps_case():
+    assert normalise_query("  TKA   infection\n") == "TKA infection"
+    assert normalise_query("TKA") != normalise_query("tka")
+
+
+def test_ram_tier_is_bounded_and_expires():
+    cache = ResultCache(ram_entries=2, ttl=0.2)
+    for key in ("a", "b", "c"):
+        cache.put("results", key, key)
+    assert cache.get("results", "a") == (None, None)
+    assert cache.get("results", "c") == ("c", "ram")
+    time.sleep(0.3)
+    assert cache.get("results", "c") == (None, None)
+
+
+def test_shared_tier_is_read_by_other_workers(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    ResultCache(8, 600, SqliteResultStore(path)).put("results", "key", {"response": 1})
+    other = ResultCache(8, 600, SqliteResultStore(path))
+    assert other.get("results", "key") == ({"response": 1}, "shared")
+    assert other.get("results", "key") == ({"response": 1}, "ram")
+
+
+def test_shared_tier_errors_are_misses():
+    class BrokenStore:
+        def get(self, key):
+            raise OSError("unreachable")
+
+        def put(self, key, data, ttl):
+            raise OSError("unreachable")
+
+    cache = ResultCache(8, 600, BrokenStore())
+    cache.put("results", "key", 1)
+    assert cache.get("results", "other") == (None, None)
+    assert cache.get("results", "key") == (1, "ram")
+    assert cache.stats()["shared_errors"] == 2
+
+
+def test_repeated_search_is_answered_from_the_cache(indexed, client):
+    miss = search(client, QUERIES[0])
+    indexed.requests.clear()
+    hit = search(client, "  " + QUERIES[0].replace(" ", "   "))
+    assert "cache" not in miss["prf_stats"] and hit["prf_stats"]["cache"] == "ram"
+    assert ranking(hit) == ranking(miss) and hit["agg_data"] == miss["agg_data"]
+    assert not any(key.endswith("_search") for key in indexed.requests)
+
+    # Another mode reuses the cached query vectors and only runs the final query
+    exact = search(client, QUERIES[0], mode="exact")
+    assert exact["prf_stats"]["cache"] == "ram"
+    assert indexed.requests["POST {index}/_search"] == 1
+
+
+def test_index_version_change_misses(indexed, client, tmp_path):
+    first = search(client, QUERIES[0])
+    version = IndexState.shared(INDEX_ALIAS).version
+
+    docs = list(synthetic_documents(60))
+    docs[0] = dict(docs[0], abstract="periprosthetic infection after revision arthroplasty")
+    create_index(write_documents(tmp_path / "updated.ndjson", docs))
+    after_update = search(client, QUERIES[0])
+    assert IndexState.shared(INDEX_ALIAS).version != version
+    assert "cache" not in after_update["prf_stats"]
+
+    create_index(write_documents(tmp_path / "updated.ndjson", docs), "--rebuild")
+    after_rebuild = search(client, QUERIES[0])
+    assert "cache" not in after_rebuild["prf_stats"]
+    assert search(client, QUERIES[0])["prf_stats"]["cache"] == "ram"
+    # Same documents, rebuilt: same results under a new version
+    assert first["results"] and ranking(after_rebuild) == ranking(after_update)
+
+
+def test_batch_mixes_cached_and_searched_queries(indexed, client):
+    search(client, QUERIES[1])
+    response = client.post("/search/batch", json={"queries": QUERIES})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line["query"] for line in lines] == QUERIES
+    assert [line["prf_stats"].get("cache") for line in lines] == [None, "ram", None, None]
+    assert [ranking(line) for line in lines] == [ranking(search(client, query)) for query in QUERIES]
+
+    response = client.post("/search/batch", json={"queries": QUERIES})
+    assert all(json.loads(line)["prf_stats"]["cache"] == "ram"
+               for line in response.get_data(as_text=True).splitlines())
+
+
+def test_failed_batch_queries_are_not_cached(indexed, client, monkeypatch):
+    msearch = SemanticSearch.msearch
+
+    def failing_first_final_query(self, bodies):
+        response = msearch(self, bodies)
+        if "expansion_terms" not in json.dumps(bodies[0].get("_source", [])):
+            # Final queries, not PRF ones: the first fails on its shard
+            response.body["responses"][0] = {"error": {"type": "search_phase_execution_exception"},
+                                             "status": 503}
+        return response
+
+    monkeypatch.setattr(SemanticSearch, "msearch", failing_first_final_query)
+    response = client.post("/search/batch", json={"queries": QUERIES[:2]})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines[0]["status"] == 503 and "results" in lines[1]
+
+    monkeypatch.setattr(SemanticSearch, "msearch", msearch)
+    assert "cache" not in search(client, QUERIES[0])["prf_stats"]
+    assert search(client, QUERIES[1])["prf_stats"]["cache"] == "ram"
@@ -0,0 +1,101 @@
+import json
+import threading
+
+import pytest
+
+import search.result_cache
+import search.semantic
+
+from benchmarks.fixtures import synthetic_queries
+from config.config import INDEX_ALIAS
+from elasticsearch_client import ElasticsearchClient
+from search.result_cache import ResultCache
+from search.semantic import SemanticSearch
+
+QUERIES = synthetic_queries(7)
+
+
+@pytest.fixture
+def uncached(indexed, monkeypatch):
+    # Single and batch searches must both reach Elasticsearch
+    monkeypatch.setattr(search.result_cache, "RESULT_CACHE_ENABLED", False)
+    monkeypatch.setattr(ResultCache, "_shared", None)
+    # Three final _msearch requests for the seven queries
+    monkeypatch.setattr(search.semantic, "SEARCH_BATCH_STREAM_CHUNK", 3)
+    return indexed
+
+
+@pytest.fixture
+def client():
+    import app
+
+    return app.app.test_client()
+
+
+def ranking(result):
+    return [(hit["id"], round(hit["score"], 5)) for hit in result["results"]]
+
+
+@pytest.mark.parametrize("mode", ["ann", "exact"])
+def test_batch_results_equal_single_results(uncached, client, mode):
+    single = [client.post("/search", json={"query": query, "mode": mode}).get_json() for query in QUERIES]
+    uncached.requests.clear()
+    response = client.post("/search/batch", json={"queries": QUERIES, "mode": mode})
+    assert response.status_code == 200 and response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    # One PRF _msearch, then one per chunk of final queries
+    assert uncached.requests["POST _msearch"] == 4
+    assert [line["query"] for line in lines] == QUERIES
+    for expected, line in zip(single, lines):
+        assert ranking(line) == ranking(expected)
+        assert line["agg_data"] == expected["agg_data"]
+        assert line["total_results"] == expected["total_results"]
+        assert line["prf_stats"]["batch_size"] == len(QUERIES)
+
+
+def test_asgi_batch_results_equal_single_results(uncached, asgi_client):
+    single = [json.loads(b"".join(asgi_client("POST", "/search", {"query": query})[2])) for query in QUERIES]
+    status, headers, chunks = asgi_client("POST", "/search/batch", {"queries": QUERIES})
+    assert status == 200 and headers[b"content-type"] == b"application/x-ndjson"
+    # One body message per query
+    lines = [json.loads(chunk) for chunk in chunks]
+    assert [ranking(line) for line in lines] == [ranking(expected) for expected in single]
+
+
+def test_first_results_stream_before_the_last_request_returns(uncached, monkeypatch):
+    search = SemanticSearch(ElasticsearchClient.get_client(), INDEX_ALIAS)
+    msearch = search.msearch
+    release = threading.Event()
+
+    def slow_last_chunk(bodies):
+        if len(bodies) == 1:
+            # The last chunk holds the seventh query alone
+            assert release.wait(10)
+        return msearch(bodies)
+
+    monkeypatch.setattr(search, "msearch", slow_last_chunk)
+    items = search.execute_semantic_search_batch(QUERIES)
+    first = [next(items) for _ in range(6)]
+    assert not release.is_set()
+    release.set()
+    assert [item[0] for item in first + list(items)] == QUERIES
+
+
+def test_failed_request_after_the_first_line_fails_the_queries_left(uncached, client, monkeypatch):
+    # Final queries in a chunk of four, then one of three
+    monkeypatch.setattr(search.semantic, "SEARCH_BATCH_STREAM_CHUNK", 4)
+    msearch = SemanticSearch.msearch
+
+    def failing_last_chunk(self, bodies):
+        if len(bodies) == 3:
+            raise ConnectionError("cluster went away")
+        return msearch(self, bodies)
+
+    monkeypatch.setattr(SemanticSearch, "msearch", failing_last_chunk)
+    response = client.post("/search/batch", json={"queries": QUERIES})
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line["query"] for line in lines] == QUERIES
+    assert ["error" in line for line in lines] == [False] * 4 + [True] * 3
+    assert lines[4] == {"query": QUERIES[4], "error": "cluster went away", "status": 500}
@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+
+from config.config import SERVER_MAX_STARTUP_FAILURES
+
+from test_metrics import samples
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code):
+    """
+    Run `code` in a fresh interpreter from api/: serve.py must set up the
+    metrics directory before prometheus_client is first imported.
+
+    Returns:
+        str: Its standard output.
+    """
+    env = {key: value for key, value in os.environ.items() if key != "PROMETHEUS_MULTIPROC_DIR"}
+    result = subprocess.run([sys.executable, "-c", code], cwd=API_DIR, env=env, capture_output=True,
+                            text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+def test_metrics_are_summed_over_workers(tmp_path):
+    metrics_dir = tmp_path / "prometheus"
+    metrics_dir.mkdir()
+    (metrics_dir / "counter_1.db").write_bytes(b"left by a previous run")
+    output = run_python(f"""
+import os
+import serve
+
+serve.prepare_metrics_dir({str(metrics_dir)!r})
+from monitoring import metrics
+
+master = serve.Master(None, None, 2, 1)
+metrics.count_model_call("biobert", 1)
+for _ in range(2):
+    pid = os.fork()
+    if pid == 0:
+        metrics.count_model_call("biobert", 2)
+        os._exit(0)
+    os.waitpid(pid, 0)
+    master.exited(pid)
+print(metrics.exposition().decode("utf-8"))
+""")
+    exposed = samples(output)
+    assert exposed[("pubmed_model_calls_total", (("model", "biobert"),))] == 3
+    assert exposed[("pubmed_model_inputs_total", (("model", "biobert"),))] == 5
+
+
+def test_master_stops_when_workers_keep_dying_during_startup():
+    output = run_python("""
+import os
+import socket
+import serve
+
+serve.SERVER_RESTART_DELAY = 0.01
+serve.run_worker = lambda *args: os._exit(3)
+master = serve.Master(None, socket.create_server(("127.0.0.1", 0)), 2, 1)
+print("healthy:", master.run(), "workers:", len(master.pids))
+""")
+    # Both first workers die; their replacement is retried with a doubling delay, then the master gives up
+    assert output.count("during startup.") == 2 + SERVER_MAX_STARTUP_FAILURES
+    assert "Starting a new worker in 0.01s." in output and "Starting a new worker in 0.02s." in output
+    assert "Serving on" not in output
+    assert output.strip().endswith("healthy: False workers: 0")
+
@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+import pytest
+
+from search.vector_store import VectorStore, VectorStoreWriter, build_path, publish_store
+
+DIM = 4
+
+
+def vectors(value):
+    return {"biobert_embedding": np.full(DIM, value), "title_embedding": np.full(DIM, -value)}
+
+
+def write(path, rows, reset=False):
+    writer = VectorStoreWriter(path, dim=DIM, reset=reset, sources=True)
+    for doc_id, value in rows:
+        writer.add(doc_id, vectors(value), {"title": f"{doc_id} v{value}"})
+    writer.flush()
+
+
+def stored(store, doc_id):
+    return store.get("biobert_embedding", [doc_id])[0][0][0]
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    path = str(tmp_path / "vectors")
+    version = build_path(path, "v1")
+    write(version, [("a", 1), ("b", 2)])
+    publish_store(path, version)
+    return path
+
+
+def test_appended_rows_are_read(store_path):
+    store = VectorStore(store_path)
+    write(os.path.realpath(store_path), [("c", 3)])
+    vector, missing = store.get("biobert_embedding", ["c", "x"])
+    assert vector[0][0] == 3 and missing == ["x"]
+    assert store.source(store.row("c")) == {"title": "c v3"}
+
+
+def test_sync_picks_up_an_in_place_update(store_path):
+    store = VectorStore(store_path)
+    write(os.path.realpath(store_path), [("a", 10)])
+    # The id is known, so a lookup alone does not look for new rows
+    assert stored(store, "a") == 1
+    store.sync()
+    assert stored(store, "a") == 10
+    assert store.source(store.row("a")) == {"title": "a v10"}
+    assert list(store.superseded) == [0]
+
+
+def test_sync_picks_up_a_rebuild_swap(store_path):
+    store = VectorStore(store_path)
+    generation = store.generation
+    old = os.path.realpath(store_path)
+    version = build_path(store_path, "v2")
+    write(version, [("b", 20), ("d", 40)])
+    assert publish_store(store_path, version) == old
+    os.rename(old, old + ".deleted")
+
+    store.sync()
+    assert store.generation == generation + 1
+    assert store.ids == ["b", "d"]
+    assert stored(store, "b") == 20
+    assert store.get("biobert_embedding", ["a"])[1] == ["a"]
+
+
+def test_sync_does_nothing_when_unchanged(store_path, monkeypatch):
+    store = VectorStore(store_path)
+    refreshes = []
+    monkeypatch.setattr(store, "refresh", lambda: refreshes.append(1))
+    store.sync()
+    assert not refreshes
+    write(os.path.realpath(store_path), [("c", 3)])
+    store.sync()
+    assert refreshes == [1]
+
+
+def test_writer_drops_an_incomplete_flush(store_path):
+    path = os.path.realpath(store_path)
+    with open(os.path.join(path, "ids.txt"), "a") as f:
+        f.write("half-writ")
+    with open(os.path.join(path, "biobert_embedding.bin"), "ab") as f:
+        f.write(np.ones(DIM, dtype=np.float32).tobytes())
+    write(path, [("c", 3)])
+    store = VectorStore(store_path)
+    assert store.ids == ["a", "b", "c"]
+    assert stored(store, "c") == 3